@@ -0,0 +1,48 @@
+"""Index of allosmod commands, used by the allosmod dispatcher.
+
+This file is generated by allosmod.util.commands; do not edit.
+"""
+
+commands = {
+    'bin_data': 'Bin data from a file.',
+    'contpres': 'Get all residues involved in charge contacts.',
+    'count_alignments': 'Count the number of alignments per residue.',
+    'edit_restraints': 'Create AllosMod-specific restraints',
+    'get_add_restraint': 'Generate Modeller distance restraints.',
+    'get_allosteric_site':
+        'Get the allosteric site (all residues near the ligand)',
+    'get_auto_align': 'Suggest an alignment of target with templates.',
+    'get_contacts': 'Make a list of all residues in contact.',
+    'get_glyc_restraint':
+        'Make Modeller restraints between protein and sugars.',
+    'get_inter_contacts':
+        'Make a list of all contacts between two structures.',
+    'get_loopadjres': 'Strengthen residues adjacent to loops',
+    'get_pm_glyc': 'Generate Modeller inputs to model with glycosylation',
+    'get_pm_initialstruct':
+        'Make initial perturbation model (PM) from sequence.',
+    'get_q_ca': 'Calculate q for CA atoms.',
+    'get_qi_trajectory':
+        'Calculate Qi and Q for every snapshot of one or more simulations.',
+    'get_qiavg_ca': 'Calculate qiavg for CA atoms.',
+    'get_qmatrix': 'Calculate q matrix for given proteins.',
+    'get_rest': 'Generate Modeller restraints for glycosylation.',
+    'get_ss': 'Get secondary structure with DSSP.',
+    'getavgpdb': 'Make a PDB file by averaging two others',
+    'getcofm': 'Get the center of mass of a PDB file',
+    'getrofg': 'Get the radius of gyration of a PDB file',
+    'make_mod_inputs': 'Make input files for Modeller.',
+    'make_pm_script': 'Make a script to generate perturbation models (PM).',
+    'min_rmsd': 'Get RMSD between two structures.',
+    'pdb2ali': 'Convert a PDB file to a Modeller alignment file.',
+    'pdb_fix_res': 'Modify PDB residues that Modeller cannot recognize.',
+    'placepdbs':
+        'Randomly rotate a set of PDB files and place them on a lattice',
+    'rotatepdb': 'Rotate a PDB file',
+    'salign0': 'Structurally align two PDBs using SALIGN.',
+    'setchain': 'Set the chain ID on a PDB file.',
+    'setup': 'Check inputs and do initial setup.',
+    'spline': 'Convert restraints into splines.',
+    'translatepdb': 'Translate a PDB file',
+    'worker': 'Run a persistent worker to speed up other allosmod commands.',
+}
@@ -1,19 +1,41 @@
 """Get all residues involved in charge contacts."""
 
-import modeller
 import math
+import numpy as np
 import allosmod.util
+from allosmod.util.restraints import RestraintStore
+from allosmod.util.snapshot import get_model_snapshot
 
 
 charged_residues = dict.fromkeys(('ARG', 'HIS', 'LYS', 'HSD', 'HSE',
                                   'HSP', 'HID', 'HIE', 'HIP', 'ASP', 'GLU'))
 
 
+def get_restrained_atom_indices(rsr_file):
+    """Get the 1-based indices of the pairs of atoms restrained by all
+       two-atom, non-bond restraints (with at least one parameter) in the
+       named restraints file (or binary cache), as two arrays"""
+    # The file is only read once, so no cache is written
+    store = RestraintStore.read_file(rsr_file, cache=False)
+    nparam = np.diff(store.params_start)
+    # Count parameters kept as text
+    spaces = np.zeros(len(store.text) + 1, dtype=np.int64)
+    np.cumsum(store.text == ord(' '), out=spaces[1:])
+    ntext = np.diff(spaces[store.text_start]) + (np.diff(store.text_start) > 0)
+    ind = np.flatnonzero((store.natom == 2) & (store.group != 1)
+                         & (nparam + ntext > 0))
+    first = store.atoms_start[ind]
+    return store.atoms[first], store.atoms[first + 1]
+
+
 def get_restrained_atoms(mdl, rsr_file):
-    for line in rsr_file:
-        spl = line.split()
-        if len(spl) > 10 and spl[5] == '2' and spl[4] != '1':
-            yield mdl.atoms[int(spl[8])-1], mdl.atoms[int(spl[9])-1]
+    """Yield the pairs of atoms restrained by all two-atom, non-bond
+       restraints (with at least one parameter) in the named restraints
+       file (or binary cache)"""
+    atoms = mdl.atoms
+    ai, aj = get_restrained_atom_indices(rsr_file)
+    for i, j in zip(ai.tolist(), aj.tolist()):
+        yield atoms[i - 1], atoms[j - 1]
 
 
 def charged_ca_pair(a1, a2):
@@ -27,20 +49,22 @@ class ChargedContactFinder:
         self.env, self.rsr_file, self.pdb_file = env, rsr_file, pdb_file
 
     def find(self):
-        m = self._m = modeller.Model(self.env, file=self.pdb_file)
-        charge = [0] * len(m.residues)
-        total = [0] * len(m.residues)
-        for a1, a2 in get_restrained_atoms(m, open(self.rsr_file)):
-            r1 = a1.residue.index - 1
-            r2 = a2.residue.index - 1
-            total[r1] += 1
-            total[r2] += 1
-            if charged_ca_pair(a1, a2):
-                charge[r1] += 1
-                charge[r2] += 1
-        self._total = total
+        m = self._m = get_model_snapshot(self.env, self.pdb_file)
+        nres = len(m.residue_name)
+        ai, aj = get_restrained_atom_indices(self.rsr_file)
+        r1 = m.atom_residue[ai - 1]
+        r2 = m.atom_residue[aj - 1]
+        charged = np.isin(m.residue_name, list(charged_residues))
+        is_ca = m.atom_name == 'CA'
+        charge_pair = (is_ca[ai - 1] & is_ca[aj - 1]
+                       & charged[r1] & charged[r2])
+        total = (np.bincount(r1, minlength=nres)
+                 + np.bincount(r2, minlength=nres))
+        charge = (np.bincount(r1[charge_pair], minlength=nres)
+                  + np.bincount(r2[charge_pair], minlength=nres))
+        self._total = total.tolist()
         self._contacts = []
-        for n, z in enumerate(zip(charge, total)):
+        for n, z in enumerate(zip(charge.tolist(), self._total)):
             c, t = z
             self._contacts.append((n+1, c if t > 143 else 0))
 
@@ -50,7 +74,7 @@ class ChargedContactFinder:
 
     def print_all_buried(self, sclbreak, fh):
         for n, c in enumerate(self._total):
-            if c > 143 and self._m.residues[n].pdb_name in charged_residues:
+            if c > 143 and self._m.residue_name[n] in charged_residues:
                 print("%d %s" % (n+1, sclbreak), file=fh)
 
     def print_cdensity(self, cutoff, sclbreak, fh):
@@ -74,6 +98,8 @@ Output all residues from <PDB file> that are involved in charge contacts
 (as specified by <restraint file>). Charged residues will also be output
 to break.dat (with the given <sclbreak> scale factor).
 
+<restraint file> can be a Modeller restraints file or a binary cache of one.
+
 Note that residue indices (starting from 1) are used, not PDB residue numbers.
 """
     parser = allosmod.util.ModellerOptionParser(usage)
@@ -92,9 +118,8 @@ Note that residue indices (starting from 1) are used, not PDB residue numbers.
 
 def main():
     rsr_file, pdb_file, sclbreak, opts = parse_args()
-    e = modeller.Environ()
-    e.io.hetatm = True
-    a = ChargedContactFinder(e, rsr_file, pdb_file)
+    # Modeller is only needed if the PDB file cannot be read directly
+    a = ChargedContactFinder(None, rsr_file, pdb_file)
     a.find()
     a.print_contacts(open('contpres.dat', 'w'))
     if opts.cdensity_cutoff is not None:
@@ -1,10 +1,23 @@
 """Create AllosMod-specific restraints"""
 
-import modeller
 import sys
+import os
+import io
+import contextlib
+import collections
+import json
+import multiprocessing
+import numpy as np
 import allosmod.util
 import allosmod.get_contacts
 import allosmod.get_ss
+from allosmod.util.restraints import RestraintStore, RestraintBuffer
+from allosmod.util.restraints import LineBuffer
+from allosmod.util.restraints import ragged_index, split_range
+from allosmod.util.restraints import CACHE_SUFFIX, is_cache_file
+from allosmod.util.restraints import CacheWriter, HashingReader
+from allosmod.util.cache import ResultCache, get_file_hash
+from allosmod.util.snapshot import get_model_snapshot
 
 
 class Sigmas:
@@ -39,6 +52,39 @@ class Sigmas:
         else:  # interface
             return self.sig_inter*sig_scale
 
+    def get_array(self, isSC1, isSC2, isAS1, isAS2):
+        """Vectorized version of get(), given boolean arrays of the
+           properties of the first and second atom in each restraint"""
+        sig_scale = np.where(~isSC1 & ~isSC2, 1.0,
+                             np.where(isSC1 != isSC2, 1.5, 1.5*1.5))
+        if self.ntotal == 1:
+            sig_AS = self.sig_AS*sig_scale
+        else:
+            sig_AS = np.full(len(sig_scale), self.sig_AS)
+        return np.where(isAS1 & isAS2, sig_AS,
+                        np.where(~isAS1 & ~isAS2, self.sig_RS*sig_scale,
+                                 self.sig_inter*sig_scale))
+
+
+#: One point in a parameter sweep (see RestraintEditor.sweep())
+SweepPoint = collections.namedtuple(
+    'SweepPoint', ['output', 'delEmax', 'sig_AS', 'sig_RS', 'sig_inter'])
+
+
+def parse_sweep_file(fh):
+    """Read a parameter sweep, one SweepPoint per line. Each line lists the
+       output file name, delEmax, sigma_AS, sigma_RS and sigma_inter.
+       Blank lines and those starting with # are ignored."""
+    for num, line in enumerate(fh):
+        spl = line.split()
+        if not spl or spl[0].startswith('#'):
+            continue
+        if len(spl) != len(SweepPoint._fields):
+            raise allosmod.util.FileFormatError(
+                "Invalid sweep line %d (expecting %d fields): %s"
+                % (num + 1, len(SweepPoint._fields), line))
+        yield SweepPoint(spl[0], *[float(x) for x in spl[1:]])
+
 
 class TruncatedGaussianParameters:
     def __init__(self, delEmax, delEmaxNUC, slope, scl_delx, breaks):
@@ -60,228 +106,149 @@ class TruncatedGaussianParameters:
         else:
             return self.delEmax * 10.0 if local else self.delEmax
 
-
-class Restraint:
-    def __init__(self, line, atoms):
-        self.line = line
-        spl = line.split()
-        self.form = int(spl[1])
-        self.modal = int(spl[2])
-        self.feat = int(spl[3])
-        self.group = int(spl[4])
-        natom = int(spl[5])
-        self.nparam = int(spl[6])
-        self.nfeat = int(spl[7])
-        ind = 7 + min(self.nfeat, 1)
-        self.atoms = [atoms[int(i)-1] for i in spl[ind:ind+natom]]
-        self.handle_parameters(spl[ind+natom:])
-
-    def handle_parameters(self, params):
-        raise ValueError("Could not handle %d" % self.form)
-
-    def write(self, fh=sys.stdout):
-        fh.write('R %4d %3d %3d %3d %3d %3d %3d '
-                 % (self.form, self.modal, self.feat, self.group,
-                    len(self.atoms), self.nparam, 1))
-        fh.write(' '.join('%5d' % x.a.index for x in self.atoms))
-        fh.write('    ')
-        self.write_parameters(fh)
-        fh.write('\n')
-
-    def is_intrahet(self):
-        """Return True iff all atoms in this restraint are HETATM"""
-        for a in self.atoms:
-            if not a.a.residue.hetatm:
-                return False
-        return True
-
-    def is_ca_cb_interaction(self):
-        for a in self.atoms:
-            if not a.isNUC and not a.isCA and not a.isCB:
-                return False
-        return True
-
-    def is_sidechain_sidechain_interaction(self):
-        for a in self.atoms:
-            if not a.isSC and not a.isCB:
-                return False
-        return True
-
-    def is_beta_beta_interaction(self, beta_structure):
-        for a in self.atoms:
-            if a.a.residue.index not in beta_structure:
-                return False
-        return True
-
-    def is_intra_protein_interaction(self):
-        for a in self.atoms:
-            if a.isNUC:
-                return False
-        return True
-
-    def is_intra_dna_interaction(self):
-        for a in self.atoms:
-            if not a.isNUC or not a.torestr:
-                return False
-        return True
-
-    def is_protein_dna_interaction(self):
-        dna = [a for a in self.atoms if a.isNUC]
-        if len(dna) == 0 or len(dna) == len(self.atoms):
-            return False
-        for a in dna:
-            if a.torestr:
-                return True
-        return False
-
-    def is_allosteric_interaction(self):
-        for a in self.atoms:
-            if not a.isAS:
-                return False
-        return True
-
-
-class GaussianRestraint(Restraint):
-    def handle_parameters(self, params):
-        self.mean = self.firstmean = float(params[0])
-        self.stdev = float(params[1])
-
-    def write_parameters(self, fh):
-        fh.write(' '.join('%9.4f' % x for x in (self.mean, self.stdev)))
-
-    def any_mean_below(self, threshold):
-        return self.mean < threshold
-
-    def rescale(self, scale):
-        self.stdev /= scale
-
-    def transform(self, tgparams, modal, stdev, truncated=True,
-                  local=False, nuc=False, fh=sys.stdout):
-        """Convert this restraint into a multigaussian, and write out"""
-        if truncated:
-            delE = tgparams.get_dele(self.atoms, local, nuc)
-            parameters = [delE, tgparams.slope, tgparams.scl_delx]
-        else:
-            parameters = []
-        parameters.extend([1.0/modal]*modal + [self.mean] * modal
-                          + [stdev]*modal)
-        fh.write('R %4d%4d%4d%4d%4d%4d%4d'
-                 % (50 if truncated else 4, modal, self.feat, self.group,
-                    len(self.atoms), len(parameters), 1))
-        fh.write(''.join('%6d' % x.a.index for x in self.atoms))
-        fh.write('    ')
-        fh.write(' '.join('%9.4f' % x for x in parameters))
-        fh.write('\n')
-
-
-class MultiGaussianRestraint(Restraint):
-    def handle_parameters(self, params):
-        self.weights = [float(x) for x in params[:self.modal]]
-        self.means = [float(x) for x in params[self.modal:self.modal*2]]
-        self.firstmean = self.means[0]
-        self.stdevs = [float(x) for x in params[self.modal*2:self.modal*3]]
-
-    def write_parameters(self, fh):
-        fh.write(' '.join('%9.4f' % x
-                          for x in self.weights + self.means + self.stdevs))
-
-    def any_mean_below(self, threshold):
-        for m in self.means:
-            if m < threshold:
-                return True
-        return False
-
-    def rescale(self, scale):
-        self.stdevs = [x / scale for x in self.stdevs]
-
-    def transform(self, tgparams, modal, stdev, truncated=True,
-                  local=False, nuc=False, fh=sys.stdout):
-        """Convert this restraint into a multigaussian, and write out"""
-        # Note that modal is ignored
-        modal = self.modal
-        if truncated:
-            delE = tgparams.get_dele(self.atoms, local, nuc)
-            parameters = [delE, tgparams.slope, tgparams.scl_delx]
-        else:
-            parameters = []
-        parameters.extend([1.0/modal]*modal + self.means + [stdev]*modal)
-        fh.write('R %4d%4d%4d%4d%4d%4d%4d'
-                 % (50 if truncated else 4, modal, self.feat, self.group,
-                    len(self.atoms), len(parameters), 1))
-        fh.write(''.join('%6d' % x.a.index for x in self.atoms))
-        fh.write('    ')
-        fh.write(' '.join('%9.4f' % x for x in parameters))
-        fh.write('\n')
-
-
-class CosineRestraint(Restraint):
-    def handle_parameters(self, params):
-        self.phase, self.force = [float(x) for x in params]
-
-    def write_parameters(self, fh):
-        fh.write(' '.join('%9.4f' % x for x in (self.phase, self.force)))
-
-    def rescale(self, scale):
-        self.force *= scale
-
-
-class BinormalRestraint(Restraint):
-    def handle_parameters(self, params):
-        # Keep as is
-        self._params = params
-
-    def write_parameters(self, fh):
-        fh.write(' '.join('%9s' % x for x in self._params))
-
-
-class SplineRestraint(Restraint):
-    def handle_parameters(self, params):
-        # Keep as is
-        self._params = params
-
-    def write_parameters(self, fh):
-        fh.write(' '.join('%9s' % x for x in self._params))
-
-
-def filter_rs_rs(atoms):
-    """Allow only RS-RS contacts"""
-    for atom in atoms:
-        if atom.isAS:
-            return False
-    return True
-
-
-def filter_not_rs_rs(atoms):
-    """Allow AS-AS and AS-RS contacts"""
-    natomRS = sum(0 if atom.isAS else 1 for atom in atoms)
-    return natomRS != len(atoms)
+    def get_dele_array(self, resinds, local, nuc):
+        """Vectorized version of get_dele(), given a list of arrays of
+           residue indices (one array for each atom in the restraints)
+           and boolean arrays for local and nuc"""
+        bscale = np.ones(len(local))
+        is_break = np.zeros(len(local), dtype=bool)
+        if self.breaks:
+            keys = np.array(sorted(self.breaks), dtype=np.int64)
+            scales = np.array([self.breaks[k] for k in keys.tolist()])
+            for ri in resinds:
+                ind = np.minimum(np.searchsorted(keys, ri), len(keys) - 1)
+                found = keys[ind] == ri
+                bscale = np.where(found, bscale * scales[ind], bscale)
+                is_break |= found
+        return np.where(nuc, self.delEmaxNUC,
+                        np.where(is_break, bscale * self.delEmax,
+                                 np.where(local, self.delEmax * 10.0,
+                                          self.delEmax)))
 
 
 def add_ca_boundary_restraints(atoms, fh=sys.stdout):
     """Add restraints to CA's enforce boundary conditions:
        cube soft boundary"""
-    for a in atoms:
-        if a.isCA:
-            for feat in range(9, 12):
-                for (form, mean) in ((2, 100.0), (1, -100.0)):
-                    fh.write('R %4d%4d%4d%4d%4d%4d%4d%6d    '
-                             '%9.4f %9.4f\n'
-                             % (form, 0, feat, 27, 1, 2, 1, a.a.index, mean,
-                                10.0))
-
-
-def parse_restraints_file(fh, atoms, filter=None):
-    restraint_from_form = {3: GaussianRestraint,
-                           4: MultiGaussianRestraint,
-                           7: CosineRestraint,
-                           9: BinormalRestraint,
-                           10: SplineRestraint}
-    for line in fh:
-        if line.startswith('R'):
-            typ, form, rest = line.split(None, 2)
-            r = restraint_from_form.get(int(form), Restraint)(line, atoms)
-            if filter is None or filter(r.atoms):
-                yield r
+    ca = np.array([a.a.index for a in atoms if a.isCA], dtype=np.float64)
+    # Six restraints per CA: upper and lower bounds on x, y and z
+    form = np.tile([2., 1.], 3 * len(ca))
+    feat = np.tile(np.repeat([9., 10., 11.], 2), len(ca))
+    mean = np.where(form == 2., 100.0, -100.0)
+    ones = np.ones(len(form))
+    lines = LineBuffer()
+    lines.add_rows(np.arange(len(form)),
+                   'R %4d%4d%4d%4d%4d%4d%4d%6d    %9.4f %9.4f\n',
+                   form, 0. * ones, feat, 27. * ones, ones, 2. * ones, ones,
+                   np.repeat(ca, 6), mean, 10. * ones)
+    fh.write(lines.getvalue())
+
+
+def mask_rs_rs(nAS):
+    """Allow only RS-RS contacts, given an array of the number of AS atoms
+       in each restraint"""
+    return nAS == 0
+
+
+def mask_not_rs_rs(nAS):
+    """Allow AS-AS and AS-RS contacts (see mask_rs_rs())"""
+    return nAS != 0
+
+
+# How each restraint is handled by RestraintEditor.classify()
+DROP = 0           # omit the restraint
+KEEP = 1           # write out as is
+KEEP_HET = 2       # intra-HET; rescale by HETscale, then write out
+LOCAL = 3          # local CA/CB restraint; truncated Gaussian, stdev 2.0
+MULTI_CONTACT = 4  # multi-Gaussian contact
+AS_TGAUSS = 5      # allosteric site contact, as truncated Gaussian
+AS_GAUSS = 6       # allosteric site contact, as Gaussian
+RS_CONTACT = 7     # regulated site or interface contact
+NUC_CONTACT = 8    # protein-nucleic acid contact
+DNA_CONTACT = 9    # intra-nucleic acid contact
+
+# Restraints written out as truncated Gaussians (if delEmax is nonzero);
+# these are counted for delEmax=CALC
+_TRUNCATED_CODES = (LOCAL, MULTI_CONTACT, AS_TGAUSS, RS_CONTACT, NUC_CONTACT)
+
+# Residue names ignored by get_calc_residue_counts()
+_CALC_NUCLEIC_ACIDS = frozenset(['ADE', '  A', ' DA', 'THY', '  T', ' DT',
+                                 'URA', '  U', ' DU', 'GUA', '  G', ' DG',
+                                 'CYT', '  C', ' DC'])
+
+# Restraint forms that we can handle: Gaussian, multi-Gaussian, cosine,
+# binormal and spline
+_KNOWN_FORMS = (3, 4, 7, 9, 10)
+
+# Version of the classification index file format (see
+# RestraintEditor.write_index)
+_INDEX_VERSION = 1
+
+# Bump if the output of get_template_contacts() changes, to invalidate
+# cached results
+_CONTACTS_CACHE_VERSION = 1
+
+
+def _check_store(store):
+    """Raise an error for any restraint in the store that we cannot
+       handle"""
+    form = store.form
+    unknown = ~np.isin(form, _KNOWN_FORMS)
+    if np.any(unknown):
+        raise ValueError("Could not handle %d" % form[np.argmax(unknown)])
+    nparam = np.diff(store.params_start)
+    bad = ((np.isin(form, (3, 4, 7)) & (np.diff(store.text_start) > 0))
+           | ((form == 3) & (nparam < 2))
+           | ((form == 4) & ((store.modal < 1) | (nparam <= store.modal)))
+           | ((form == 7) & (nparam != 2)))
+    if np.any(bad):
+        raise ValueError("Invalid parameters for restraint %d of form %d"
+                         % (np.argmax(bad) + 1, form[np.argmax(bad)]))
+
+
+def _atom_positions(store, natoms):
+    """Get the position in the list of atoms of every atom in every
+       restraint in the store (restraint atom indices are 1-based)"""
+    pos = store.atoms.astype(np.int64) - 1
+    pos[pos < 0] += natoms
+    if len(pos) > 0 and (pos.min() < 0 or pos.max() >= natoms):
+        raise IndexError("Restraint atom index out of range")
+    return pos
+
+
+def _count_per_restraint(store, values):
+    """Given a boolean array with one entry for each atom in each restraint,
+       return the number of True entries for each restraint"""
+    cs = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=cs[1:])
+    return cs[store.atoms_start[1:]] - cs[store.atoms_start[:-1]]
+
+
+def _get_means(store, ind):
+    """Get the index into store.params of the first mean, and the number
+       of means, for each of the given Gaussian or multi-Gaussian
+       restraints"""
+    p0 = store.params_start[ind]
+    nparam = store.params_start[ind + 1] - p0
+    modal = store.modal[ind].astype(np.int64)
+    multi = store.form[ind] == 4
+    first = p0 + np.where(multi, modal, 0)
+    count = np.where(multi,
+                     np.clip(np.minimum(modal, nparam - modal), 0, None),
+                     np.minimum(nparam, 1))
+    return first, count
+
+
+def _get_min_mean(store, ind):
+    """Get the smallest mean of each of the given Gaussian or
+       multi-Gaussian restraints"""
+    first, count = _get_means(store, ind)
+    pind, offsets = ragged_index(first, count)
+    min_mean = np.full(len(ind), np.inf)
+    nonempty = count > 0
+    if np.any(nonempty):
+        min_mean[nonempty] = np.minimum.reduceat(store.params[pind],
+                                                 offsets[:-1][nonempty])
+    return min_mean
 
 
 class Atom:
@@ -291,12 +258,53 @@ class Atom:
         self.a = a
 
 
+class AtomTable:
+    """Properties of all atoms, as arrays, for vectorized restraint editing.
+       Each array has one entry per atom, in the same order as the
+       list of :class:`Atom` objects it was built from."""
+    flags = ('isAS', 'isNUC', 'isSC', 'isCA', 'isCB', 'torestr')
+
+    def __init__(self, atoms):
+        self.index = np.array([a.a.index for a in atoms], dtype=np.int64)
+        self.resind = np.array([a.a.residue.index for a in atoms],
+                               dtype=np.int64)
+        self.hetatm = np.array([bool(a.a.residue.hetatm) for a in atoms],
+                               dtype=bool)
+        for flag in self.flags:
+            setattr(self, flag, np.array([bool(getattr(a, flag))
+                                          for a in atoms], dtype=bool))
+
+    def __len__(self):
+        return len(self.index)
+
+
 class ContactMap:
+    """Set of residue-residue contacts.
+
+       As well as individual pairs, a residue can be marked as contacting
+       every residue (see add_all()); such wildcard rows are stored once
+       rather than as one pair per residue."""
     def __init__(self):
         self.__d = {}
+        self.__all = {}
+        self.__keys = None
+        self.__all_nres = None
 
     def keys(self):
-        return self.__d.keys()
+        if not self.__all:
+            return self.__d.keys()
+        keys = set(self.__d.keys())
+        for i, nres in self.__all.items():
+            keys.update((min(i, j), max(i, j)) for j in range(1, nres + 1))
+        return keys
+
+    def add_all(self, i, nres):
+        """Mark residue `i` as in contact with all residues 1 to `nres`"""
+        self.__all_nres = None
+        self.__all[i] = max(nres, self.__all.get(i, 0))
+
+    def __in_all(self, i, j):
+        return 1 <= j <= self.__all.get(i, 0)
 
     def __getitem__(self, key):
         i, j = key
@@ -304,14 +312,55 @@ class ContactMap:
             i = i.a.residue.index
         if isinstance(j, Atom):
             j = j.a.residue.index
+        if self.__all and (self.__in_all(i, j) or self.__in_all(j, i)):
+            return True
         i, j = min(i, j), max(i, j)
         return (i, j) in self.__d
 
     def __setitem__(self, key, val):
         i, j = key
         i, j = min(i, j), max(i, j)
+        self.__keys = None
         return self.__d.__setitem__((i, j), True)
 
+    def add_pairs(self, ri, rj):
+        """Add contacts between each pair of residues in the given arrays
+           of residue indices"""
+        ri, rj = np.asarray(ri), np.asarray(rj)
+        self.__keys = None
+        self.__d.update(dict.fromkeys(zip(np.minimum(ri, rj).tolist(),
+                                          np.maximum(ri, rj).tolist()), True))
+
+    def __lookup_all(self, ri, rj):
+        if self.__all_nres is None:
+            self.__all_nres = np.zeros(max(self.__all) + 1, dtype=np.int64)
+            for i, nres in self.__all.items():
+                self.__all_nres[i] = nres
+        nres = self.__all_nres
+        inrange = (ri >= 0) & (ri < len(nres))
+        limit = np.zeros(len(ri), dtype=np.int64)
+        limit[inrange] = nres[ri[inrange]]
+        return (rj >= 1) & (rj <= limit)
+
+    def lookup(self, ri, rj):
+        """Vectorized version of __getitem__; given arrays of residue
+           indices, return a boolean array, True for each pair in contact"""
+        ri, rj = np.asarray(ri, dtype=np.int64), np.asarray(rj, dtype=np.int64)
+        if self.__keys is None:
+            self.__keys = np.sort(np.array([(i << 32) + j
+                                            for i, j in self.__d.keys()],
+                                           dtype=np.int64))
+        keys = (np.minimum(ri, rj) << 32) + np.maximum(ri, rj)
+        if len(self.__keys) == 0:
+            found = np.zeros(len(keys), dtype=bool)
+        else:
+            pos = np.minimum(np.searchsorted(self.__keys, keys),
+                             len(self.__keys) - 1)
+            found = self.__keys[pos] == keys
+        if self.__all:
+            found |= self.__lookup_all(ri, rj) | self.__lookup_all(rj, ri)
+        return found
+
 
 def parse_atomlist_asrs(atomlist_asrs):
     retval = {'AS': True, 'RS': False}
@@ -320,12 +369,40 @@ def parse_atomlist_asrs(atomlist_asrs):
         yield retval[allos_type]
 
 
-def get_contacts(contacts_pdbs, rcut):
+def get_template_contacts(fname, rcut, cache):
+    """Get all residue-residue contacts in the named PDB file, as arrays
+       of residue indices. Results are read from, or stored in, the given
+       ResultCache."""
+    key = (cache.get_key(fname, rcut, _CONTACTS_CACHE_VERSION)
+           if cache.enabled else None)
+    data = cache.load(key) if key else None
+    if data is None:
+        ri, rj = [], []
+        for r1, r2, dist in allosmod.get_contacts.get_contacts(fname, rcut):
+            ri.append(r1.index)
+            rj.append(r2.index)
+        data = {'ri': np.array(ri, dtype=np.int32),
+                'rj': np.array(rj, dtype=np.int32)}
+        if key:
+            cache.save(key, **data)
+    return data['ri'], data['rj']
+
+
+def get_contacts(contacts_pdbs, rcut, jobs=1, cache=True):
+    """Get the union of the contacts in all of the given templates,
+       using up to `jobs` processes. Each template's contacts are cached
+       on disk (see get_template_contacts()) if `cache` is True."""
+    rcache = ResultCache('contacts', enabled=cache)
+    args = [('pm_' + f, rcut, rcache) for f in contacts_pdbs]
+    if jobs > 1 and len(args) > 1:
+        with multiprocessing.get_context('fork').Pool(
+                min(jobs, len(args))) as pool:
+            results = pool.starmap(get_template_contacts, args)
+    else:
+        results = [get_template_contacts(*a) for a in args]
     contacts = ContactMap()
-    for f in contacts_pdbs:
-        for ri, rj, dist in allosmod.get_contacts.get_contacts('pm_' + f,
-                                                               rcut):
-            contacts[(ri.index, rj.index)] = True
+    for ri, rj in results:
+        contacts.add_pairs(ri, rj)
     return contacts
 
 
@@ -337,9 +414,9 @@ def get_breaks(fh):
     return breaks
 
 
-def get_beta(pdb_file):
+def get_beta(pdb_file, cache=False):
     beta = {}
-    dssp = list(allosmod.get_ss.get_ss(pdb_file))
+    dssp = allosmod.get_ss.get_ss_cached(pdb_file, cache)
     beta_fraction = dssp.count('E') / len(dssp) if len(dssp) > 0 else 0
     helix_fraction = dssp.count('H') / len(dssp) if len(dssp) > 0 else 0
     beta_structure = beta_fraction > 0.20 and helix_fraction < 0.05
@@ -370,6 +447,58 @@ def get_nuc_restrained(atm_name, res_name):
         return atm_name in ('N1', 'C2', 'O2', 'N3', 'C4', 'N4', 'C5', 'C6')
 
 
+def get_calc_residue_counts(pdb_file):
+    """Count residues in the given PDB file, for delEmax=CALC. Nucleic acids
+       are ignored. Return the number of the last ATOM residue, and the
+       number of HETATM residues."""
+    nres = nhet = 0
+    last_het = None
+    with open(pdb_file) as fh:
+        for line in fh:
+            if line[:4] not in ('ATOM', 'HETA') \
+               or line[17:20] in _CALC_NUCLEIC_ACIDS:
+                continue
+            if line[:4] == 'ATOM':
+                nres = int(line[22:26])
+            else:
+                het = (line[17:20], line[21], line[22:26])
+                if het != last_het:
+                    nhet += 1
+                    last_het = het
+    return nres, nhet
+
+
+class DelEmaxCalculation:
+    """Result of calculating delEmax from the number of truncated Gaussian
+       distance restraints (contacts), for delEmax=CALC. Tf is the
+       estimated folding temperature."""
+
+    def __init__(self, ncontact, nres, nhet):
+        self.ncontact, self.nres, self.nhet = ncontact, nres, nhet
+        nall = nres + nhet
+        if nall == 0:
+            self.delEmax, self.tf = 999., None
+        else:
+            # Round as done by the original shell script
+            self.delEmax = float('%.3f' % (3.6 * nall / ncontact)) \
+                if ncontact > 0 else 0.1
+            self.tf = 367. * self.delEmax * ncontact / (4. * nall)
+
+    def write(self, fh):
+        """Write a report, in the same format as run.log"""
+        # As in the original shell script, only a calculated delEmax is
+        # written to 3 decimal places (the defaults are written as 0.1
+        # or 999)
+        calculated = self.tf is not None and self.ncontact > 0
+        fh.write("delEmax set to: %s\n"
+                 % ("%.3f" if calculated else "%g") % self.delEmax)
+        if self.tf is None:
+            fh.write("Number of distance contacts: NA\nEstimated Tf: NA\n")
+        else:
+            fh.write("Number of distance contacts: %d\n" % self.ncontact)
+            fh.write("Estimated Tf: %.0f\n" % self.tf)
+
+
 class RestraintEditor:
     # if empty_AS, then only use: cov bonds, angles, dihedrals for AS
     # (ignore nonbonded contacts within AS site, RS and interface OK)
@@ -383,10 +512,24 @@ class RestraintEditor:
     delEmaxNUC = 0.12
     rcutNUC = 8.0
     distco_scsc = 5.0
+    # Classified restraints are held in memory up to this size (in bytes),
+    # then spilled to a temporary file
+    max_buffer_size = 1 << 30
+    # Maximum size (in bytes) of each part of a restraints file handled
+    # by a single worker process, if jobs > 1
+    shard_size = 1 << 24
+    # Number of restraints classified at a time, when read from a cache
+    chunk_size = 1 << 18
+    # If more than this fraction of the restraints in either file would be
+    # reclassified by update(), do a full edit instead
+    max_update_fraction = 0.5
+    # Result of calculating delEmax, if delEmax='CALC'
+    delEmax_calculation = None
+    _atom_table = None
 
     def __init__(self, listoth_rsr, listas_rsr, pdb_file, contacts_pdbs,
                  atomlist_asrs, sigmas, rcut, delEmax, break_file,
-                 coarse, locrigid):
+                 coarse, locrigid, jobs=1, cache=True):
         self.listoth_rsr = listoth_rsr
         self.listas_rsr = listas_rsr
         self.pdb_file = pdb_file
@@ -394,160 +537,730 @@ class RestraintEditor:
         self.atomlist_asrs = atomlist_asrs
         self.sigmas = sigmas
         self.rcut = rcut
+        # If delEmax is 'CALC', it is calculated from the number of
+        # contacts (see classify_restraints())
         self.delEmax = delEmax
+        self.calc_delEmax = delEmax == 'CALC'
         self.break_file = break_file
         self.coarse = coarse
         self.locrigid = locrigid
+        self.jobs = jobs
+        self.cache = cache
 
     def setup_atoms(self, env):
-        self.m = modeller.Model(env, file=self.pdb_file)
+        self.m = get_model_snapshot(env, self.pdb_file)
         self.atoms = [Atom(a) for a in self.m.atoms]
-        self.contacts = get_contacts(self.contacts_pdbs, self.rcut)
+        self.contacts = get_contacts(self.contacts_pdbs, self.rcut,
+                                     self.jobs, self.cache)
         if self.break_file:
             self.breaks = get_breaks(open(self.break_file))
         else:
             self.breaks = {}
-        self.beta_structure = get_beta(self.pdb_file)
-        NUCLEIC_ACIDS = dict.fromkeys(['ADE', 'A', 'DA', 'THY', 'T', 'DT',
-                                       'URA', 'U', 'DU', 'GUA', 'G', 'DG',
-                                       'CYT', 'C', 'DC'])
-        BACKBONE_ATOMS = dict.fromkeys(['CA', 'CB', 'O', 'N', 'C', 'OT', 'NA',
-                                        'NB', 'NC', 'ND', 'C1A', 'C2A', 'C3A',
-                                        'C4A', 'C1B', 'C2B', 'C3B', 'C4B',
-                                        'C1C', 'C2C', 'C3C', 'C4C', 'C1D',
-                                        'C2D', 'C3D', 'C4D'])
-        for a in self.atoms:
-            r = a.a.residue
-            if r.pdb_name in NUCLEIC_ACIDS:
-                a.isNUC = True
-                a.torestr = get_nuc_restrained(a.a.name, r.pdb_name)
-                for rj in range(1, len(self.m.residues) + 1):
-                    self.contacts[(r.index, rj)] = True
-            if a.a.name in BACKBONE_ATOMS or r.pdb_name in NUCLEIC_ACIDS:
+        self.beta_structure = get_beta(self.pdb_file, self.cache)
+        NUCLEIC_ACIDS = ['ADE', 'A', 'DA', 'THY', 'T', 'DT', 'URA', 'U', 'DU',
+                         'GUA', 'G', 'DG', 'CYT', 'C', 'DC']
+        BACKBONE_ATOMS = ['CA', 'CB', 'O', 'N', 'C', 'OT', 'NA', 'NB', 'NC',
+                          'ND', 'C1A', 'C2A', 'C3A', 'C4A', 'C1B', 'C2B',
+                          'C3B', 'C4B', 'C1C', 'C2C', 'C3C', 'C4C', 'C1D',
+                          'C2D', 'C3D', 'C4D']
+        names = self.m.atom_name
+        resnames = self.m.residue_name[self.m.atom_residue]
+        nuc = np.isin(resnames, NUCLEIC_ACIDS)
+        backbone = nuc | np.isin(names, BACKBONE_ATOMS)
+        nres = len(self.m.residue_name)
+        for ri in np.unique(self.m.atom_residue[nuc]).tolist():
+            self.contacts.add_all(ri + 1, nres)
+        for n in np.flatnonzero(nuc).tolist():
+            a = self.atoms[n]
+            a.isNUC = True
+            a.torestr = get_nuc_restrained(a.a.name, a.a.residue.pdb_name)
+        for a, bb, ca, cb, sc in zip(
+                self.atoms, backbone.tolist(), (names == 'CA').tolist(),
+                (names == 'CB').tolist(), (names != 'H').tolist()):
+            if bb:
                 a.isSC = False
-                a.isCA = a.a.name == 'CA'
-                a.isCB = a.a.name == 'CB'
+                a.isCA = ca
+                a.isCB = cb
             else:
-                a.isSC = a.a.name != 'H'
+                a.isSC = sc
         for a, asrs in zip(self.atoms,
                            parse_atomlist_asrs(open(self.atomlist_asrs))):
             a.isAS = asrs
 
-    def setup_delEmax(self):
-        if not self.coarse:
-            return
-        ndist = ndistCACB = 0
-        for r in parse_restraints_file(open(self.listas_rsr), self.atoms):
-            if (isinstance(r, GaussianRestraint)
-                and len(r.atoms) == 2 and r.group != 1) \
-               or (isinstance(r, MultiGaussianRestraint)
-                   and len(r.atoms) == 2):
-                if self.contacts[(r.atoms[0], r.atoms[1])]:
-                    if (not r.atoms[0].isSC and not r.atoms[0].isCB) \
-                       or (not r.atoms[1].isSC and not r.atoms[1].isCB) \
-                       or r.firstmean < self.distco_scsc:
-                        ndist += 1
-                    if (r.atoms[0].isCA or r.atoms[0].isCB) \
-                       and (r.atoms[1].isCA or r.atoms[1].isCB):
-                        ndistCACB += 1
+    def _scale_delEmax(self, ndist, ndistCACB):
+        """Scale delEmax (for coarse landscapes) given the number of
+           distance contacts and the number of those that are CA/CB-CA/CB
+           (see count_delEmax_contacts())"""
         if ndistCACB > 0:
             self.delEmax = (6.5 / 7.8) * (ndist / ndistCACB) * self.delEmax
             self.delEmaxNUC = (6.5 / 7.8) * (ndist / ndistCACB) \
                                           * self.delEmaxNUC
 
-    def edit(self, env):
+    def count_delEmax_contacts(self, store):
+        """Count the two-atom distance restraints in the given
+           RestraintStore that are contacts, for scaling delEmax. Only
+           those that are not between two side chain (or CB) atoms, or have
+           a first mean below distco_scsc, are counted in ndist;
+           ndistCACB counts those between two CA or CB atoms.
+           Return (ndist, ndistCACB)."""
+        at = self.get_atom_table()
+        pos = _atom_positions(store, len(at))
+        form = store.form
+        ind = np.flatnonzero((store.natom == 2)
+                             & (((form == 3) & (store.group != 1))
+                                | (form == 4)))
+        a0 = pos[store.atoms_start[ind]]
+        a1 = pos[store.atoms_start[ind] + 1]
+        contact = self.contacts.lookup(at.resind[a0], at.resind[a1])
+        firstmean = store.params[_get_means(store, ind)[0]]
+        sc = at.isSC | at.isCB
+        cacb = at.isCA | at.isCB
+        ndist = np.count_nonzero(contact & (~sc[a0] | ~sc[a1]
+                                            | (firstmean < self.distco_scsc)))
+        ndistCACB = np.count_nonzero(contact & cacb[a0] & cacb[a1])
+        return int(ndist), int(ndistCACB)
+
+    def count_calc_contacts(self, store, mask, codes):
+        """Count restraints in the given RestraintStore that are written
+           out as truncated Gaussians with a nonzero delEmax. This uses a
+           non-coarse landscape without extra local rigidity, regardless
+           of self.coarse and self.locrigid, so that delEmax=CALC gives the
+           same delEmax for all landscapes. `codes` is the output of
+           classify() for the same store and mask."""
+        if self.coarse or self.locrigid:
+            codes = self.classify(store, mask, coarse=False, locrigid=False)
+        return int(np.count_nonzero(np.isin(codes, _TRUNCATED_CODES)))
+
+    def calculate_delEmax(self, ncontact):
+        """Set delEmax given the number of truncated Gaussian distance
+           restraints, such that the energy landscape has a folding
+           temperature that scales with the size of the system (NRES+NHET).
+           The result is also stored in self.delEmax_calculation."""
+        self.delEmax_calculation = DelEmaxCalculation(
+            ncontact, *get_calc_residue_counts(self.pdb_file))
+        self.delEmax = self.delEmax_calculation.delEmax
+
+    def edit(self, env, index=None, fh=sys.stdout):
+        """Edit all restraints, writing the result to `fh`. If `index` is
+           given, also write a classification index to that file, which
+           can be used to quickly update the output if only the AS/RS atom
+           list changes (see update())."""
+        key = self.get_index_key() if index else None
+        self.setup_atoms(env)
+        self._edit(index, key, fh)
+
+    def _edit(self, index, key, fh):
+        with RestraintBuffer(self.max_buffer_size) as buf, \
+                self.get_pool() as pool:
+            self.classify_restraints(buf, pool)
+            tgparams = TruncatedGaussianParameters(
+                delEmax=self.delEmax, delEmaxNUC=self.delEmaxNUC,
+                slope=4.0, scl_delx=0.7, breaks=self.breaks)
+            self.write_restraints(tgparams, buf, fh, pool)
+        if index:
+            self.write_index(index, key, self.kept_restraints)
+
+    def get_index_key(self):
+        """Get a string describing all inputs except the AS/RS atom list,
+           used to check that a classification index matches"""
+        files = [self.listoth_rsr, self.listas_rsr, self.pdb_file] \
+            + ['pm_' + f for f in self.contacts_pdbs]
+        if self.break_file:
+            files.append(self.break_file)
+        s = self.sigmas
+        return json.dumps(
+            {'files': [get_file_hash(f) for f in files],
+             'params': [self.rcut, self.delEmax, bool(self.coarse),
+                        bool(self.locrigid), s.ntotal, s.sig_AS, s.sig_RS,
+                        s.sig_inter, self.empty_AS, self.tgauss_AS,
+                        self.HETscale, self.delEmaxNUC, self.rcutNUC,
+                        self.distco_scsc]})
+
+    def write_index(self, fname, key, kept):
+        """Write a classification index to the named file. This records
+           which input restraints were kept, the AS/RS assignment of each
+           atom, and the (scaled) delEmax."""
+        with open(fname, 'wb') as fh:
+            np.savez(fh, version=np.array(_INDEX_VERSION), key=np.array(key),
+                     is_as=self.get_atom_table().isAS, kept=kept,
+                     delEmax=np.array([self.delEmax, self.delEmaxNUC]))
+
+    def _read_index(self, fname, key):
+        """Read a classification index written by write_index(). Return
+           None if it cannot be read or does not match the current inputs."""
+        try:
+            with np.load(fname, allow_pickle=False) as data:
+                index = dict(data.items())
+            if (int(index['version']) != _INDEX_VERSION
+                    or str(index['key']) != key
+                    or len(index['is_as']) != len(self.atoms)):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return index
+
+    def update(self, env, previous_rsr, previous_index, index=None,
+               fh=sys.stdout):
+        """Like edit(), but reuse the output of a previous run that differed
+           only in the AS/RS atom list. `previous_rsr` is that output, and
+           `previous_index` its classification index (see edit()). Only
+           restraints that contain atoms whose AS/RS assignment changed are
+           reclassified; all others are copied from `previous_rsr`. If the
+           index does not match the current inputs, or most restraints
+           are affected, a full edit is done instead. A full edit is also
+           always done if delEmax is calculated (since it depends on
+           which restraints are used for AS/RS)."""
+        key = self.get_index_key()
+        self.setup_atoms(env)
+        old = None if self.calc_delEmax \
+            else self._read_index(previous_index, key)
+        if old is not None:
+            with open(previous_rsr, 'rb') as pfh:
+                prev = pfh.read()
+            kept = self._update(old, prev, fh)
+            if kept is not None:
+                if index:
+                    self.write_index(index, key, kept)
+                return
+        self._edit(index, key, fh)
+
+    def _update(self, old, prev, fh):
+        """Write updated restraints given the old index and output.
+           Return the new list of kept restraints, or None (and write
+           nothing) if a full edit should be done instead."""
+        at = self.get_atom_table()
+        changed = at.isAS != old['is_as']
+        old_kept = old['kept']
+        # delEmax scaling does not depend on AS/RS, so reuse the old value
+        delEmax, delEmaxNUC = old['delEmax'].tolist()
+        tgparams = TruncatedGaussianParameters(
+            delEmax=delEmax, delEmaxNUC=delEmaxNUC,
+            slope=4.0, scl_delx=0.7, breaks=self.breaks)
+
+        # Reclassify and format all affected restraints
+        new_kept = old_kept.copy()
+        affected, new_lines = [], []
+        offset = 0
+        for (fname, mask) in ((self.listoth_rsr, mask_rs_rs),
+                              (self.listas_rsr, mask_not_rs_rs)):
+            store = RestraintStore.read_file(fname, cache=self.cache)
+            _check_store(store)
+            pos = _atom_positions(store, len(at))
+            ind = np.flatnonzero(_count_per_restraint(store, changed[pos]))
+            nstore = len(store)
+            if offset + nstore > len(old_kept) \
+                    or len(ind) > self.max_update_fraction * nstore:
+                return None
+            store = store.take(ind)
+            codes = self.classify(store, mask)
+            keep = np.flatnonzero(codes != DROP)
+            sfh = io.StringIO()
+            self.write_classified(tgparams, store.take(keep), codes[keep],
+                                  sfh)
+            new_kept[ind + offset] = codes != DROP
+            affected.append(ind + offset)
+            new_lines.append(np.full(len(ind), None, dtype=object))
+            new_lines[-1][keep] = sfh.getvalue().splitlines(keepends=True)
+            offset += nstore
+        if offset != len(old_kept):
+            return None
+        affected = np.concatenate(affected)
+        new_lines = np.concatenate(new_lines)
+
+        # Start of each restraint line in the previous output (skipping the
+        # header), plus the end of the last one
+        nkept = np.count_nonzero(old_kept)
+        starts = np.flatnonzero(np.frombuffer(prev, dtype=np.uint8)
+                                == ord('\n')) + 1
+        if len(starts) < nkept + 1:
+            return None
+        starts = starts[:nkept + 1]
+        # Index into starts of each restraint (or of the next kept restraint,
+        # if not kept), plus the end of the last restraint
+        old_line = np.concatenate(([0], np.cumsum(old_kept)))
+
+        # Copy unaffected restraints, and write affected ones, in order
+        fh.write(prev[:starts[0]].decode('ascii'))
+        # Split affected restraints into runs of consecutive indices
+        run_start = np.flatnonzero(np.diff(affected, prepend=-2) != 1)
+        run_end = np.append(run_start[1:], len(affected))
+        copy_from = 0
+        for rstart, rend in zip(run_start.tolist(), run_end.tolist()):
+            fh.write(prev[starts[old_line[copy_from]]:
+                          starts[old_line[affected[rstart]]]].decode('ascii'))
+            fh.write(''.join([x for x in new_lines[rstart:rend]
+                              if x is not None]))
+            copy_from = affected[rend - 1] + 1
+        fh.write(prev[starts[old_line[copy_from]]:
+                      starts[old_line[-1]]].decode('ascii'))
+        add_ca_boundary_restraints(self.atoms, fh)
+        self.delEmax, self.delEmaxNUC = delEmax, delEmaxNUC
+        return new_kept
+
+    def sweep(self, env, points):
+        """Like edit(), but write one restraints file for each of the given
+           SweepPoints, using its delEmax and sigmas. Restraints are only
+           read and classified once, since the classification does not
+           depend on these parameters."""
         self.setup_atoms(env)
-        self.setup_delEmax()
-        tgparams = TruncatedGaussianParameters(delEmax=self.delEmax,
-                                               delEmaxNUC=self.delEmaxNUC,
-                                               slope=4.0, scl_delx=0.7,
-                                               breaks=self.breaks)
-        self.parse_restraints(tgparams)
-
-    def parse_restraints(self, tgparams, fh=sys.stdout):
+        delEmaxNUC = self.delEmaxNUC
+        with RestraintBuffer(self.max_buffer_size) as buf, \
+                self.get_pool() as pool:
+            self.classify_restraints(buf, pool)
+            for p in points:
+                self.sigmas = Sigmas(self.sigmas.ntotal, p.sig_AS, p.sig_RS,
+                                     p.sig_inter)
+                self.delEmax, self.delEmaxNUC = p.delEmax, delEmaxNUC
+                if self.coarse:
+                    self._scale_delEmax(*self.delEmax_counts)
+                tgparams = TruncatedGaussianParameters(
+                    delEmax=self.delEmax, delEmaxNUC=self.delEmaxNUC,
+                    slope=4.0, scl_delx=0.7, breaks=self.breaks)
+                with open(p.output, 'w') as fh:
+                    self.write_restraints(tgparams, buf, fh, pool)
+
+    def get_pool(self):
+        """Get a pool of self.jobs worker processes, to be used as a
+           context manager, or a null context if jobs == 1. Workers are
+           forked from this process, so share its atoms, contacts, etc.
+           (setup_atoms() should be called first)."""
+        global _pool_editor
+        if self.jobs <= 1:
+            return contextlib.nullcontext()
+        # Build lookup tables once, before forking
+        self.get_atom_table()
+        self.contacts.lookup([], [])
+        _pool_editor = self
+        return multiprocessing.get_context('fork').Pool(self.jobs)
+
+    def classify_chunk(self, store, mask, count):
+        """Classify all restraints in the given store. Return the store,
+           the classification of each restraint, counts (from
+           count_delEmax_contacts() if `count` is True, then from
+           count_calc_contacts() if delEmax is calculated), and None (in
+           place of the mask of kept restraints returned by _pool_filter())."""
+        codes = self.classify(store, mask)
+        counts = self.count_delEmax_contacts(store) if count else (0, 0)
+        ncontact = self.count_calc_contacts(store, mask, codes) \
+            if self.calc_delEmax else 0
+        return store, codes, counts + (ncontact,), None
+
+    def _read_chunks(self, fname, mask, count, pool):
+        """Read and classify all restraints in the named file, one chunk
+           at a time. The binary cache of the file is used if it is valid,
+           or written (also one chunk at a time) if self.cache is True."""
+        store = None
+        if is_cache_file(fname):
+            cache_file = fname
+            store = RestraintStore.load(fname)[0]
+        elif self.cache:
+            cache_file = fname + CACHE_SUFFIX
+            store = RestraintStore.load_cache_for(fname)
+        if store is not None:
+            if pool is None:
+                for i in range(0, len(store), self.chunk_size):
+                    yield self.classify_chunk(
+                        store.slice(i, i + self.chunk_size), mask, count)
+            else:
+                # Workers read the (memory-mapped) cache themselves
+                nrange = max(self.jobs, -(-len(store) // self.chunk_size))
+                yield from pool.imap(_pool_classify_cache,
+                                     [(cache_file, start, end, mask, count)
+                                      for (start, end)
+                                      in split_range(len(store), nrange)])
+            return
+        st = os.stat(fname)
+        # The file is hashed as it is read, if we read it all in order;
+        # otherwise the cache records only its size and modification time
+        digest = None
+        with (CacheWriter() if self.cache
+              else contextlib.nullcontext()) as writer:
+            if pool is None:
+                with open(fname, 'rb') as fh:
+                    hfh = HashingReader(fh)
+                    for chunk in RestraintStore.iter_read(hfh):
+                        if writer:
+                            writer.append(chunk)
+                        yield self.classify_chunk(chunk, mask, count)
+                digest = hfh.hash.hexdigest()
+            else:
+                nrange = max(self.jobs, -(-st.st_size // self.shard_size))
+                for chunk in pool.imap(_pool_classify,
+                                       [(fname, start, end, mask, count,
+                                         self.cache) for (start, end)
+                                        in split_range(st.st_size, nrange)]):
+                    if writer:
+                        writer.append(chunk[0])
+                    yield chunk
+            if writer:
+                writer.write_cache_for(fname, st, digest)
+
+    def classify_restraints(self, buf, pool=None):
+        """Read and classify all restraints in a single pass, adding those
+           that are not dropped, plus their classification, to the given
+           RestraintBuffer. For coarse landscapes, delEmax is also scaled
+           (see count_delEmax_contacts()) using counts gathered in the
+           same pass, which are also stored in self.delEmax_counts. If
+           delEmax is 'CALC', it is first calculated (see
+           calculate_delEmax()) from contacts counted in the same pass.
+           Which of the input restraints were kept is stored in
+           self.kept_restraints.
+           If a pool (see get_pool()) is given, each file is split into
+           ranges which are classified in parallel."""
+        ndist = ndistCACB = ncontact = 0
+        kept_restraints = []
+        for (fname, mask, count) in (
+                (self.listoth_rsr, mask_rs_rs, False),
+                (self.listas_rsr, mask_not_rs_rs, self.coarse)):
+            for store, codes, (n, ncacb, ncont), kept in self._read_chunks(
+                    fname, mask, count, pool):
+                if kept is None:
+                    kept = codes != DROP
+                    if not kept.all():
+                        keep = np.flatnonzero(kept)
+                        store, codes = store.take(keep), codes[keep]
+                kept_restraints.append(kept)
+                buf.append(store, codes=codes)
+                ndist += n
+                ndistCACB += ncacb
+                ncontact += ncont
+        self.kept_restraints = np.concatenate(kept_restraints) \
+            if kept_restraints else np.zeros(0, dtype=bool)
+        self.delEmax_counts = (ndist, ndistCACB)
+        if self.calc_delEmax:
+            self.calculate_delEmax(ncontact)
+        if self.coarse:
+            self._scale_delEmax(ndist, ndistCACB)
+
+    def write_restraints(self, tgparams, buf, fh=sys.stdout, pool=None):
+        """Write out all restraints previously classified by
+           classify_restraints(). If a pool (see get_pool()) is given,
+           restraints are formatted in parallel."""
         print("MODELLER5 VERSION: MODELLER FORMAT", file=fh)
-        # get restraints
-        for (fname, filter) in ((self.listoth_rsr, filter_rs_rs),
-                                (self.listas_rsr, filter_not_rs_rs)):
-            for r in parse_restraints_file(open(fname), self.atoms, filter):
-                self.parse_restraint(tgparams, r, fh)
+        if pool is None:
+            for store, data in buf:
+                self.write_classified(tgparams, store, data['codes'], fh)
+        else:
+            for text in pool.imap(_pool_write,
+                                  ((tgparams, self.sigmas, store,
+                                    data['codes'])
+                                   for store, data in buf)):
+                fh.write(text)
         add_ca_boundary_restraints(self.atoms, fh)
 
-    def parse_restraint(self, tgparams, r, fh):
+    def get_atom_table(self):
+        """Get an AtomTable for self.atoms"""
+        if self._atom_table is None or self._atom_table[0] is not self.atoms:
+            self._atom_table = (self.atoms, AtomTable(self.atoms))
+        return self._atom_table[1]
+
+    def classify(self, store, mask=None, coarse=None, locrigid=None):
+        """Decide how to handle each restraint in the given RestraintStore.
+           An array is returned containing DROP, KEEP, etc. for each
+           restraint. If `mask` is given, it is used to
+           select restraints (see mask_rs_rs()); all others are dropped.
+           If `coarse` or `locrigid` are given, they override self.coarse
+           and self.locrigid respectively."""
+        _check_store(store)
+        at = self.get_atom_table()
+        pos = _atom_positions(store, len(at))
+        natom = store.natom.astype(np.int64)
+        form, group = store.form, store.group
+        codes = np.full(len(store), DROP, dtype=np.int8)
+        if mask is None:
+            sel = np.ones(len(store), dtype=bool)
+        else:
+            sel = mask(_count_per_restraint(store, at.isAS[pos]))
+        intrahet = _count_per_restraint(store, at.hetatm[pos]) == natom
+        gauss = sel & (form == 3)
+        multi = sel & (form == 4)
         # gaussian; bond, angle or torsion
         # multigaussian; angle or torsion
         # cosine; some dihedrals
         # keep as is for prot, scale for HET
-        if ((isinstance(r, GaussianRestraint) and
-             ((len(r.atoms) == 2 and r.group == 1)
-              or len(r.atoms) == 3 or len(r.atoms) == 4))
-                or (isinstance(r, MultiGaussianRestraint)
-                    and len(r.atoms) >= 3)
-                or isinstance(r, CosineRestraint)):
-            if r.is_intrahet():
-                r.rescale(self.HETscale)
-            r.write(fh)
+        keep = ((gauss & (((natom == 2) & (group == 1))
+                          | (natom == 3) | (natom == 4)))
+                | (multi & (natom >= 3)) | (sel & (form == 7)))
+        distance = (natom == 2) & ((gauss & (group != 1)) | multi)
+        codes[keep & ~intrahet] = KEEP
         # add intra heme contacts to maintain geometry; keep all as is
-        elif (r.is_intrahet() and len(r.atoms) == 2 and
-              ((isinstance(r, GaussianRestraint) and r.group != 1)
-                or isinstance(r, MultiGaussianRestraint))):
-            r.rescale(self.HETscale)
-            r.write(fh)
-        # Keep as is
-        elif isinstance(r, SplineRestraint):
-            r.write(fh)
-        # Gaussian or MultiGaussian distance restraint
-        elif (len(r.atoms) == 2
-              and ((isinstance(r, GaussianRestraint) and r.group != 1)
-                   or (isinstance(r, MultiGaussianRestraint)))):
-            if self.coarse and not r.is_ca_cb_interaction():
-                return
-            # omit side chain interactions > 5 Ang
-            if (r.is_sidechain_sidechain_interaction()
-                    and not r.any_mean_below(self.distco_scsc)):
-                return
-            seqdst = abs(r.atoms[0].a.residue.index
-                         - r.atoms[1].a.residue.index)
-            if self.locrigid and 2 <= seqdst <= 5 and r.is_ca_cb_interaction():
-                r.transform(tgparams, local=True, modal=2, stdev=2.0, fh=fh)
-            elif (self.locrigid and 6 <= seqdst <= 12
-                  and r.is_ca_cb_interaction() and r.any_mean_below(6.0)):
-                r.transform(tgparams, local=True, modal=2, stdev=2.0, fh=fh)
-            elif (2 <= seqdst and r.any_mean_below(6.0)
-                  and r.is_ca_cb_interaction()
-                  and r.is_beta_beta_interaction(self.beta_structure)):
-                r.transform(tgparams, local=True, modal=2, stdev=2.0, fh=fh)
-            elif self.contacts[(r.atoms[0], r.atoms[1])]:
-                if isinstance(r, MultiGaussianRestraint):
-                    sig = self.sigmas.get_scaled(r.atoms) / r.modal / r.modal
-                    r.transform(tgparams, modal=r.modal,
-                                stdev=sig, truncated=tgparams.delEmax != 0.,
-                                fh=fh)
-                elif r.is_intra_protein_interaction():
-                    sig = self.sigmas.get_scaled(r.atoms)
-                    if r.is_allosteric_interaction():
-                        if not self.empty_AS:
-                            if self.tgauss_AS:
-                                r.transform(tgparams, modal=2,
-                                            stdev=sig, fh=fh)
-                            else:
-                                r.stdev = sig
-                                r.write(fh)
-                    else:  # RS or interface
-                        if tgparams.delEmax == 0.:
-                            r.transform(tgparams, modal=1,
-                                        stdev=sig, truncated=False, fh=fh)
-                        else:
-                            r.transform(tgparams, modal=2,
-                                        stdev=sig, fh=fh)
-                elif (r.is_protein_dna_interaction()
-                      and r.any_mean_below(self.rcutNUC)):
-                    sig = self.sigmas.get(r.atoms)
-                    r.transform(tgparams, nuc=True, modal=2, stdev=sig, fh=fh)
-                elif (r.is_intra_dna_interaction()
-                      and r.any_mean_below(self.rcutNUC)):
-                    r.stdev = 1.0
-                    r.write(fh)
+        codes[(keep | distance) & intrahet] = KEEP_HET
+        # Keep splines as is
+        codes[sel & (form == 10)] = KEEP
+        ind = np.flatnonzero(distance & ~intrahet)
+        codes[ind] = self._classify_distance(
+            store, ind, pos, at,
+            self.coarse if coarse is None else coarse,
+            self.locrigid if locrigid is None else locrigid)
+        return codes
+
+    def _classify_distance(self, store, ind, pos, at, coarse, locrigid):
+        """Classify the given Gaussian or MultiGaussian distance restraints"""
+        a0 = pos[store.atoms_start[ind]]
+        a1 = pos[store.atoms_start[ind] + 1]
+
+        def both(flags):
+            return flags[a0] & flags[a1]
+        ca_cb = both(at.isNUC | at.isCA | at.isCB)
+        min_mean = _get_min_mean(store, ind)
+        # omit side chain interactions > 5 Ang
+        keep = ~both(at.isSC | at.isCB) | (min_mean < self.distco_scsc)
+        if coarse:
+            keep &= ca_cb
+        r0, r1 = at.resind[a0], at.resind[a1]
+        seqdst = np.abs(r0 - r1)
+        beta = np.isin(at.resind, list(self.beta_structure))
+        local = (2 <= seqdst) & (min_mean < 6.0) & ca_cb & both(beta)
+        if locrigid:
+            local |= ca_cb & (((2 <= seqdst) & (seqdst <= 5))
+                              | ((6 <= seqdst) & (seqdst <= 12)
+                                 & (min_mean < 6.0)))
+        local &= keep
+        contact = keep & ~local & self.contacts.lookup(r0, r1)
+        multi = store.form[ind] == 4
+
+        codes = np.full(len(ind), DROP, dtype=np.int8)
+        codes[local] = LOCAL
+        codes[contact & multi] = MULTI_CONTACT
+        gauss = contact & ~multi
+        protein = gauss & ~at.isNUC[a0] & ~at.isNUC[a1]
+        allosteric = both(at.isAS)
+        if not self.empty_AS:
+            codes[protein & allosteric] = (AS_TGAUSS if self.tgauss_AS
+                                           else AS_GAUSS)
+        codes[protein & ~allosteric] = RS_CONTACT
+        below_nuc = min_mean < self.rcutNUC
+        restr = at.isNUC & at.torestr
+        protein_dna = (at.isNUC[a0] != at.isNUC[a1]) & (restr[a0] | restr[a1])
+        codes[gauss & protein_dna & below_nuc] = NUC_CONTACT
+        codes[gauss & both(restr) & below_nuc] = DNA_CONTACT
+        return codes
+
+    def write_classified(self, tgparams, store, codes, fh=sys.stdout):
+        """Write out all restraints in the given RestraintStore, handled as
+           determined by classify()."""
+        at = self.get_atom_table()
+        pos = _atom_positions(store, len(at))
+        lines = LineBuffer()
+        ind = np.flatnonzero(np.isin(codes, (KEEP, KEEP_HET, AS_GAUSS,
+                                             DNA_CONTACT))
+                             & (store.form != 10))
+        for gind, fmt, columns in self._write_block(store, codes, ind,
+                                                    pos, at):
+            lines.add_rows(gind, fmt, *columns)
+        ind = np.flatnonzero(np.isin(codes, (LOCAL, MULTI_CONTACT, AS_TGAUSS,
+                                             RS_CONTACT, NUC_CONTACT)))
+        for gind, fmt, columns in self._transform_block(tgparams, store,
+                                                        codes, ind, pos, at):
+            lines.add_rows(gind, fmt, *columns)
+        ind = np.flatnonzero((codes == KEEP) & (store.form == 10))
+        lines.add_lines(ind, self._write_splines(store, ind, pos, at))
+        fh.write(lines.getvalue())
+
+    def _get_sigmas(self, store, ind, pos, at, scaled):
+        """Get sigma for each of the given two-atom restraints"""
+        a0 = pos[store.atoms_start[ind]]
+        a1 = pos[store.atoms_start[ind] + 1]
+        sig = self.sigmas.get_array(at.isSC[a0], at.isSC[a1],
+                                    at.isAS[a0], at.isAS[a1])
+        if scaled:
+            sig = sig * self.sigmas.ntotal * self.sigmas.ntotal
+        return sig
+
+    def _get_atom_indices(self, store, ind, natom, pos, at):
+        """Get Modeller indices of atoms in the given restraints, as a
+           2D array, given that they all contain `natom` atoms"""
+        first = store.atoms_start[ind]
+        return at.index[pos[first[:, np.newaxis] + np.arange(natom)]]
+
+    def _write_block(self, store, codes, ind, pos, at):
+        """Format the given restraints (which are written out more or less
+           as is), yielding (indices, format, columns) for each group of
+           restraints (see LineBuffer.add_rows())"""
+        form = store.form[ind]
+        modal = store.modal[ind].astype(np.int64)
+        nparam = store.params_start[ind + 1] - store.params_start[ind]
+        # Number of parameters written for each restraint
+        nval = np.where(form == 4, np.minimum(nparam, 3 * modal), 2)
+        natom = store.natom[ind].astype(np.int64)
+        het = codes[ind] == KEEP_HET
+        stdev = np.full(len(ind), np.nan)
+        stdev[codes[ind] == DNA_CONTACT] = 1.0
+        as_gauss = np.flatnonzero(codes[ind] == AS_GAUSS)
+        stdev[as_gauss] = self._get_sigmas(store, ind[as_gauss], pos, at,
+                                           scaled=True)
+        key = natom * 65536 + nval
+        for k in np.unique(key).tolist():
+            g = np.flatnonzero(key == k)
+            na, nv = divmod(k, 65536)
+            gind = ind[g]
+            vals = store.params[store.params_start[gind][:, np.newaxis]
+                                + np.arange(nv)]
+            col = np.arange(nv)[np.newaxis, :]
+            gform = form[g][:, np.newaxis]
+            ghet = het[g][:, np.newaxis]
+            vals = np.where(ghet & (gform == 3) & (col == 1),
+                            vals / self.HETscale, vals)
+            vals = np.where(ghet & (gform == 4)
+                            & (col >= 2 * modal[g][:, np.newaxis]),
+                            vals / self.HETscale, vals)
+            vals = np.where(ghet & (gform == 7) & (col == 1),
+                            vals * self.HETscale, vals)
+            gstdev = stdev[g][:, np.newaxis]
+            vals = np.where((col == 1) & ~np.isnan(gstdev), gstdev, vals)
+            header = np.column_stack((store.form[gind], store.modal[gind],
+                                      store.feat[gind], store.group[gind],
+                                      store.natom[gind], store.nparam[gind],
+                                      np.ones(len(gind))))
+            fmt = ('R %4d %3d %3d %3d %3d %3d %3d '
+                   + ' '.join(['%5d'] * na) + '    '
+                   + ' '.join(['%9.4f'] * nv) + '\n')
+            yield gind, fmt, (header,
+                              self._get_atom_indices(store, gind, na, pos, at),
+                              vals)
+
+    def _transform_block(self, tgparams, store, codes, ind, pos, at):
+        """Format the given two-atom distance restraints, which are
+           converted into (truncated) multi-Gaussians, yielding
+           (indices, format, columns) for each group of restraints"""
+        code = codes[ind]
+        multi = store.form[ind] == 4
+        no_trunc = tgparams.delEmax == 0.
+        truncated = ~(no_trunc & ((code == MULTI_CONTACT)
+                                  | (code == RS_CONTACT)))
+        modal = np.where(multi, store.modal[ind],
+                         np.where(no_trunc & (code == RS_CONTACT), 1, 2))
+        mean_first, nmean = _get_means(store, ind)
+        nmean = np.where(multi, nmean, modal)
+
+        stdev = np.full(len(ind), 2.0)
+        scaled = np.isin(code, (MULTI_CONTACT, AS_TGAUSS, RS_CONTACT))
+        stdev[scaled] = self._get_sigmas(store, ind[scaled], pos, at,
+                                         scaled=True)
+        stdev = np.where(code == MULTI_CONTACT, stdev / modal / modal, stdev)
+        nuc = code == NUC_CONTACT
+        stdev[nuc] = self._get_sigmas(store, ind[nuc], pos, at, scaled=False)
+        a0 = pos[store.atoms_start[ind]]
+        a1 = pos[store.atoms_start[ind] + 1]
+        delE = tgparams.get_dele_array([at.resind[a0], at.resind[a1]],
+                                       local=code == LOCAL, nuc=nuc)
+
+        key = (truncated * 65536 + modal) * 65536 + nmean
+        for k in np.unique(key).tolist():
+            g = np.flatnonzero(key == k)
+            k, nm = divmod(k, 65536)
+            trunc, m = divmod(k, 65536)
+            gind = ind[g]
+            # Each Gaussian's mean is repeated modal times
+            mean_step = np.where(multi[g], 1, 0)[:, np.newaxis]
+            means = store.params[mean_first[g][:, np.newaxis]
+                                 + mean_step * np.arange(nm)]
+            values = [np.full((len(g), m), 1.0 / m), means,
+                      np.repeat(stdev[g][:, np.newaxis], m, axis=1)]
+            if trunc:
+                values.insert(0, np.column_stack(
+                    (delE[g], np.full(len(g), tgparams.slope),
+                     np.full(len(g), tgparams.scl_delx))))
+            nv = 3 * trunc + 2 * m + nm
+            header = np.column_stack(
+                (np.full(len(g), 50 if trunc else 4), np.full(len(g), m),
+                 store.feat[gind], store.group[gind], np.full(len(g), 2),
+                 np.full(len(g), nv), np.ones(len(g))))
+            fmt = ('R %4d%4d%4d%4d%4d%4d%4d%6d%6d    '
+                   + ' '.join(['%9.4f'] * nv) + '\n')
+            yield gind, fmt, (header,
+                              self._get_atom_indices(store, gind, 2, pos, at),
+                              *values)
+
+    def _write_splines(self, store, ind, pos, at):
+        """Format the given restraints, splines, as is. Return a list of
+           lines."""
+        if len(ind) == 0:
+            return []
+        # Right-justify every parameter to 9 characters (as '%9s' would),
+        # for all restraints at once
+        first = store.text_start[ind]
+        text_ind, text_off = ragged_index(first, store.text_start[ind + 1]
+                                          - first)
+        text = store.text[text_ind]
+        is_tok = ~np.isin(text, np.frombuffer(b' \t\r\n', dtype=np.uint8))
+        prev_tok = np.empty(len(text), dtype=bool)
+        prev_tok[0:1] = False
+        prev_tok[1:] = is_tok[:-1]
+        prev_tok[text_off[:-1][text_off[:-1] < len(text)]] = False
+        next_tok = np.empty(len(text), dtype=bool)
+        next_tok[-1:] = False
+        next_tok[:-1] = is_tok[1:]
+        next_tok[text_off[1:] - 1] = False
+        tok_start = np.flatnonzero(is_tok & ~prev_tok)
+        tok_len = np.flatnonzero(is_tok & ~next_tok) + 1 - tok_start
+        tok_owner = np.searchsorted(text_off, tok_start, side='right') - 1
+        last_tok = np.ones(len(tok_start), dtype=bool)
+        last_tok[:-1] = tok_owner[1:] != tok_owner[:-1]
+        # Each token is padded, then followed by a space (except the last)
+        out_len = np.maximum(tok_len, 9) + ~last_tok
+        out_start = np.cumsum(out_len) - out_len
+        out = np.full(out_len.sum(), ord(' '), dtype=np.uint8)
+        src, off = ragged_index(tok_start, tok_len)
+        dest = ragged_index(out_start + np.maximum(9 - tok_len, 0),
+                            tok_len)[0]
+        out[dest] = text[src]
+        params = out.tobytes().decode('latin-1')
+        param_end = np.zeros(len(ind) + 1, dtype=np.int64)
+        np.add.at(param_end, tok_owner + 1, out_len)
+        param_end = np.cumsum(param_end).tolist()
+
+        lines = []
+        for n, i in enumerate(ind.tolist()):
+            atoms = at.index[pos[store.atoms_start[i]:
+                                 store.atoms_start[i + 1]]]
+            if param_end[n + 1] > param_end[n] or store.nparam[i] == 0:
+                p = params[param_end[n]:param_end[n + 1]]
+            else:
+                p = ' '.join('%9s' % x for x in store.get_parameters(i))
+            lines.append('R %4d %3d %3d %3d %3d %3d %3d '
+                         % (store.form[i], store.modal[i], store.feat[i],
+                            store.group[i], len(atoms), store.nparam[i], 1)
+                         + ' '.join('%5d' % x for x in atoms.tolist())
+                         + '    ' + p + '\n')
+        return lines
+
+
+# RestraintEditor used by worker processes (see RestraintEditor.get_pool)
+_pool_editor = None
+
+
+def _pool_filter(chunk):
+    """Remove dropped restraints from classify_chunk() output"""
+    store, codes, counts, kept = chunk
+    kept = codes != DROP
+    keep = np.flatnonzero(kept)
+    return store.take(keep), codes[keep], counts, kept
+
+
+def _pool_classify(args):
+    fname, start, end, mask, count, keep_all = args
+    with open(fname, 'rb') as fh:
+        store = RestraintStore.read_range(fh, start, end)
+    chunk = _pool_editor.classify_chunk(store, mask, count)
+    # Return all restraints if needed to write the cache
+    return chunk if keep_all else _pool_filter(chunk)
+
+
+def _pool_classify_cache(args):
+    fname, start, end, mask, count = args
+    store, header = RestraintStore.load(fname)
+    return _pool_filter(_pool_editor.classify_chunk(
+        store.slice(start, end), mask, count))
+
+
+def _pool_write(args):
+    tgparams, sigmas, store, codes = args
+    # Sigmas may have changed since the worker was forked (see sweep())
+    _pool_editor.sigmas = sigmas
+    fh = io.StringIO()
+    _pool_editor.write_classified(tgparams, store, codes, fh)
+    return fh.getvalue()
 
 
 def parse_args():
@@ -565,6 +1278,36 @@ with AllosMod.
                     (AS v RS,SC v BB)
 <contact list>      list of PDB files used to define contact maps
 <atomlistASRS>      file labeling atoms as AS or RS
+
+By default, a binary cache of each restraints file is written in the same
+directory as that file, with the same name plus a .rsrcache suffix, so that
+later runs can read the restraints more quickly; use --no_cache to prevent
+this (for example, if the input directory should not be modified). The
+.rsrcache files are not removed automatically. Either restraints file can
+also be a binary cache.
+
+The contacts in each PDB file in <contact list>, and the DSSP secondary
+structure of <PDB file>, are also cached (unless --no_cache is given),
+keyed by the file contents, in the directory named by the ALLOSMOD_CACHE_DIR
+environment variable (by default, ~/.cache/allosmod).
+
+With --sweep, restraints are classified once and then written out for each
+set of parameters listed in the given file, one per line: output file name,
+delEmax, sigma_AS, sigma_RS and sigma_inter. Nothing is written to standard
+output, and the corresponding command line options are ignored.
+
+With --index, a classification index is also written. If a later run
+differs only in <atomlistASRS>, it can pass the previous output and index
+with --previous and --previous_index; then only restraints containing atoms
+whose AS/RS assignment changed are reprocessed, and the rest are copied
+from the previous output (which must not be the file being written to).
+
+With --delEmax=CALC, delEmax is calculated from the number of truncated
+Gaussian distance restraints (contacts) in a non-coarse landscape, N, and
+the number of residues and HETATM residues in <PDB file> (excluding nucleic
+acids), NRES and NHET, as 3.6*(NRES+NHET)/N. The folding temperature is
+estimated as 367*delEmax*N/(4*(NRES+NHET)); both are written to the file
+given by --delEmax_report.
 """
     parser = allosmod.util.ModellerOptionParser(usage)
     parser.add_option("--ntotal", type=int, default=1,
@@ -585,9 +1328,15 @@ with AllosMod.
                       dest="sig_inter", metavar='FLOAT',
                       help="Standard deviation for restraints between "
                            "the allosteric and regulated sites")
-    parser.add_option("--delEmax", type=float, default=0.1,
+    parser.add_option("--delEmax", type=str, default="0.1",
                       dest="delEmax", metavar='FLOAT',
-                      help="delEmax parameter for truncated Gaussian")
+                      help="delEmax parameter for truncated Gaussian, "
+                           "or CALC to calculate it (see above)")
+    parser.add_option("--delEmax_report", type=str, default=None,
+                      dest="delEmax_report", metavar='FILE',
+                      help="With --delEmax=CALC, write the calculated "
+                           "delEmax, number of contacts and estimated "
+                           "folding temperature to FILE")
     parser.add_option("--slope", type=float, default=4.0,
                       dest="slope", metavar='FLOAT',
                       help="slope parameter for truncated Gaussian")
@@ -603,10 +1352,47 @@ with AllosMod.
     parser.add_option("--locrigid", action='store_true',
                       dest="locrigid", metavar='BOOL',
                       help="Increase local rigidity")
+    parser.add_option("--jobs", type=int, default=1,
+                      dest="jobs", metavar='INT',
+                      help="Number of worker processes to use for editing "
+                           "restraints (default 1)")
+    parser.add_option("--no_cache", action='store_false', default=True,
+                      dest="cache",
+                      help="Don't read or write binary caches of the "
+                           "restraints files, contact maps or DSSP output "
+                           "(by default, a <file>.rsrcache cache is written "
+                           "next to each restraints file)")
+    parser.add_option("--sweep", type=str, default=None,
+                      dest="sweep", metavar='FILE',
+                      help="Write restraints for each set of parameters "
+                           "listed in FILE (see above)")
+    parser.add_option("--index", type=str, default=None,
+                      dest="index", metavar='FILE',
+                      help="Write a classification index to FILE")
+    parser.add_option("--previous", type=str, default=None,
+                      dest="previous", metavar='FILE',
+                      help="Output of a previous run, to be updated for "
+                           "a new <atomlistASRS> (see above)")
+    parser.add_option("--previous_index", type=str, default=None,
+                      dest="previous_index", metavar='FILE',
+                      help="Classification index of the previous run")
 
     opts, args = parser.parse_args()
     if len(args) != 5:
         parser.error("incorrect number of arguments")
+    if bool(opts.previous) != bool(opts.previous_index):
+        parser.error("--previous and --previous_index must be used together")
+    if opts.sweep and (opts.previous or opts.index):
+        parser.error("--sweep cannot be used with --index or --previous")
+    if opts.delEmax.upper() == 'CALC':
+        opts.delEmax = 'CALC'
+    else:
+        try:
+            opts.delEmax = float(opts.delEmax)
+        except ValueError:
+            parser.error("--delEmax must be a number or CALC")
+        if opts.delEmax_report:
+            parser.error("--delEmax_report requires --delEmax=CALC")
     return args + [opts]
 
 
@@ -624,8 +1410,19 @@ def main():
     e = RestraintEditor(listoth_rsr, listas_rs, pdb_file,
                         allosmod.util.read_templates(contacts_pdbs),
                         atomlist_asrs, sigmas, opts.cutoff, opts.delEmax,
-                        opts.break_file, opts.coarse, opts.locrigid)
-    e.edit(env)
+                        opts.break_file, opts.coarse, opts.locrigid,
+                        opts.jobs, opts.cache)
+    if opts.sweep:
+        with open(opts.sweep) as fh:
+            points = list(parse_sweep_file(fh))
+        e.sweep(env, points)
+    elif opts.previous:
+        e.update(env, opts.previous, opts.previous_index, opts.index)
+    else:
+        e.edit(env, opts.index)
+    if opts.delEmax_report and e.delEmax_calculation:
+        with open(opts.delEmax_report, 'w') as fh:
+            e.delEmax_calculation.write(fh)
 
 
 if __name__ == '__main__':
@@ -1,11 +1,12 @@
 """Get the allosteric site (all residues near the ligand)"""
 
-import modeller
 import os
 import allosmod.util
 from allosmod.salign0 import salign0
 from allosmod.get_inter_contacts import get_inter_contacts
 import sys
+import numpy as np
+from allosmod.util.snapshot import get_model_snapshot
 
 
 class AllostericSiteError(Exception):
@@ -28,6 +29,7 @@ class AllostericSiteFinder:
     def find(self):
         """Return a Modeller selection corresponding to the allosteric site.
            @raise AllostericSiteError on error."""
+        import modeller
         if self.__allosteric_site is None:
             # align PDB2 to PDB1 and superimpose antigen
             try:
@@ -40,13 +42,15 @@ class AllostericSiteFinder:
             pmfit = get_fit_filename(self.pdb2)
 
             # determine residues in PDB2 that contact LIG1
-            self.__pmfit = modeller.Model(self.env, file=pmfit)
+            pmfit_mdl = modeller.Model(self.env, file=pmfit)
             lig1 = modeller.Model(self.env, file=self.ligand)
-            self.__allosteric_site = \
-                modeller.Selection(
-                    [ri for ri, rj, dist
-                     in get_inter_contacts(self.env, self.__pmfit, lig1,
-                                           self.rcut)])
+            site = [ri for ri, rj, dist
+                    in get_inter_contacts(self.env, pmfit_mdl, lig1,
+                                          self.rcut)]
+            self.__allosteric_site = modeller.Selection(site)
+            # Keep just the topology of PDB2 for write_atom_list()
+            self.__pmfit = get_model_snapshot(self.env, pmfit)
+            self.__site_residues = [ri.index for ri in site]
             os.unlink(pmfit)
             os.unlink(get_fit_filename(self.pdb1))
             if len(self.__allosteric_site) == 0:
@@ -54,10 +58,10 @@ class AllostericSiteFinder:
         return self.__allosteric_site
 
     def write_atom_list(self, atomlist):
-        allosteric_site = self.find()
-        for n, atom in enumerate(self.__pmfit.atoms):
-            atomlist.write('%d ' % (n+1))
-            atomlist.write('AS\n' if atom in allosteric_site else 'RS\n')
+        self.find()
+        is_as = np.isin(self.__pmfit.atom_residue + 1, self.__site_residues)
+        atomlist.write(''.join('%d %s\n' % (n + 1, 'AS' if a else 'RS')
+                               for n, a in enumerate(is_as.tolist())))
 
 
 def parse_args():
@@ -85,6 +89,7 @@ of <ligand> (after superposition of <PDB 2> onto <PDB 1>).
 
 
 def main():
+    import modeller
     pdb1, ligand, pdb2, rcut, opts = parse_args()
     e = modeller.Environ()
     e.io.hetatm = True
@@ -3,53 +3,101 @@
 import optparse
 import math
 import collections
+import numpy as np
+from allosmod.util.restraints import ragged_index
 
 
 Residue = collections.namedtuple('Residue', ['r', 'average'])
 
 
-def _get_average(to_average):
-    x = sum(a.x for a in to_average)
-    y = sum(a.y for a in to_average)
-    z = sum(a.z for a in to_average)
-    return (x / len(to_average), y / len(to_average),
-            z / len(to_average))
-
-
-def _get_average_hem(r):
-    def get_av(names):
-        return _get_average([a for a in r.atoms if a.name in names])
-    return Residue(r, (get_av(['NA', 'C1A', 'C2A', 'C3A', 'C4A']),
-                       get_av(['NB', 'C1B', 'C2B', 'C3B', 'C4B']),
-                       get_av(['NC', 'C1C', 'C2C', 'C3C', 'C4C']),
-                       get_av(['ND', 'C1D', 'C2D', 'C3D', 'C4D'])))
+_MAIN_CHAIN_ATOMS = ['O', 'N', 'C', 'OT', 'CA', 'CB']
+_HEM_RINGS = [['NA', 'C1A', 'C2A', 'C3A', 'C4A'],
+              ['NB', 'C1B', 'C2B', 'C3B', 'C4B'],
+              ['NC', 'C1C', 'C2C', 'C3C', 'C4C'],
+              ['ND', 'C1D', 'C2D', 'C3D', 'C4D']]
+
+
+def get_residue_centers(residues, hem=True):
+    """Get the representative centers of all residues in one pass.
+       Return an Nx3 array of center coordinates, and an array giving the
+       index into `residues` of each center.
+
+       For most residues, the center is the mass center of all heavy atoms
+       in the sidechain, plus CB (for all residues except GLY) or CA (for
+       GLY); if there are no such atoms, the CA, O or N atom (in that order)
+       is used. If `hem` is True, HEM residues have four centers, one for
+       each pyrrole ring."""
+    names, xyz, atom_res, resnames = [], [], [], []
+    for n, r in enumerate(residues):
+        resnames.append(r.pdb_name)
+        for a in r.atoms:
+            names.append(a.name)
+            xyz.append((a.x, a.y, a.z))
+            atom_res.append(n)
+    nres = len(resnames)
+    names = np.array(names, dtype=str)
+    xyz = np.array(xyz, dtype=float).reshape(-1, 3)
+    atom_res = np.array(atom_res, dtype=np.intp)
+    resnames = np.array(resnames, dtype=str)
+    is_hem = (resnames == 'HEM') if hem else np.zeros(nres, dtype=bool)
+    is_gly = (resnames == 'GLY')[atom_res]
+
+    ncenter = np.where(is_hem, len(_HEM_RINGS), 1)
+    owner = np.repeat(np.arange(nres), ncenter)
+    first_center = np.cumsum(ncenter) - ncenter
+    # Map each atom to the center it contributes to, or -1 for none
+    center = np.full(len(names), -1, dtype=np.intp)
+    aa = ~is_hem[atom_res]
+    sidechain = aa & (~np.isin(names, _MAIN_CHAIN_ATOMS)
+                      | ((names == 'CA') & is_gly)
+                      | ((names == 'CB') & ~is_gly))
+    center[sidechain] = first_center[atom_res[sidechain]]
+    for ring, ring_names in enumerate(_HEM_RINGS):
+        inring = ~aa & np.isin(names, ring_names)
+        center[inring] = first_center[atom_res[inring]] + ring
+
+    # Sum coordinates in atom order (so results match a simple Python sum)
+    used = center >= 0
+    count = np.bincount(center[used], minlength=len(owner))
+    coords = np.empty((len(owner), 3), dtype=float)
+    for k in range(3):
+        coords[:, k] = np.bincount(center[used], weights=xyz[used, k],
+                                   minlength=len(owner))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coords /= count[:, np.newaxis]
+
+    # Residues with no sidechain atoms use CA, O or N (in that order)
+    missing = np.nonzero(count == 0)[0]
+    if len(missing) > 0:
+        fallback = np.full(nres, -1, dtype=np.intp)
+        for typ in ('N', 'O', 'CA'):
+            ind = np.nonzero(aa & (names == typ))[0]
+            res, pos = np.unique(atom_res[ind], return_index=True)
+            fallback[res] = ind[pos]
+        atom = fallback[owner[missing]]
+        if np.any(atom < 0) or np.any(is_hem[owner[missing]]):
+            raise ValueError("no average")
+        coords[missing] = xyz[atom]
+    return coords, owner
+
+
+def _get_residue_averages(residues, coords, owner):
+    """Convert output from get_residue_centers() to a list of Residue
+       objects"""
+    centers = [tuple(c) for c in coords.tolist()]
+    start = np.searchsorted(owner, np.arange(len(residues) + 1)).tolist()
+    return [Residue(r, tuple(centers[start[i]:start[i + 1]]))
+            for i, r in enumerate(residues)]
 
 
 def _get_average_aa(r):
-    main_chain_atom_names = dict.fromkeys(['O', 'N', 'C', 'OT', 'CA', 'CB'])
-    to_average = []
-    for a in r.atoms:
-        if a.name not in main_chain_atom_names \
-          or (a.name == 'CA' and r.pdb_name == 'GLY') \
-          or (a.name == 'CB' and r.pdb_name != 'GLY'):
-            to_average.append(a)
-    if to_average:
-        return Residue(r, (_get_average(to_average),))
-    else:
-        for typ in ('CA', 'O', 'N'):
-            try:
-                a = r.atoms[typ]
-                return Residue(r, ((a.x, a.y, a.z),))
-            except KeyError:
-                pass
-    raise ValueError("no average")
+    coords, owner = get_residue_centers([r], hem=False)
+    return _get_residue_averages([r], coords, owner)[0]
 
 
 def get_average_coordinate(r):
-    if r.pdb_name == 'HEM':
-        return _get_average_hem(r)
-    else:
-        return _get_average_aa(r)
+    coords, owner = get_residue_centers([r])
+    return _get_residue_averages([r], coords, owner)[0]
 
 
 def get_contact_type(r1, r2):
@@ -81,6 +129,42 @@ def get_contact_dist(r1, r2, rcut2):
                 return math.sqrt(dist)
 
 
+def _get_close_points(coords, rcut, block_size=4096):
+    """Find all pairs of points in `coords` (an Nx3 array) that are closer
+       than `rcut`, using a uniform grid of cells of side `rcut` so that
+       only points in neighboring cells are compared.
+       Return arrays of the first and second point indices (i < j),
+       in no particular order."""
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    rcut = abs(rcut)
+    if len(coords) < 2 or rcut == 0.:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    # Pad by one cell on each side so that neighbor cells are never negative
+    cell = np.floor((coords - coords.min(axis=0)) / rcut).astype(np.int64) + 1
+    dims = cell.max(axis=0) + 2
+    key = (cell[:, 0] * dims[1] + cell[:, 1]) * dims[2] + cell[:, 2]
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    offsets = np.array([(dx * dims[1] + dy) * dims[2] + dz
+                        for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                        for dz in (-1, 0, 1)], dtype=np.int64)
+    found_i, found_j = [], []
+    for start in range(0, len(coords), block_size):
+        pi = np.arange(start, min(start + block_size, len(coords)))
+        nkey = (key[pi, np.newaxis] + offsets).ravel()
+        first = np.searchsorted(sorted_key, nkey, side='left')
+        last = np.searchsorted(sorted_key, nkey, side='right')
+        ind, cand = ragged_index(first, last - first)
+        i = np.repeat(np.repeat(pi, len(offsets)), np.diff(cand))
+        j = order[ind]
+        i, j = i[i < j], j[i < j]
+        d = coords[i] - coords[j]
+        close = np.einsum('ij,ij->i', d, d) < rcut * rcut
+        found_i.append(i[close])
+        found_j.append(j[close])
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+
 def get_contacts(pdb_file, rcut):
     import modeller
 
@@ -91,16 +175,21 @@ def get_contacts(pdb_file, rcut):
     m = modeller.Model(e, file=pdb_file)
 
     rcut2 = rcut * rcut
-    av = [get_average_coordinate(r) for r in m.residues]
-    for i in range(len(av) - 3):
-        for j in range(i + 3, len(av)):
-            ri = av[i].r
-            rj = av[j].r
-            if ri.hetatm and rj.hetatm:
-                continue  # do not print het-het contacts
-            dist = get_contact_dist(av[i], av[j], rcut2)
-            if dist is not None:
-                yield ri, rj, dist
+    residues = list(m.residues)
+    coords, owner = get_residue_centers(residues)
+    av = _get_residue_averages(residues, coords, owner)
+    # Find candidate residue pairs using all residue centers (HEM has 4).
+    # Use a slightly larger cutoff so that no pair is lost to rounding;
+    # get_contact_dist() then makes the final decision.
+    hetatm = np.array([r.hetatm for r in residues], dtype=bool)
+    pi, pj = _get_close_points(coords, abs(rcut) * (1. + 1e-6))
+    ri, rj = owner[pi], owner[pj]
+    keep = (rj >= ri + 3) & ~(hetatm[ri] & hetatm[rj])
+    pairs = np.unique((ri[keep].astype(np.int64) << 32) + rj[keep])
+    for i, j in zip(pairs >> 32, pairs & 0xffffffff):
+        dist = get_contact_dist(av[i], av[j], rcut2)
+        if dist is not None:
+            yield av[i].r, av[j].r, dist
 
 
 def parse_args():
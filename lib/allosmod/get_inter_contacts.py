@@ -1,20 +1,35 @@
 """Make a list of all contacts between two structures."""
 
+import numpy as np
 import allosmod.util
-from allosmod.get_contacts import _get_average_aa, get_contact_type
-from allosmod.get_contacts import get_contact_dist
+from allosmod.get_contacts import get_contact_type, get_contact_dist
+from allosmod.get_contacts import get_residue_centers, _get_residue_averages
+from allosmod.get_contacts import _get_close_points
 
 
 def get_inter_contacts(env, mdl1, mdl2, rcut):
-    av1 = [_get_average_aa(r) for r in mdl1.residues]
-    av2 = [_get_average_aa(r) for r in mdl2.residues]
+    res1 = list(mdl1.residues)
+    res2 = list(mdl2.residues)
+    coords1, owner1 = get_residue_centers(res1, hem=False)
+    coords2, owner2 = get_residue_centers(res2, hem=False)
+    av1 = _get_residue_averages(res1, coords1, owner1)
+    av2 = _get_residue_averages(res2, coords2, owner2)
 
     rcut2 = rcut * rcut
-    for i in av1:
-        for j in av2:
-            dist = get_contact_dist(i, j, rcut2)
-            if dist is not None:
-                yield i.r, j.r, dist
+    # Search for candidates using both sets of centers together, keeping
+    # only pairs between the sets; get_contact_dist() makes the final
+    # decision (see get_contacts())
+    pi, pj = _get_close_points(np.concatenate((coords1, coords2)),
+                               abs(rcut) * (1. + 1e-6))
+    n1 = len(coords1)
+    between = (pi < n1) & (pj >= n1)
+    i = owner1[pi[between]].astype(np.int64)
+    j = owner2[pj[between] - n1]
+    pairs = np.unique((i << 32) + j)
+    for i, j in zip(pairs >> 32, pairs & 0xffffffff):
+        dist = get_contact_dist(av1[i], av2[j], rcut2)
+        if dist is not None:
+            yield av1[i].r, av2[j].r, dist
 
 
 def parse_args():
@@ -2,9 +2,6 @@
 
 import shutil
 import os
-import modeller
-import modeller.automodel
-import modeller.scripts
 import random
 import allosmod.util
 
@@ -15,6 +12,7 @@ def get_target(e, target, aln_file):
     if target:
         return target
     else:
+        import modeller
         aln = modeller.Alignment(e, file=aln_file)
         return aln[0].code
 
@@ -23,6 +21,8 @@ def get_pm_initialstruct(aln_file, templates, pdb_dir, nmodel,
                          refine_level, opts):
     # Note the assumption is made in this code that the align code and the
     # PDB file are the same. This is not necessarily the case in Modeller.
+    import modeller
+    import modeller.automodel
     env = modeller.Environ(rand_seed=random.randint(-40000, -2))
     target = get_target(env, opts.target, aln_file)
     dirname = 'pred_%s' % templates[0]
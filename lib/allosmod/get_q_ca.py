@@ -2,7 +2,9 @@
 
 import optparse
 import math
-from allosmod.get_qiavg_ca import get_distance, get_coordinates
+import numpy as np
+from allosmod.get_qiavg_ca import TargetDistances, read_coordinates
+from allosmod.get_qiavg_ca import _get_square_distances
 
 
 class QScore:
@@ -14,6 +16,11 @@ class QScore:
         self.q += val
         self.count += 1
 
+    def add_all(self, vals):
+        """Add a list of values; equivalent to calling add() for each"""
+        self.q = sum(vals, self.q)
+        self.count += len(vals)
+
     def average(self):
         if self.count == 0:
             return 0.
@@ -43,33 +50,42 @@ class QScores:
         else:
             self.ql.add(qcont)
 
+    def add_all(self, dij, qcont):
+        """Add contributions for arrays of residue separations and Q
+           contributions; equivalent to calling add() for each pair"""
+        self.q.add_all(qcont.tolist())
+        self.qs.add_all(qcont[dij < 5].tolist())
+        self.qm.add_all(qcont[(dij >= 5) & (dij < 13)].tolist())
+        self.ql.add_all(qcont[dij >= 13].tolist())
+
 
-def get_distances(coord, resdelta=1):
-    dist = {}
-    for i in range(len(coord) - resdelta):
-        for j in range(i + resdelta, len(coord)):
-            d = get_distance(coord[i], coord[j])
-            if d is not None:
-                dist[(i, j)] = math.sqrt(d)
-    return dist
+def get_distances(xyz, resdelta=2):
+    """Get a TargetDistances object for all pairs of residues (i, j),
+       j >= i + `resdelta`, in the given target coordinates (as returned by
+       read_coordinates()) where both residues have coordinates"""
+    i, j = np.triu_indices(len(xyz), k=resdelta)
+    d = _get_square_distances(xyz, i, j)
+    ok = np.isfinite(d)
+    i, j = i[ok], j[ok]
+    powers = np.array([float(k) ** 0.15 for k in range(len(xyz))])
+    return TargetDistances(i, j, np.sqrt(d[ok]), powers[j - i])
 
 
 def get_qi_ca(m, len_coord, dist, template, rcut):
     q_tot = QScores()
     q_cut = QScores()
-    coord = get_coordinates(m, template)
-    if len(coord) != len_coord:
+    xyz = read_coordinates(template, m)
+    if len(xyz) != len_coord:
         raise ValueError("different numbers of residues")
-    for i in range(len(coord) - 2):
-        for j in range(i + 2, len(coord)):
-            if (i, j) not in dist:
-                continue
-            d = get_distance(coord[i], coord[j])
-            if d is not None:
-                delta = dist[(i, j)] - math.sqrt(d)
-                q_tot.add(i, j, delta)
-                if dist[(i, j)] < rcut:
-                    q_cut.add(i, j, delta)
+    d = _get_square_distances(xyz, dist.i, dist.j)
+    ok = np.isfinite(d)
+    dij = dist.j[ok] - dist.i[ok]
+    delta = (dist.dist[ok] - np.sqrt(d[ok])) / dist.scale[ok]
+    # Use math.exp rather than np.exp, for results identical to QScores.add()
+    qcont = np.array([math.exp(x) for x in (-delta * delta * 0.5).tolist()])
+    q_tot.add_all(dij, qcont)
+    cut = dist.dist[ok] < rcut
+    q_cut.add_all(dij[cut], qcont[cut])
     return q_tot, q_cut
 
 
@@ -80,19 +96,12 @@ def write_q_scores(qs, fh):
 
 
 def get_q_ca(target, templates, rcut):
-    import modeller
-
-    modeller.log.none()
-    e = modeller.Environ()
-    e.io.hetatm = False
-
-    m = modeller.Model(e)
-    coord = get_coordinates(m, target)
+    coord = read_coordinates(target)
     dist = get_distances(coord)
     q_tot = []
     q_cut = []
     for template in templates:
-        t, c = get_qi_ca(m, len(coord), dist, template, rcut)
+        t, c = get_qi_ca(None, len(coord), dist, template, rcut)
         q_tot.append(t)
         q_cut.append(c)
     write_q_scores(q_tot, open('qscore1to%d.dat' % len(coord), 'w'))
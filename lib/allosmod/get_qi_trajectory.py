@@ -0,0 +1,159 @@
+"""Calculate Qi and Q for every snapshot of one or more simulations."""
+
+import optparse
+import os
+import re
+import multiprocessing
+import numpy as np
+from allosmod.get_qiavg_ca import read_coordinates, get_distances
+from allosmod.get_qiavg_ca import get_qi_sums, _write_qi
+
+
+# Target distances, used by worker processes (set before forking)
+_pool_distances = None
+
+# Number of snapshots handled by each worker task; this (times the number
+# of residues and processes) bounds the memory used for results in flight
+frames_per_block = 64
+
+# Intermediate models written by AllosModel during sampling are named
+# like pm.pdb.B10010001.pdb, where the first number counts up from 1001;
+# B9999xxxx is the final model
+_snapshot_re = re.compile(r'\.B(\d{4})\d{4}\.pdb$')
+
+
+def _is_snapshot(fname):
+    m = _snapshot_re.search(fname)
+    return m is not None and 1000 < int(m.group(1)) < 9999
+
+
+def find_snapshots(dirs):
+    """Find all snapshot PDB files in the given directories and any
+       subdirectories. Files are returned in order of directory and then
+       in trajectory order."""
+    snapshots = []
+    for top in dirs:
+        if not os.path.isdir(top):
+            raise ValueError("%s is not a directory" % top)
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            snapshots.extend(os.path.join(dirpath, f)
+                             for f in sorted(filenames) if _is_snapshot(f))
+    return snapshots
+
+
+def get_frame_qi(dist, fnames, numres):
+    """Get Qi for each residue (NaN for residues with no contacts) and Q
+       for each of the named snapshot files, as an array of shape
+       (len(fnames), numres) and an array of length len(fnames)"""
+    qi = np.full((len(fnames), numres), np.nan)
+    q = np.full(len(fnames), np.nan)
+    for n, fname in enumerate(fnames):
+        xyz = read_coordinates(fname)
+        if len(xyz) != numres:
+            raise ValueError("%s: different numbers of residues" % fname)
+        qsum, count = get_qi_sums(dist, xyz)
+        found = count > 0
+        qi[n, found] = qsum[found] / count[found]
+        if np.any(found):
+            q[n] = qsum.sum() / count.sum()
+    return qi, q
+
+
+def _get_pool_frame_qi(block):
+    fnames, numres = block
+    return get_frame_qi(_pool_distances, fnames, numres)
+
+
+def _get_frame_blocks(dist, fnames, numres, jobs):
+    """Yield Qi and Q for blocks of snapshots, in order, using up to
+       `jobs` processes"""
+    global _pool_distances
+    blocks = [(fnames[start:start + frames_per_block], numres)
+              for start in range(0, len(fnames), frames_per_block)]
+    if jobs > 1 and len(blocks) > 1:
+        _pool_distances = dist
+        try:
+            with multiprocessing.get_context('fork').Pool(
+                    min(jobs, len(blocks))) as pool:
+                for result in pool.imap(_get_pool_frame_qi, blocks):
+                    yield result
+        finally:
+            _pool_distances = None
+    else:
+        for fn, nres in blocks:
+            yield get_frame_qi(dist, fn, nres)
+
+
+def get_qi_trajectory(target, dirs, rcut, jobs=1):
+    """Calculate Qi and Q against `target` for every snapshot in `dirs`.
+       Qi for each residue in each frame is written to qi_frames.npy
+       (a float32 array with one row per residue and one column per
+       frame), Q and the file name of each frame to q_frames.dat, and
+       the average Qi to qi_avg.dat (in the same format as
+       get_qiavg_ca)."""
+    fnames = find_snapshots(dirs)
+    if not fnames:
+        raise ValueError("No snapshots found in %s" % ", ".join(dirs))
+    coord = read_coordinates(target)
+    numres = len(coord)
+    dist = get_distances(coord, rcut)
+    avg_qi = np.zeros(numres)
+    navg_qi = np.zeros(numres, dtype=np.int64)
+    # Store as Fortran order so that each frame is contiguous on disk
+    qi_frames = np.lib.format.open_memmap(
+        'qi_frames.npy', mode='w+', dtype=np.float32,
+        shape=(numres, len(fnames)), fortran_order=True)
+    start = 0
+    with open('q_frames.dat', 'w') as fh:
+        for qi, q in _get_frame_blocks(dist, fnames, numres, jobs):
+            end = start + len(q)
+            qi_frames[:, start:end] = qi.T
+            # Add one frame at a time, to match get_qiavg_ca
+            for frame_qi in qi:
+                found = ~np.isnan(frame_qi)
+                avg_qi[found] += frame_qi[found]
+                navg_qi[found] += 1
+            for n, (fname, qval) in enumerate(zip(fnames[start:end],
+                                                  q.tolist())):
+                fh.write("%6d %9.4f %s\n" % (start + n + 1, qval, fname))
+            start = end
+    qi_frames.flush()
+    del qi_frames
+    found = navg_qi > 0
+    avg_qi[found] /= navg_qi[found]
+    avg_qi[~found] = 1.1
+    with open('qi_avg.dat', 'w') as fh:
+        _write_qi(avg_qi, fh)
+
+
+def parse_args():
+    usage = """%prog [opts] <target PDB> <cutoff> <directory> [...]
+
+Calculate Qi (for CA atoms) and Q, relative to a target structure, for
+every snapshot written during AllosMod sampling (files named like
+pm.pdb.B10010001.pdb) in the given directories and their subdirectories
+(e.g. pred_dE*/ directories).
+
+Per-residue Qi for every frame is written to qi_frames.npy, a NumPy
+float32 array with one row per residue and one column per frame (NaN
+where a residue has no contacts). Q and the file name of each frame are
+written to q_frames.dat, and Qi averaged over all frames to qi_avg.dat.
+"""
+    parser = optparse.OptionParser(usage)
+    parser.add_option("--jobs", type=int, default=1,
+                      dest="jobs", metavar='INT',
+                      help="Number of worker processes to use (default 1)")
+    options, args = parser.parse_args()
+    if len(args) < 3:
+        parser.error("incorrect number of arguments")
+    return args[0], float(args[1]), args[2:], options
+
+
+def main():
+    target, cutoff, dirs, opts = parse_args()
+    get_qi_trajectory(target, dirs, cutoff, opts.jobs)
+
+
+if __name__ == '__main__':
+    main()
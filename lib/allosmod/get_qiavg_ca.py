@@ -6,6 +6,18 @@ to a reference structure and a score of 0 implies all contacts are different.
 
 import optparse
 import math
+import collections
+import functools
+import numpy as np
+from allosmod.get_contacts import _get_close_points
+from allosmod.util.snapshot import read_ca_p_coordinates, UnsupportedPDBError
+
+
+# Target distances for all pairs of residues (i, j) with |i-j| >= 2 that
+# are within the cutoff, in both directions, sorted by i and then j.
+# `scale` is |i-j|^0.15 for each pair.
+TargetDistances = collections.namedtuple('TargetDistances',
+                                         ['i', 'j', 'dist', 'scale'])
 
 
 def get_coordinates(m, fname):
@@ -27,64 +39,115 @@ def get_distance(ci, cj):
         return dx * dx + dy * dy + dz * dz
 
 
-def get_distances(coord, rcut):
+def get_coordinate_array(coord):
+    """Convert the output of get_coordinates() to an Nx3 array, with NaN
+       for residues that have no CA or P atom"""
+    return np.array([(c.x, c.y, c.z) if c is not None else (np.nan,) * 3
+                     for c in coord], dtype=float).reshape(-1, 3)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model():
+    """Get a Modeller model, set up to read PDB files for Q"""
+    import modeller
+
+    modeller.log.none()
+    e = modeller.Environ()
+    e.io.hetatm = False
+    return modeller.Model(e)
+
+
+def read_coordinates(fname, m=None):
+    """Get an Nx3 array of the CA (or P) coordinates of each residue in the
+       named PDB file, with NaN for residues that have neither. The file is
+       read directly if possible; otherwise, it is read with Modeller
+       into the model `m` (or a shared model, if `m` is None)."""
+    try:
+        return read_ca_p_coordinates(fname)
+    except UnsupportedPDBError:
+        pass
+    if m is None:
+        m = _get_model()
+    return get_coordinate_array(get_coordinates(m, fname))
+
+
+def _get_square_distances(xyz, i, j):
+    """Get squared distances between the given pairs of points, summed
+       in the same order as get_distance()"""
+    d = xyz[i] - xyz[j]
+    return d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2]
+
+
+def get_distances(xyz, rcut):
+    """Get a TargetDistances object for the given target coordinates
+       (as returned by read_coordinates())"""
     rcut2 = rcut * rcut
-    dist = {}
-    for i in range(len(coord) - 1):
-        for j in range(i + 1, len(coord)):
-            d = get_distance(coord[i], coord[j])
-            if d is not None and d < rcut2:
-                dist[(i, j)] = dist[(j, i)] = math.sqrt(d)
-    return dist
+    ok = np.flatnonzero(np.all(np.isfinite(xyz), axis=1))
+    # Find candidates with a slightly larger cutoff, then make the final
+    # decision using exactly the same arithmetic as get_distance()
+    pi, pj = _get_close_points(xyz[ok], abs(rcut) * (1. + 1e-6))
+    i, j = ok[pi], ok[pj]
+    d = _get_square_distances(xyz, i, j)
+    keep = (d < rcut2) & (np.abs(i - j) >= 2)
+    i, j, d = i[keep], j[keep], np.sqrt(d[keep])
+    i, j = np.concatenate((i, j)), np.concatenate((j, i))
+    order = np.lexsort((j, i))
+    i, j, d = i[order], j[order], np.concatenate((d, d))[order]
+    powers = np.array([float(k) ** 0.15 for k in range(len(xyz))])
+    return TargetDistances(i, j, d, powers[np.abs(i - j)])
+
+
+def get_qi_sums(dist, xyz):
+    """Get the sum of the Q contributions of each residue's contacts in
+       the given TargetDistances, for template coordinates `xyz`, and the
+       number of contacts summed (those where both residues have
+       coordinates in the template)"""
+    d = _get_square_distances(xyz, dist.i, dist.j)
+    ok = np.isfinite(d)
+    delta = (dist.dist[ok] - np.sqrt(d[ok])) / dist.scale[ok]
+    # Use math.exp rather than np.exp, which can differ in the last bit
+    # on some platforms; bincount sums each residue's terms in order, like
+    # a simple Python sum. Together these give results identical to a
+    # pure Python implementation.
+    gauss = [math.exp(x) for x in (-delta * delta * 0.5).tolist()]
+    return (np.bincount(dist.i[ok], weights=gauss, minlength=len(xyz)),
+            np.bincount(dist.i[ok], minlength=len(xyz)))
 
 
 def get_qi_ca(m, len_coord, dist, template, avg_qi_cut, navg_qi_cut, fh):
-    coord = get_coordinates(m, template)
-    if len(coord) != len_coord:
+    """Write Qi for each residue in `template` to `fh`, and add it to the
+       running totals in the `avg_qi_cut` and `navg_qi_cut` arrays"""
+    xyz = read_coordinates(template, m)
+    if len(xyz) != len_coord:
         raise ValueError("different numbers of residues")
-    qi_cut = [0.] * len(coord)
-    nqi_cut = [0] * len(coord)
-    for i in range(len(coord)):
-        for j in range(len(coord)):
-            if abs(i - j) < 2 or (i, j) not in dist:
-                continue
-            d = get_distance(coord[i], coord[j])
-            if d is not None:
-                delta = (dist[(i, j)] - math.sqrt(d)) / (abs(j - i) ** 0.15)
-                qi_cut[i] += math.exp(-delta * delta * 0.5)
-                nqi_cut[i] += 1
-    for i in range(len(coord)):
-        if nqi_cut[i] > 0:
-            qi_cut[i] /= nqi_cut[i]
-            avg_qi_cut[i] += qi_cut[i]
-            navg_qi_cut[i] += 1
-        else:
-            qi_cut[i] = 1.1
-        print("%6d %9.4f" % (i+1, qi_cut[i]), file=fh)
+    qi_cut, nqi_cut = get_qi_sums(dist, xyz)
+    found = nqi_cut > 0
+    qi_cut[found] /= nqi_cut[found]
+    avg_qi_cut[found] += qi_cut[found]
+    navg_qi_cut[found] += 1
+    qi_cut[~found] = 1.1
+    _write_qi(qi_cut, fh)
 
 
-def get_qiavg_ca(target, templates, rcut):
-    import modeller
+def _write_qi(qi, fh):
+    fh.write(''.join("%6d %9.4f\n" % (i + 1, q)
+                     for i, q in enumerate(qi.tolist())))
 
-    modeller.log.none()
-    e = modeller.Environ()
-    e.io.hetatm = False
 
-    m = modeller.Model(e)
-    coord = get_coordinates(m, target)
+def get_qiavg_ca(target, templates, rcut):
+    coord = read_coordinates(target)
     dist = get_distances(coord, rcut)
-    avg_qi_cut = [0.] * len(coord)
-    navg_qi_cut = [0] * len(coord)
+    avg_qi_cut = np.zeros(len(coord))
+    navg_qi_cut = np.zeros(len(coord), dtype=np.int64)
     for n, template in enumerate(templates):
-        get_qi_ca(m, len(coord), dist, template, avg_qi_cut, navg_qi_cut,
-                  open('qi_%d.dat' % (n+1), 'w'))
+        with open('qi_%d.dat' % (n+1), 'w') as fh:
+            get_qi_ca(None, len(coord), dist, template, avg_qi_cut,
+                      navg_qi_cut, fh)
+    found = navg_qi_cut > 0
+    avg_qi_cut[found] /= navg_qi_cut[found]
+    avg_qi_cut[~found] = 1.1
     with open('qi_avg.dat', 'w') as fh:
-        for i in range(len(coord)):
-            if navg_qi_cut[i] > 0:
-                avg_qi_cut[i] /= navg_qi_cut[i]
-            else:
-                avg_qi_cut[i] = 1.1
-            print("%6d %9.4f" % (i+1, avg_qi_cut[i]), file=fh)
+        _write_qi(avg_qi_cut, fh)
 
 
 def parse_args():
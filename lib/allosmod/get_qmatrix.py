@@ -1,100 +1,381 @@
 """Calculate q matrix for given proteins."""
 
 import optparse
-import math
 import random
-from allosmod.get_qiavg_ca import get_coordinates, get_distance
-from allosmod.get_q_ca import QScore
-
-
-def get_squared_distances(coord):
-    dist = {}
-    for i in range(len(coord) - 2):
-        for j in range(i + 2, len(coord)):
-            d = get_distance(coord[i], coord[j])
-            if d is not None:
-                dist[(i, j)] = d
-    return dist
-
-
-def get_template_distances(m, numres, template):
-    coord = get_coordinates(m, template)
-    return get_squared_distances(coord)
-
-
-def write_q_output(q_cuts, templates, mat_fh, avg_fh):
-    def get_q(q_cuts, temp1, temp2):
-        return q_cuts.get((temp1, temp2), None) \
-               or q_cuts.get((temp2, temp1), None) or 1.0
-    qavg = QScore()
-    for itg, template in enumerate(templates):
-        qs = [get_q(q_cuts, itg, jtg) for jtg in range(len(templates))]
-        for jtg, q in enumerate(qs):
-            if jtg != itg:
-                qavg.add(q)
-        print(template + "".join(" %.4f" % q for q in qs), file=mat_fh)
-    print("Qa,b: %.2f" % qavg.average(), file=avg_fh)
-
-
-def make_matrix_from_dists(templates, dists, numres, rcut2):
-    q_cuts = {}
-    for itg in range(len(templates) - 1):
-        for jtg in range(itg + 1, len(templates)):
-            q_cuts[(itg, jtg)] = q_cut = QScore()
-            for i in range(numres - 2):
-                for j in range(i + 2, numres):
-                    ditg = dists[itg].get((i, j), None)
-                    djtg = dists[jtg].get((i, j), None)
-                    if ditg is None or djtg is None:
-                        continue
-                    if ditg < rcut2 or djtg < rcut2:
-                        delta = (math.sqrt(ditg) - math.sqrt(djtg)) \
-                                / (abs(j-i) ** 0.15)
-                        q_cut.add(math.exp(-delta * delta * 0.5))
-    for k in q_cuts.keys():
-        q_cuts[k] = q_cuts[k].average()
-    return q_cuts
-
-
-def get_qmatrix(target, templates, rcut):
-    import modeller
-
-    rcut2 = rcut * rcut
-    modeller.log.none()
-    e = modeller.Environ()
-    e.io.hetatm = False
-
-    m = modeller.Model(e, file=target)
-    numres = len(m.residues)
-    dists = []
-    for template in templates:
-        dists.append(get_template_distances(m, numres, template))
-    q_cuts = make_matrix_from_dists(templates, dists, numres, rcut2)
-    write_q_output(q_cuts, templates, open('qmatrix.dat', 'w'),
-                   open('cq_aq_qavg_qsd.dat', 'w'))
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+from allosmod.get_qiavg_ca import read_coordinates
+from allosmod.get_qiavg_ca import _get_square_distances
+
+
+# Distances of all templates, used by worker processes (set before forking)
+_pool_distances = None
+
+# Maximum size (in bytes) of template distances to keep in memory; larger
+# sets of distances are stored in a memory-mapped temporary file
+max_memory = 1 << 30
+
+# Maximum number of template-residue pair distances (or Q matrix
+# elements) to handle at once
+max_block_size = 1 << 22
+
+# Number of template pairs for which exact Q is calculated to estimate
+# the error in the approximate (landmark) Q matrix
+n_check = 200
+
+
+def _empty_array(shape, dtype):
+    """Make a new uninitialized array. If it is larger than max_memory,
+       it is memory-mapped from a temporary file."""
+    if np.prod(shape) * np.dtype(dtype).itemsize > max_memory:
+        with tempfile.TemporaryFile() as fh:
+            # The mapping remains valid after the file is closed
+            return np.memmap(fh, dtype=dtype, mode='w+', shape=shape)
+    else:
+        return np.empty(shape, dtype=dtype)
+
+
+class TemplateDistances:
+    """Distances between all pairs of residues (i, j), j >= i+2, in each
+       of a set of templates, stored as float32 condensed arrays (one row
+       per template, with pairs ordered by i and then j).
+
+       NaN is stored for pairs where either residue has no CA or P atom.
+       Pairs closer than the cutoff are stored as negative distances, so
+       that the cutoff is applied exactly once, using the original double
+       precision squared distance."""
+
+    def __init__(self, numres, ntemplates, rcut):
+        self.numres, self.rcut2 = numres, rcut * rcut
+        self.i, self.j = np.triu_indices(numres, k=2)
+        powers = np.array([float(k) ** 0.15 for k in range(numres)])
+        self.scale = powers[self.j - self.i]
+        self.dist = _empty_array((ntemplates, len(self.i)), np.float32)
+
+    def __len__(self):
+        return len(self.dist)
+
+    def set_coordinates(self, n, coord):
+        """Set distances for the nth template from its coordinates
+           (as returned by read_coordinates()). Residues beyond the number
+           in the target are ignored."""
+        xyz = np.full((self.numres, 3), np.nan)
+        c = coord[:self.numres]
+        xyz[:len(c)] = c
+        d2 = _get_square_distances(xyz, self.i, self.j)
+        d = np.sqrt(d2)
+        d[np.isnan(d)] = np.nan  # Make sure the sign bit is clear
+        d[d2 < self.rcut2] *= -1.
+        self.dist[n] = d
+
+    def get_q_sums(self, itg, start, end):
+        """Get the Q contributions of all pairs that are within the cutoff
+           in template `itg`, against templates `start` through `end`-1.
+           Return the sum and count over all such pairs, and the sum and
+           count over the subset of those pairs that are also within the
+           cutoff in the other template."""
+        d = self.dist[itg]
+        near = np.flatnonzero(np.signbit(d))
+        di = -d[near].astype(np.float64)
+        scale = self.scale[near]
+        others = np.asarray(self.dist[start:end, near], dtype=np.float64)
+        valid = ~np.isnan(others)
+        both = np.signbit(others)
+        delta = (di - np.abs(others)) / scale
+        q = np.exp(-delta * delta * 0.5)
+        q[~valid] = 0.
+        return (q.sum(axis=1), valid.sum(axis=1),
+                np.where(both, q, 0.).sum(axis=1), both.sum(axis=1))
+
+    def get_q_rows(self, start, end):
+        """Get partial Q sums and counts for templates `start` through
+           `end`-1 against all templates (see make_matrix_from_dists())"""
+        ntemp = len(self.dist)
+        qsum = np.zeros((end - start, ntemp))
+        qcount = np.zeros((end - start, ntemp), dtype=np.int64)
+        for itg in range(start, end):
+            nnear = max(1, np.count_nonzero(np.signbit(self.dist[itg])))
+            step = max(1, max_block_size // nnear)
+            for jstart in range(0, ntemp, step):
+                jend = min(jstart + step, ntemp)
+                s, c, sboth, cboth = self.get_q_sums(itg, jstart, jend)
+                qsum[itg - start, jstart:jend] = s - 0.5 * sboth
+                qcount[itg - start, jstart:jend] = 2 * c - cboth
+        return start, qsum, qcount
+
+    def get_q(self, itg, start, end):
+        """Get exact Q between template `itg` and templates `start`
+           through `end`-1 (0 where there are no pairs within the cutoff)"""
+        d = np.asarray(self.dist[itg])
+        near = np.signbit(d)
+        valid = ~np.isnan(d)
+        q = np.zeros(end - start)
+        step = max(1, max_block_size // max(1, len(d)))
+        for jstart in range(start, end, step):
+            jend = min(jstart + step, end)
+            others = np.asarray(self.dist[jstart:jend])
+            mask = (np.signbit(others) | near) & valid & ~np.isnan(others)
+            rows, cols = np.nonzero(mask)
+            delta = (np.abs(d[cols].astype(np.float64))
+                     - np.abs(others[rows, cols].astype(np.float64))) \
+                / self.scale[cols]
+            qsum = np.bincount(rows, weights=np.exp(-delta * delta * 0.5),
+                               minlength=jend - jstart)
+            count = np.bincount(rows, minlength=jend - jstart)
+            np.divide(qsum, count, out=q[jstart - start:jend - start],
+                      where=count > 0)
+        return q
+
+
+def get_template_distances(m, numres, templates, rcut):
+    """Read all templates and return their TemplateDistances"""
+    dists = TemplateDistances(numres, len(templates), rcut)
+    for n, template in enumerate(templates):
+        dists.set_coordinates(n, read_coordinates(template, m))
+    return dists
+
+
+def _get_pool_q_rows(block):
+    return _pool_distances.get_q_rows(*block)
+
+
+def make_matrix_from_dists(dists, jobs=1, block_size=16):
+    """Get the matrix of Q between every pair of templates, given their
+       TemplateDistances. Q is averaged over all residue pairs that are
+       within the cutoff in either template (and 0 if there are no such
+       pairs, and on the diagonal). Templates are handled in blocks of
+       `block_size`, using up to `jobs` processes.
+
+       Each pair of residues that is within the cutoff in both templates
+       is seen from both sides, so is counted with weight 1/2 from each.
+
+       Like the distances, the matrix is memory-mapped from a temporary
+       file if it is larger than max_memory."""
+    global _pool_distances
+    ntemp = len(dists)
+    qsum = _empty_array((ntemp, ntemp), np.float64)
+    qcount = _empty_array((ntemp, ntemp), np.int64)
+    blocks = [(start, min(start + block_size, ntemp))
+              for start in range(0, ntemp, block_size)]
+    if jobs > 1 and len(blocks) > 1:
+        _pool_distances = dists
+        try:
+            njob = min(jobs, len(blocks))
+            with multiprocessing.get_context('fork').Pool(njob) as pool:
+                for start, s, c in pool.imap_unordered(
+                        _get_pool_q_rows, blocks,
+                        chunksize=-(-len(blocks) // (4 * njob))):
+                    qsum[start:start + len(s)] = s
+                    qcount[start:start + len(c)] = c
+        finally:
+            _pool_distances = None
+    else:
+        for start, s, c in (dists.get_q_rows(*b) for b in blocks):
+            qsum[start:start + len(s)] = s
+            qcount[start:start + len(c)] = c
+    # Combine both sides of each pair, overwriting the sums with Q, one
+    # square block (and its mirror image) at a time. Adding the two sides
+    # in either order gives the same result, so Q is exactly symmetric.
+    step = max(1, int(np.sqrt(max_block_size)))
+    for i in range(0, ntemp, step):
+        for j in range(i, ntemp, step):
+            s = qsum[i:i + step, j:j + step] + qsum[j:j + step, i:i + step].T
+            c = qcount[i:i + step, j:j + step] \
+                + qcount[j:j + step, i:i + step].T
+            q = np.zeros(s.shape)
+            np.divide(2. * s, c, out=q, where=c > 0)
+            if i == j:
+                np.fill_diagonal(q, 0.)
+            qsum[i:i + step, j:j + step] = q
+            qsum[j:j + step, i:i + step] = q.T
+    return qsum
+
+
+def _get_pool_q(itg, start, end):
+    return _pool_distances.get_q(itg, start, end)
+
+
+def _get_output_q(q):
+    """Q is output as 1.0 where no contacts were found"""
+    return np.where(q == 0., 1.0, q)
+
+
+class LandmarkQMatrix:
+    """Approximation to the Q matrix, calculated from exact Q between all
+       templates and a subset of `nlandmark` landmark templates.
+
+       Landmarks are chosen by farthest-point sampling: each new landmark
+       is the template least similar to all landmarks chosen so far. The
+       rest of the matrix is reconstructed using the Nystrom low-rank
+       approximation Q ~ C W^+ C^T, where C is Q between all templates and
+       the landmarks, and W is Q between the landmarks themselves.
+
+       The error is estimated by calculating exact Q for `ncheck` randomly
+       chosen pairs of non-landmark templates.
+
+       Rows of the matrix are calculated on demand, by slicing, so that
+       the full matrix need not fit in memory."""
+
+    def __init__(self, dists, nlandmark, jobs=1, ncheck=n_check):
+        global _pool_distances
+        ntemp = len(dists)
+        nlandmark = min(nlandmark, ntemp)
+        self.landmarks = []
+        c = np.empty((ntemp, nlandmark))
+        maxq = np.full(ntemp, -np.inf)
+        _pool_distances = dists
+        try:
+            with (multiprocessing.get_context('fork').Pool(jobs)
+                  if jobs > 1 else contextlib.nullcontext()) as pool:
+                for n in range(nlandmark):
+                    # Always start with the first template (templates are
+                    # shuffled in random order by main())
+                    itg = int(np.argmin(maxq)) if n > 0 else 0
+                    self.landmarks.append(itg)
+                    c[:, n] = _get_output_q(self._get_q(itg, ntemp, pool))
+                    # Use Q to the nearest other template in place of
+                    # self-similarity, which is always exactly 1; this
+                    # corrects most of the approximation's tendency to
+                    # underestimate Q between noisy snapshots
+                    c[itg, n] = -np.inf
+                    c[itg, n] = np.max(c[:, n]) if ntemp > 1 else 1.0
+                    maxq = np.maximum(maxq, c[:, n])
+                    maxq[itg] = np.inf
+                self._c = c
+                w = c[self.landmarks]
+                self._m = np.linalg.pinv(w, rcond=1e-6, hermitian=True) \
+                    .dot(c.T)
+                self._check_errors(dists, ncheck, ntemp)
+        finally:
+            _pool_distances = None
+
+    def _get_q(self, itg, ntemp, pool):
+        step = max(1, max_block_size // max(1, len(_pool_distances.i)))
+        blocks = [(itg, start, min(start + step, ntemp))
+                  for start in range(0, ntemp, step)]
+        if pool is None or len(blocks) < 2:
+            return np.concatenate([_get_pool_q(*b) for b in blocks])
+        return np.concatenate(pool.starmap(_get_pool_q, blocks))
+
+    def _check_errors(self, dists, ncheck, ntemp):
+        others = np.setdiff1d(np.arange(ntemp), self.landmarks)
+        npair = len(others) * (len(others) - 1)
+        # Fraction of all matrix elements that are approximated
+        self._approx_fraction = npair / max(1, ntemp * (ntemp - 1))
+        errors = []
+        if npair > 0:
+            rng = np.random.RandomState(0)
+            for k in range(min(ncheck, npair)):
+                i, j = rng.choice(others, size=2, replace=False).tolist()
+                exact = _get_output_q(dists.get_q(i, j, j + 1))[0]
+                errors.append(self[i:i + 1][0, j] - exact)
+        self.errors = np.array(errors)
+
+    def __len__(self):
+        return len(self._c)
+
+    def __getitem__(self, key):
+        """Get rows of the approximate matrix, given a slice"""
+        start, end, _ = key.indices(len(self))
+        q = self._c[start:end].dot(self._m)
+        # Keep Q in (0, 1]; exactly 0 is reserved for "no contacts"
+        np.clip(q, np.finfo(float).tiny, 1.0, out=q)
+        # Q involving landmarks is known exactly
+        q[:, self.landmarks] = self._c[start:end]
+        for n, itg in enumerate(self.landmarks):
+            if start <= itg < end:
+                q[itg - start] = self._c[:, n]
+        q[np.arange(len(q)), np.arange(start, start + len(q))] = 1.0
+        return q
+
+    def get_error_bound(self):
+        """Get an approximate 95% confidence bound on the error in the
+           average of all off-diagonal elements of the matrix (Qa,b)"""
+        if len(self.errors) == 0:
+            return 0.
+        err = abs(self.errors.mean())
+        if len(self.errors) > 1:
+            err += 2. * self.errors.std(ddof=1) / np.sqrt(len(self.errors))
+        return err * self._approx_fraction
+
+    def write_error_summary(self, fh):
+        print("Qa,b error bound: %.4f" % self.get_error_bound(), file=fh)
+        if len(self.errors) > 0:
+            print("Approximate Q matrix from %d landmarks; over %d sampled "
+                  "pairs, max error %.4f, RMS error %.4f"
+                  % (len(self.landmarks), len(self.errors),
+                     np.max(np.abs(self.errors)),
+                     np.sqrt(np.mean(self.errors ** 2))), file=fh)
+
+
+def write_q_output(q, templates, mat_fh, avg_fh):
+    """Write the Q matrix `q` (a NumPy array, or any object that returns
+       rows of the matrix when sliced) and the average Q"""
+    ntemp = len(templates)
+    fmt = " %.4f" * ntemp
+    step = max(1, max_block_size // max(1, ntemp))
+    qsum = 0.
+    for start in range(0, ntemp, step):
+        # Q is 1.0 on the diagonal, and where no contacts were found
+        rows = _get_output_q(q[start:start + step])
+        rows[np.arange(len(rows)), np.arange(start, start + len(rows))] = 1.0
+        qsum += rows.sum()
+        for template, qs in zip(templates[start:], rows.tolist()):
+            print(template + fmt % tuple(qs), file=mat_fh)
+    nq = ntemp * (ntemp - 1)
+    qavg = (qsum - ntemp) / nq if nq > 0 else 0.
+    print("Qa,b: %.2f" % qavg, file=avg_fh)
+
+
+def get_qmatrix(target, templates, rcut, jobs=1, landmarks=None):
+    numres = len(read_coordinates(target))
+    dists = get_template_distances(None, numres, templates, rcut)
+    if landmarks and landmarks < len(templates):
+        q = LandmarkQMatrix(dists, landmarks, jobs)
+    else:
+        q = make_matrix_from_dists(dists, jobs)
+    with open('qmatrix.dat', 'w') as mat_fh:
+        with open('cq_aq_qavg_qsd.dat', 'w') as avg_fh:
+            write_q_output(q, templates, mat_fh, avg_fh)
+            if isinstance(q, LandmarkQMatrix):
+                q.write_error_summary(avg_fh)
 
 
 def shuffle_templates(templates):
     random.shuffle(templates)
-    del templates[500:]
 
 
 def parse_args():
-    usage = """%prog <target PDB> <cutoff> <template PDB> [...]
+    usage = """%prog [opts] <target PDB> <cutoff> <template PDB> [...]
 
 Calculate q matrix for templates.
+
+For very large numbers of templates, --landmarks can be used to calculate
+an approximate matrix, from exact Q between every template and a smaller
+number of landmark templates. An estimate of the error in the average Q
+(Qa,b) is then also output.
 """
     parser = optparse.OptionParser(usage)
+    parser.add_option("--jobs", type=int, default=1,
+                      dest="jobs", metavar='INT',
+                      help="Number of worker processes to use (default 1)")
+    parser.add_option("--landmarks", type=int, default=None,
+                      dest="landmarks", metavar='INT',
+                      help="Calculate an approximate matrix using this "
+                           "many landmark templates (default: calculate "
+                           "the exact matrix)")
     options, args = parser.parse_args()
     if len(args) < 3:
         parser.error("incorrect number of arguments")
-    return args[0], float(args[1]), args[2:]
+    return args[0], float(args[1]), args[2:], options
 
 
 def main():
-    target, cutoff, templates = parse_args()
+    target, cutoff, templates, opts = parse_args()
     shuffle_templates(templates)
-    get_qmatrix(target, templates, cutoff)
+    get_qmatrix(target, templates, cutoff, opts.jobs, opts.landmarks)
 
 
 if __name__ == '__main__':
@@ -2,6 +2,14 @@
 
 import optparse
 import subprocess
+import numpy as np
+from allosmod.util.cache import ResultCache
+
+# Bump if the output of get_ss() changes, to invalidate cached results
+_CACHE_VERSION = 1
+
+# In-memory copy of results from get_ss_cached(), keyed by cache key
+_memo = {}
 
 
 def get_ss(pdb_file):
@@ -26,6 +34,29 @@ def get_ss(pdb_file):
             yield line[16] if line[16] != ' ' else '-'
 
 
+def get_ss_cached(pdb_file, cache=True, directory=None):
+    """Get secondary structure as for get_ss(), but as a list.
+       Results are keyed by the contents of `pdb_file` and stored both in
+       memory and (if `cache` is True) on disk, in a ResultCache in the
+       given directory, so that mkdssp is run at most once for any given
+       structure."""
+    if not cache:
+        return list(get_ss(pdb_file))
+    rcache = ResultCache('dssp', directory=directory)
+    key = rcache.get_key(pdb_file, _CACHE_VERSION)
+    ss = _memo.get(key)
+    if ss is None:
+        data = rcache.load(key)
+        if data is None:
+            ss = ''.join(get_ss(pdb_file))
+            rcache.save(key, ss=np.frombuffer(ss.encode('ascii'),
+                                              dtype=np.uint8))
+        else:
+            ss = data['ss'].tobytes().decode('ascii')
+        _memo[key] = ss
+    return list(ss)
+
+
 def parse_args():
     usage = """%prog <PDB file>
 
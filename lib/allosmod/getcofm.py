@@ -2,18 +2,12 @@
 
 import argparse
 import allosmod.util
+from allosmod.util.pdbcoord import PDBCoordinates
 
 
 class CenterOfMassPDBParser(allosmod.util.PDBParser):
     def get_cofm(self, fh):
-        x = y = z = 0.
-        nr = 0
-        for line in self.parse(fh):
-            x += float(line[30:38])
-            y += float(line[38:46])
-            z += float(line[46:54])
-            nr += 1
-        return x / nr, y / nr, z / nr
+        return PDBCoordinates.read(fh, self.filter).get_center()
 
 
 def parse_args():
@@ -1,26 +1,13 @@
 """Get the radius of gyration of a PDB file"""
 
 import optparse
-import allosmod.util
-from allosmod.getcofm import CenterOfMassPDBParser
-import math
+from allosmod.util.pdbcoord import PDBCoordinates
 
 
 def getrofg(pdb_file):
-    c = CenterOfMassPDBParser(allosmod.util.atom_hetatm_filter)
-    cofm_x, cofm_y, cofm_z = c.get_cofm(open(pdb_file))
-    nr = 0
-    r = 0
     with open(pdb_file) as fh:
-        for line in fh:
-            if line.startswith('ATOM') or line.startswith('HETATM'):
-                x = float(line[30:38])
-                y = float(line[38:46])
-                z = float(line[46:54])
-                r += math.sqrt((x - cofm_x) ** 2 + (y - cofm_y) ** 2
-                               + (z - cofm_z) ** 2)
-                nr += 1
-    return r / nr
+        c = PDBCoordinates.read(fh)
+    return c.get_mean_distance(c.get_center())
 
 
 def parse_args():
@@ -1,11 +1,15 @@
 """Modify PDB residues that Modeller cannot recognize."""
 
 import optparse
-import fileinput
+import sys
+import allosmod.util
 
 
-def pdb_fix_res(pdb_file, inplace):
-    for line in fileinput.input(pdb_file, inplace):
+def fix_res_lines(lines):
+    """Return the ATOM and HETATM records from the given PDB file lines,
+       with unrecognized residues replaced"""
+    out = []
+    for line in lines:
         if line.startswith('ATOM') or line.startswith('HETATM'):
             if line[17:20] in ('HID', 'HIE', 'HIP', 'HSD', 'HSE', 'HSP'):
                 line = 'ATOM  ' + line[6:17] + 'HIS' + line[20:]
@@ -13,14 +17,25 @@ def pdb_fix_res(pdb_file, inplace):
                 line = 'ATOM  ' + line[6:17] + 'MET' + line[20:]
                 if line[12:14] == 'SE':
                     line = line[:12] + ' SD' + line[15:]
-            print(line, end='')
+            out.append(line)
+    return out
+
+
+def pdb_fix_res(pdb_file, inplace):
+    if inplace:
+        allosmod.util.rewrite_files([pdb_file], fix_res_lines)
+    else:
+        with open(pdb_file) as fh:
+            sys.stdout.write(''.join(fix_res_lines(fh)))
 
 
 def parse_args():
-    usage = """%prog <PDB file>
+    usage = """%prog [opts] <PDB file>
+       %prog [opts] --in-place <PDB file> [...]
 
 Modify PDB residues that Modeller cannot recognize, and write the new PDB file
-to standard output (or modify it inplace if --in-place is specified).
+to standard output (or modify it inplace if --in-place is specified; in this
+case any number of PDB files can be given, and are all modified).
 
 The following substitutions are made:
 - Everything except ATOM and HETATM records is stripped from the file.
@@ -29,17 +44,24 @@ The following substitutions are made:
 """
     parser = optparse.OptionParser(usage)
     parser.add_option("--in-place", action="store_true", dest="inplace",
-                      help="modify the file in place")
+                      help="modify the file(s) in place")
+    parser.add_option("--jobs", type=int, default=1,
+                      dest="jobs", metavar='INT',
+                      help="Number of files to modify in parallel "
+                           "(default 1)")
 
     opts, args = parser.parse_args()
-    if len(args) != 1:
+    if len(args) == 0 or (len(args) > 1 and not opts.inplace):
         parser.error("incorrect number of arguments")
-    return args[0], opts
+    return args, opts
 
 
 def main():
-    pdb_file, opts = parse_args()
-    pdb_fix_res(pdb_file, opts.inplace)
+    pdb_files, opts = parse_args()
+    if opts.inplace:
+        allosmod.util.rewrite_files(pdb_files, fix_res_lines, opts.jobs)
+    else:
+        pdb_fix_res(pdb_files[0], False)
 
 
 if __name__ == '__main__':
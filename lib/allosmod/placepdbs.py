@@ -0,0 +1,120 @@
+"""Randomly rotate a set of PDB files and place them on a lattice"""
+
+import argparse
+import math
+import random
+from decimal import Decimal
+import allosmod.util
+from allosmod.util.pdbcoord import PDBCoordinates
+from allosmod.rotatepdb import rotate_coordinates
+
+
+# Directions in which successive structures are placed from the first
+_DIRECTIONS = ((0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1),
+               (-1, 0, 0), (0, -1, 0), (0, 0, -1))
+
+
+def get_lattice_position(n):
+    """Get the direction in which to place the nth structure (counting
+       from zero), and the number of steps to move in that direction.
+       The first structure goes at the origin, the next six one step along
+       +x, +y, +z, -x, -y and -z, the next six two steps, and so on."""
+    if n == 0:
+        return _DIRECTIONS[0], 0
+    return _DIRECTIONS[(n - 1) % 6 + 1], (n + 5) // 6
+
+
+def get_random_angles(nstruc, seed=None):
+    """Get random rotation angles, in whole degrees about the x, y and z
+       axes, for each structure"""
+    rng = random.Random(seed)
+    return [tuple(rng.randrange(360) for _ in range(3))
+            for _ in range(nstruc)]
+
+
+def _round_coordinates(coord):
+    """Round coordinates to the precision of a PDB file"""
+    return [(float("%.3f" % x), float("%.3f" % y), float("%.3f" % z))
+            for x, y, z in coord]
+
+
+def place_pdbs(pdb_files, angles):
+    """Rotate each PDB file about the origin by the given angles (in
+       degrees), then translate it so that its center of mass is on a
+       lattice, with spacing 1.3 times the sum of the radii of gyration of
+       the first and the current structure. Each file is overwritten with
+       its transformed ATOM and HETATM records.
+
+       This gives exactly the same results as running rotatepdb, getrofg,
+       getcofm and translatepdb on each file in turn (rounding to the
+       precision of their input and output, and using decimal arithmetic
+       for the offsets, as the original shell script did with bc)."""
+    deg2rad = math.pi / 180.
+    rofg0 = None
+    for n, (pdb_file, rot) in enumerate(zip(pdb_files, angles)):
+        with open(pdb_file) as fh:
+            c = PDBCoordinates.read(fh)
+        c.coord = _round_coordinates(rotate_coordinates(
+            c.coord, *[float(a) * deg2rad for a in rot]))
+
+        rofg = Decimal("%.1f" % c.get_mean_distance(c.get_center()))
+        if rofg0 is None:
+            rofg0 = rofg
+        atoms = PDBCoordinates(
+            None, [xyz for prefix, xyz in zip(c.prefix, c.coord)
+                   if allosmod.util.atom_filter(prefix)], None)
+        cofm = [Decimal("%.3f" % x) for x in atoms.get_center()]
+        direction, steps = get_lattice_position(n)
+        dist = Decimal('1.3') * (rofg0 + rofg)
+        c.translate(*[float(-x + d * steps * dist)
+                      for x, d in zip(cofm, direction)])
+        with open(pdb_file, 'w') as fh:
+            c.write(fh)
+
+
+def get_ligand_center(ligand_file):
+    """Get the center of mass of the ATOM records in the given PDB file"""
+    with open(ligand_file) as lig_fh:
+        c = PDBCoordinates.read(lig_fh, allosmod.util.atom_filter)
+    return c.get_center()
+
+
+def write_ligand_center(center, fh):
+    """Write a single pseudo-atom at the given center of mass"""
+    fh.write("ATOM      1  XX  ALA A   1    %8.3f%8.3f%8.3f  1.00 99.99"
+             "           C\n" % center)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Randomly rotate each PDB file named in a list file, "
+                    "then translate it so that the structures are spread "
+                    "out on a lattice around the first (each file is "
+                    "overwritten with its ATOM and HETATM records). "
+                    "Finally, write a ligand file containing a single "
+                    "atom at the center of mass of the given ligand PDB "
+                    "file (after it is moved, if it is in the list).")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for the random number generator")
+    parser.add_argument("--ligand-output", default="lig.pdb",
+                        help="File to write the ligand center of mass to "
+                             "(default lig.pdb)")
+    parser.add_argument("list", help="File listing PDB files, one per line")
+    parser.add_argument("ligand", help="Ligand PDB file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pdb_files = allosmod.util.read_templates(args.list)
+    place_pdbs(pdb_files, get_random_angles(len(pdb_files), args.seed))
+    if pdb_files:
+        # Read the ligand before opening the output, which may be the
+        # same file
+        center = get_ligand_center(args.ligand)
+        with open(args.ligand_output, 'w') as fh:
+            write_ligand_center(center, fh)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,33 +2,37 @@
 
 import optparse
 import math
+import sys
+from allosmod.util.pdbcoord import PDBCoordinates
 
 
-def rotate_coordinate(x, y, z, dx, dy, dz):
-    xa = x
-    ya = math.cos(dx) * y - math.sin(dx) * z
-    za = math.sin(dx) * y + math.cos(dx) * z
+def rotate_coordinates(coord, dx, dy, dz):
+    """Rotate a list of (x, y, z) coordinates dx radians about the x axis,
+       then dy about the y axis, then dz about the z axis"""
+    cx, sx = math.cos(dx), math.sin(dx)
+    cy, sy = math.cos(dy), math.sin(dy)
+    cz, sz = math.cos(dz), math.sin(dz)
+
+    def rotate(xa, y, z):
+        ya = cx * y - sx * z
+        za = sx * y + cx * z
+
+        xb = sy * za + cy * xa
+        zb = cy * za - sy * xa
 
-    xb = math.sin(dy) * za + math.cos(dy) * xa
-    yb = ya
-    zb = math.cos(dy) * za - math.sin(dy) * xa
+        return cz * xb - sz * ya, sz * xb + cz * ya, zb
+    return [rotate(x, y, z) for x, y, z in coord]
 
-    xc = math.cos(dz) * xb - math.sin(dz) * yb
-    yc = math.sin(dz) * xb + math.cos(dz) * yb
-    zc = zb
-    return xc, yc, zc
+
+def rotate_coordinate(x, y, z, dx, dy, dz):
+    return rotate_coordinates([(x, y, z)], dx, dy, dz)[0]
 
 
 def rotatepdb(pdb_file, dx, dy, dz):
     with open(pdb_file) as fh:
-        for line in fh:
-            if line.startswith('ATOM') or line.startswith('HETATM'):
-                x = float(line[30:38])
-                y = float(line[38:46])
-                z = float(line[46:54])
-                x, y, z = rotate_coordinate(x, y, z, dx, dy, dz)
-                print(line[:30] + "%8.3f%8.3f%8.3f" % (x, y, z) + line[54:],
-                      end='')
+        c = PDBCoordinates.read(fh)
+    c.coord = rotate_coordinates(c.coord, dx, dy, dz)
+    c.write(sys.stdout)
 
 
 def parse_args():
@@ -1,36 +1,58 @@
 """Set the chain ID on a PDB file."""
 
 import optparse
-import fileinput
+import sys
+import allosmod.util
+
+
+def set_chain_lines(lines, chain_id):
+    """Return the given PDB file lines with the chain ID of every ATOM
+       and HETATM record replaced"""
+    return [line[:21] + chain_id + line[22:]
+            if line.startswith('ATOM') or line.startswith('HETATM')
+            else line for line in lines]
 
 
 def setchain(pdb_file, chain_id, inplace):
     """Replace any empty chain IDs with '@'"""
-    for line in fileinput.input(pdb_file, inplace):
-        if line.startswith('ATOM') or line.startswith('HETATM'):
-            line = line[:21] + chain_id + line[22:]
-        print(line, end='')
+    if inplace:
+        allosmod.util.rewrite_files(
+            [pdb_file], lambda lines: set_chain_lines(lines, chain_id))
+    else:
+        with open(pdb_file) as fh:
+            sys.stdout.write(''.join(set_chain_lines(fh, chain_id)))
 
 
 def parse_args():
-    usage = """%prog <PDB file> <chainID>
+    usage = """%prog [opts] <PDB file> <chainID>
+       %prog [opts] --in-place <PDB file> [...] <chainID>
 
 Set the chain ID on a PDB file, and write it to standard output (or modify
-it inplace if --in-place is specified).
+it inplace if --in-place is specified; in this case any number of PDB files
+can be given, and are all modified).
 """
     parser = optparse.OptionParser(usage)
     parser.add_option("--in-place", action="store_true", dest="inplace",
-                      help="modify the file in place")
+                      help="modify the file(s) in place")
+    parser.add_option("--jobs", type=int, default=1,
+                      dest="jobs", metavar='INT',
+                      help="Number of files to modify in parallel "
+                           "(default 1)")
 
     opts, args = parser.parse_args()
-    if len(args) != 2:
+    if len(args) < 2 or (len(args) > 2 and not opts.inplace):
         parser.error("incorrect number of arguments")
-    return args[0], args[1][:1], opts
+    return args[:-1], args[-1][:1], opts
 
 
 def main():
-    pdb_file, chain_id, opts = parse_args()
-    setchain(pdb_file, chain_id, opts.inplace)
+    pdb_files, chain_id, opts = parse_args()
+    if opts.inplace:
+        allosmod.util.rewrite_files(
+            pdb_files, lambda lines: set_chain_lines(lines, chain_id),
+            opts.jobs)
+    else:
+        setchain(pdb_files[0], chain_id, False)
 
 
 if __name__ == '__main__':
@@ -18,12 +18,15 @@ def convert_restraints(rsr):
 
 def spline(pdb_file, in_restraints, out_restraints):
     import modeller
+    from allosmod.util.restraints import text_restraints_file
     # Needed to keep our custom form alive for restraints.read()
     from allosmod.modeller.forms import TruncatedGaussian  # noqa: F401
 
     e = modeller.Environ()
     m = modeller.Model(e, file=pdb_file)
-    m.restraints.read(file=in_restraints)
+    # Modeller can only read text restraints files
+    with text_restraints_file(in_restraints) as fname:
+        m.restraints.read(file=fname)
     convert_restraints(m.restraints)
     m.restraints.write(file=out_restraints)
 
@@ -34,7 +37,8 @@ def parse_args():
 Convert restraints into splines.
 Selected restraints from the Modeller restraints file <restraints in>
 (which apply to <pdb file>) are converted into cubic splines and written
-out to <restraints out>.
+out to <restraints out>. <restraints in> can also be a binary cache of
+a restraints file, as written by other AllosMod commands.
 
 Currently only the regular Modeller multi-Gaussian and the AllosMod-specific
 TruncatedGaussian restraints are converted to splines. Splines are much faster
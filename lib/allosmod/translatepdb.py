@@ -1,17 +1,15 @@
 """Translate a PDB file"""
 
 import argparse
+import sys
+from allosmod.util.pdbcoord import PDBCoordinates
 
 
 def translatepdb(pdb_file, dx, dy, dz):
     with open(pdb_file) as fh:
-        for line in fh:
-            if line.startswith('ATOM') or line.startswith('HETATM'):
-                x = float(line[30:38]) + dx
-                y = float(line[38:46]) + dy
-                z = float(line[46:54]) + dz
-                print(line[:30] + "%8.3f%8.3f%8.3f" % (x, y, z) + line[54:],
-                      end='')
+        c = PDBCoordinates.read(fh)
+    c.translate(dx, dy, dz)
+    c.write(sys.stdout)
 
 
 def parse_args():
@@ -40,6 +40,44 @@ def fix_newlines(fname):
             fh.write(contents.replace('\r', ''))
 
 
+def replace_file(fname, contents):
+    """Atomically replace the contents of a file. The new contents are
+       written to a temporary file in the same directory, which is then
+       renamed over the original (keeping its permissions), so that the
+       file is never seen partially written."""
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.allosmod')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(contents)
+        os.chmod(tmpname, os.stat(fname).st_mode & 0o7777)
+        os.replace(tmpname, fname)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def rewrite_files(fnames, func, jobs=1):
+    """Rewrite each of the named files in place. `func` is called with a
+       list of the lines in each file, and should return a list of new
+       lines. Up to `jobs` files are read and written in parallel by a
+       pool of threads (which helps on slow network filesystems)."""
+    def rewrite(fname):
+        with open(fname) as fh:
+            lines = fh.readlines()
+        replace_file(fname, ''.join(func(lines)))
+    if jobs > 1 and len(fnames) > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(
+                min(jobs, len(fnames))) as pool:
+            # Consume the results so that any exception is raised here
+            for _ in pool.map(rewrite, fnames):
+                pass
+    else:
+        for fname in fnames:
+            rewrite(fname)
+
+
 def read_templates(template_file):
     """Read list of templates from the given file. The AllosMod list format
        is one template per file; each line lists the PDB file, chain,
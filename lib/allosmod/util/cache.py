@@ -0,0 +1,86 @@
+"""On-disk cache of results computed from input files."""
+
+import hashlib
+import json
+import tempfile
+import os
+import numpy as np
+
+
+def get_file_hash(fname):
+    """Get the SHA-256 hash of the named file"""
+    h = hashlib.sha256()
+    with open(fname, 'rb') as fh:
+        for data in iter(lambda: fh.read(1 << 24), b''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def get_cache_dir():
+    """Get the directory used to store cached results. This is
+       $ALLOSMOD_CACHE_DIR if set, otherwise an allosmod subdirectory of
+       the user's cache directory ($XDG_CACHE_HOME or ~/.cache)."""
+    d = os.environ.get('ALLOSMOD_CACHE_DIR')
+    if d:
+        return d
+    xdg = os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(xdg, 'allosmod')
+
+
+class ResultCache:
+    """Cache of results computed from files, keyed by the file contents
+       plus any parameters of the computation. Each result is stored as
+       a set of NumPy arrays in its own file under `directory`/`name`.
+
+       Files are written to a temporary file and then renamed into place,
+       so it is safe for multiple processes (even on different machines
+       sharing the filesystem) to use the same cache. Any error reading or
+       writing the cache is treated as a cache miss.
+
+       If `enabled` is False, nothing is read from or written to disk."""
+
+    def __init__(self, name, directory=None, enabled=True):
+        self.name, self.enabled = name, enabled
+        self.directory = os.path.join(directory or get_cache_dir(), name)
+
+    def get_key(self, fname, *params):
+        """Get the key for results computed from the named file with the
+           given parameters (which must be JSON-serializable)"""
+        h = hashlib.sha256(get_file_hash(fname).encode('ascii'))
+        h.update(json.dumps(params).encode('utf-8'))
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def load(self, key):
+        """Return a dict of the arrays stored under the given key, or None
+           if the key is not in the cache"""
+        if not self.enabled:
+            return None
+        try:
+            with np.load(self._get_path(key), allow_pickle=False) as data:
+                return dict(data.items())
+        except (OSError, ValueError, EOFError):
+            return None
+
+    def save(self, key, **arrays):
+        """Store the given arrays under the given key"""
+        if not self.enabled:
+            return
+        path = self._get_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(path), prefix='.tmp',
+                    suffix='.npz', delete=False) as fh:
+                try:
+                    np.savez(fh, **arrays)
+                    fh.close()
+                    os.replace(fh.name, path)
+                except BaseException:
+                    os.unlink(fh.name)
+                    raise
+        except OSError:
+            pass
@@ -0,0 +1,46 @@
+"""Generate the index of allosmod commands used by the dispatcher."""
+
+import ast
+import os
+import sys
+
+
+def get_commands(package_dir):
+    """Get a dict of the commands in the given package directory, mapping
+       each command name to the first line of its module docstring. The
+       modules are parsed, not imported, so this is fast and does not need
+       any of their dependencies (e.g. Modeller)."""
+    commands = {}
+    for fname in sorted(os.listdir(package_dir)):
+        if fname.endswith('.py') and not fname.startswith('_'):
+            with open(os.path.join(package_dir, fname)) as fh:
+                doc = ast.get_docstring(ast.parse(fh.read(), fname),
+                                        clean=False)
+            commands[fname[:-3]] = doc.split('\n', 1)[0] if doc else ''
+    return commands
+
+
+def write_index(commands, fh):
+    """Write a Python module containing the given command index"""
+    fh.write('"""Index of allosmod commands, used by the allosmod '
+             'dispatcher.\n\n'
+             'This file is generated by allosmod.util.commands; do not edit.\n'
+             '"""\n\ncommands = {\n')
+    for name, doc in sorted(commands.items()):
+        line = "    %r: %r,\n" % (name, doc)
+        if len(line) > 80:
+            line = "    %r:\n        %r,\n" % (name, doc)
+        fh.write(line)
+    fh.write('}\n')
+
+
+def main():
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if len(sys.argv) > 1:
+        package_dir = sys.argv[1]
+    with open(os.path.join(package_dir, '_commands.py'), 'w') as fh:
+        write_index(get_commands(package_dir), fh)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Fast reading and rewriting of the coordinates of PDB records."""
+
+import math
+
+
+class PDBCoordinates:
+    """The coordinates of a set of PDB records, as a list of (x, y, z)
+       tuples. The text of each record before and after the coordinates is
+       also kept, so that the records can be written out again with new
+       coordinates but otherwise unchanged.
+
+       This deliberately does not use NumPy (or import much else); the
+       commands that use it are run once per structure from shell scripts,
+       and for typical structures importing NumPy takes longer than the
+       whole calculation."""
+
+    def __init__(self, prefix, coord, suffix):
+        self.prefix, self.suffix = prefix, suffix
+        self.coord = coord
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Make a new object from a list of PDB records"""
+        return cls([line[:30] for line in lines],
+                   [(float(line[30:38]), float(line[38:46]),
+                     float(line[46:54])) for line in lines],
+                   [line[54:] for line in lines])
+
+    @classmethod
+    def read(cls, fh, filter=None):
+        """Read all records that pass the given filter function (by default,
+           ATOM and HETATM records) from a PDB file handle"""
+        if filter is None:
+            return cls.from_lines([line for line in fh
+                                   if line.startswith(('ATOM', 'HETATM'))])
+        else:
+            return cls.from_lines([line for line in fh if filter(line)])
+
+    def __len__(self):
+        return len(self.coord)
+
+    def _check_not_empty(self):
+        if not self.coord:
+            raise ValueError("no ATOM/HETATM records")
+
+    def get_center(self):
+        """Get the mean of all coordinates, as an (x, y, z) tuple"""
+        self._check_not_empty()
+        x, y, z = [sum(c) for c in zip(*self.coord)]
+        n = len(self.coord)
+        return x / n, y / n, z / n
+
+    def get_mean_distance(self, point):
+        """Get the mean distance of all coordinates from the given point"""
+        self._check_not_empty()
+        px, py, pz = point
+        sqrt = math.sqrt
+        return sum([sqrt((x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2)
+                    for x, y, z in self.coord]) / len(self.coord)
+
+    def translate(self, dx, dy, dz):
+        """Translate all coordinates by the given offset"""
+        self.coord = [(x + dx, y + dy, z + dz) for x, y, z in self.coord]
+
+    def write(self, fh):
+        """Write all records, with their current coordinates, to the given
+           file handle"""
+        fh.write(''.join([p + "%8.3f%8.3f%8.3f" % c + s for p, c, s
+                          in zip(self.prefix, self.coord, self.suffix)]))
@@ -0,0 +1,874 @@
+"""Compact, columnar storage of Modeller restraints files."""
+
+import itertools
+import contextlib
+import tempfile
+import warnings
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import numpy as np
+from allosmod.util.cache import get_file_hash
+
+
+#: Restraint forms whose parameters are kept as text rather than parsed
+#: into numbers (binormal and spline restraints are passed through as-is)
+VERBATIM_FORMS = (9, 10)
+
+#: Scalar (one value per restraint) columns, in the order they appear
+#: in each restraint line
+SCALAR_COLUMNS = ('form', 'modal', 'feat', 'group', 'natom', 'nparam',
+                  'nfeat')
+
+#: Ragged columns; each is a flat array plus an offsets array
+RAGGED_COLUMNS = (('feats', np.int32), ('atoms', np.int32),
+                  ('params', np.float64), ('text', np.uint8))
+
+
+#: Suffix of the binary cache file written alongside a restraints file
+CACHE_SUFFIX = '.rsrcache'
+
+# First bytes of a binary cache file; followed by the header size
+# (8 bytes, little endian), the header itself (JSON) and the data
+_CACHE_MAGIC = b'ALLOSMOD RESTRAINT CACHE\n'
+_CACHE_VERSION = 1
+# Alignment, in bytes, of each array in a cache file
+_CACHE_ALIGN = 64
+
+
+class HashingReader:
+    """Wrap a binary file handle, keeping a hash of all data read"""
+    def __init__(self, fh):
+        self.fh = fh
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.hash.update(data)
+        return data
+
+    def readline(self):
+        data = self.fh.readline()
+        self.hash.update(data)
+        return data
+
+
+def is_cache_file(fname):
+    """Return True iff the named file is a binary restraints cache"""
+    with open(fname, 'rb') as fh:
+        return fh.read(len(_CACHE_MAGIC)) == _CACHE_MAGIC
+
+
+@contextlib.contextmanager
+def text_restraints_file(fname):
+    """Context manager yielding the name of a Modeller text restraints file
+       containing the same restraints as the named file. If the file is
+       a binary cache, it is converted to a temporary text file."""
+    if not is_cache_file(fname):
+        yield fname
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        text_file = os.path.join(tmpdir, 'restraints.rsr')
+        with open(text_file, 'w') as fh:
+            RestraintStore.load(fname)[0].write(fh)
+        yield text_file
+
+
+def ragged_index(first, counts):
+    """Get indices first[i], first[i]+1, ..., first[i]+counts[i]-1 for all i,
+       concatenated, plus the offset of each group in the result."""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    ind = np.arange(offsets[-1], dtype=np.int64) \
+        + np.repeat(first - offsets[:-1], counts)
+    return ind, offsets
+
+
+_FORMAT_SPEC = re.compile(r'%(\d+)(?:\.(\d+))?([df])')
+
+
+def _make_digit_table():
+    """Get characters of all 4-digit numbers, zero-padded (rows 0-9999),
+       space-padded (10000-19999), and space-padded with zero written as
+       all spaces (20000-29999)"""
+    zero = (np.arange(10000)[:, np.newaxis] // np.array([1000, 100, 10, 1])
+            % 10 + ord('0')).astype(np.uint8)
+    ndigit = np.searchsorted([10, 100, 1000], np.arange(10000),
+                             side='right') + 1
+    space = np.where(np.arange(4) < 4 - ndigit[:, np.newaxis],
+                     np.uint8(ord(' ')), zero)
+    blank = space.copy()
+    blank[0] = ord(' ')
+    return np.vstack((zero, space, blank))
+
+
+# Characters of 4-digit numbers, for _format_int()
+_DIGITS4 = _make_digit_table()
+_POWERS10 = 10 ** np.arange(1, 19, dtype=np.int64)
+
+
+def _format_int(n, width, zero_pad):
+    """Format an array of non-negative integers right-aligned in the given
+       width, either padded with zeros or with spaces. Return an (N, width)
+       array of characters, the number of digits in each integer, and a
+       mask of integers that do not fit."""
+    ngroup = -(-width // 4)
+    out = np.empty((len(n), 4 * ngroup), dtype=np.uint8)
+    rem = n
+    # Fill in four digits at a time, starting with the least significant
+    for g in range(ngroup):
+        rem, low = np.divmod(rem, 10000)
+        if zero_pad:
+            ind = low
+        else:
+            ind = low + np.where(rem > 0, 0, 10000 if g == 0 else 20000)
+        out[:, 4 * (ngroup - g - 1):4 * (ngroup - g)] = np.take(
+            _DIGITS4, ind, axis=0)
+    ndigit = np.searchsorted(_POWERS10, n, side='right') + 1
+    return out[:, 4 * ngroup - width:], ndigit, ndigit > width
+
+
+def _format_column(values, width, precision):
+    """Format an array of floats as fixed-width text, as '%{width}d' (if
+       precision is None) or '%{width}.{precision}f' would. Return an
+       (N, width) array of characters, and a mask of values which could
+       not be formatted exactly this way (these need to be formatted by
+       Python instead)."""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        mag = np.abs(values)
+        if precision is None:
+            n = np.trunc(mag)
+            neg = (values < 0.) & (n > 0.)
+            bad = ~np.isfinite(values)
+        else:
+            scaled = mag * 10. ** precision
+            n = np.rint(scaled)
+            neg = np.signbit(values)
+            # Python rounds the exact binary value, so give up if the
+            # scaled value is too close to a tie to be rounded reliably
+            bad = ~np.isfinite(values) | (
+                np.abs(np.abs(scaled - n) - 0.5) <= scaled * 1e-15 + 1e-300)
+        bad |= ~(n < 1e18)
+    n = np.where(bad, 0., n).astype(np.int64)
+    if precision:
+        # Integer part, decimal point, then zero-padded decimal places
+        int_width = max(width - precision - 1, 1)
+        int_chars, ndigit, ibad = _format_int(n // 10 ** precision,
+                                              int_width, zero_pad=False)
+        frac_chars = _format_int(n % 10 ** precision, precision,
+                                 zero_pad=True)[0]
+        out = np.empty((len(n), int_width + 1 + precision), dtype=np.uint8)
+        out[:, :int_width] = int_chars
+        out[:, int_width] = ord('.')
+        out[:, int_width + 1:] = frac_chars
+        length = ndigit + 1 + precision + neg
+    else:
+        out, ndigit, ibad = _format_int(n, width, zero_pad=False)
+        length = ndigit + neg
+    bad |= ibad | (length > width)
+    # Place the minus sign just before the first digit
+    neg_ind = np.flatnonzero(neg & ~bad)
+    out[neg_ind, out.shape[1] - length[neg_ind]] = ord('-')
+    return out[:, out.shape[1] - width:], bad
+
+
+def _format_rows(fmt, table):
+    """Format each row of a 2D array using the given printf-style format
+       string, which may contain only %Nd and %N.Mf conversions (one for
+       each column). Return an (N, line length) array of characters, and a
+       mask of rows which could not be formatted this way."""
+    specs = list(_FORMAT_SPEC.finditer(fmt))
+    if table.ndim != 2 or table.shape[1] != len(specs) \
+            or '%' in _FORMAT_SPEC.sub('', fmt):
+        raise ValueError("Format %r does not match table" % fmt)
+    pieces = []
+    bad = np.zeros(len(table), dtype=bool)
+    last = 0
+    for i, spec in enumerate(specs):
+        pieces.append(np.frombuffer(
+            fmt[last:spec.start()].encode('ascii'), dtype=np.uint8))
+        width = int(spec.group(1))
+        precision = int(spec.group(2)) if spec.group(3) == 'f' else None
+        chars, colbad = _format_column(table[:, i], width, precision)
+        pieces.append(chars)
+        bad |= colbad
+        last = spec.end()
+    pieces.append(np.frombuffer(fmt[last:].encode('ascii'), dtype=np.uint8))
+    out = np.empty((len(table), sum(p.shape[-1] for p in pieces)),
+                   dtype=np.uint8)
+    pos = 0
+    for p in pieces:
+        out[:, pos:pos + p.shape[-1]] = p
+        pos += p.shape[-1]
+    return out, bad
+
+
+class LineBuffer:
+    """Lines of text, each with an integer key, which are formatted in
+       blocks and then joined in key order (lines with equal keys stay in
+       the order they were added).
+
+       Numeric tables are formatted a column at a time (see add_rows()),
+       giving exactly the same text as Python's % operator."""
+
+    def __init__(self):
+        self._keys, self._data, self._lengths = [], [], []
+        # Position of each line in the order it was added
+        self._seq = []
+        self._nline = 0
+
+    def add_rows(self, keys, fmt, *columns):
+        """Add one line for each row of the given 2D arrays (which are
+           concatenated horizontally), formatted with the given printf-style
+           format string, which may contain only %Nd and %N.Mf conversions
+           (one for each column). `keys` gives the key for each line."""
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(keys) == 0:
+            return
+        table = np.hstack([np.asarray(c, dtype=np.float64).reshape(len(keys),
+                                                                   -1)
+                           for c in columns])
+        chars, bad = _format_rows(fmt, table)
+        good = np.flatnonzero(~bad)
+        self._add(keys[good], self._nline + good, chars[good].ravel(),
+                  np.full(len(good), chars.shape[1], dtype=np.int64))
+        if len(good) < len(keys):
+            # Let Python handle anything unusual (overflow, NaN, etc.)
+            bad = np.flatnonzero(bad)
+            self._add_text(keys[bad], self._nline + bad,
+                           [fmt % tuple(row) for row in table[bad].tolist()])
+        self._nline += len(keys)
+
+    def add_lines(self, keys, lines):
+        """Add already-formatted lines of (latin-1) text, with the given
+           keys"""
+        self._add_text(keys, self._nline + np.arange(len(lines)), lines)
+        self._nline += len(lines)
+
+    def _add_text(self, keys, seq, lines):
+        self._add(keys, seq,
+                  np.frombuffer(''.join(lines).encode('latin-1'),
+                                dtype=np.uint8),
+                  np.array([len(line) for line in lines], dtype=np.int64))
+
+    def _add(self, keys, seq, data, lengths):
+        self._keys.append(np.asarray(keys, dtype=np.int64))
+        self._seq.append(seq)
+        self._data.append(data)
+        self._lengths.append(lengths)
+
+    def __len__(self):
+        return self._nline
+
+    def getvalue(self):
+        """Get all lines, in key order, as a single string"""
+        if len(self) == 0:
+            return ''
+        keys = np.concatenate(self._keys)
+        lengths = np.concatenate(self._lengths)
+        starts = np.cumsum(lengths) - lengths
+        order = np.lexsort((np.concatenate(self._seq), keys))
+        ind, offsets = ragged_index(starts[order], lengths[order])
+        return np.concatenate(self._data)[ind].tobytes().decode('latin-1')
+
+
+def split_range(size, nrange):
+    """Split range(size) (for example, the bytes of a file, or the
+       restraints in a store) into nrange contiguous ranges, returning a
+       list of (start, end) pairs"""
+    bounds = [size * i // nrange for i in range(nrange + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _write_cache(fh, columns, source, write_column):
+    """Write a binary cache file (see RestraintStore.save()) to the given
+       file handle. `columns` is a list of the (name, dtype, length) of each
+       array; write_column(name) is called to write the data of each in
+       turn."""
+    meta = {}
+    offset = 0
+    for name, dtype, length in columns:
+        offset += -offset % _CACHE_ALIGN
+        meta[name] = {'dtype': np.dtype(dtype).str, 'offset': offset,
+                      'length': length}
+        offset += length * np.dtype(dtype).itemsize
+    header = json.dumps({'version': _CACHE_VERSION, 'source': source,
+                         'columns': meta}).encode('ascii')
+    start = len(_CACHE_MAGIC) + 8 + len(header)
+    header += b' ' * (-start % _CACHE_ALIGN)
+    fh.write(_CACHE_MAGIC + len(header).to_bytes(8, 'little') + header)
+    offset = 0
+    for name, dtype, length in columns:
+        fh.write(b'\0' * (meta[name]['offset'] - offset))
+        write_column(name)
+        offset = meta[name]['offset'] + length * np.dtype(dtype).itemsize
+
+
+def _write_cache_for(fname, st, digest, save):
+    """Atomically write the binary cache of the named restraints file,
+       using save(fh, source) (see RestraintStore.write_cache_for())"""
+    source = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+              'sha256': digest}
+    cache = fname + CACHE_SUFFIX
+    try:
+        with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(os.path.abspath(cache)),
+                prefix=os.path.basename(cache) + '.',
+                delete=False) as fh:
+            save(fh, source)
+        try:
+            # Don't write a cache if the file changed while we read it
+            new_st = os.stat(fname)
+            if (new_st.st_size, new_st.st_mtime_ns) \
+                    == (st.st_size, st.st_mtime_ns):
+                os.replace(fh.name, cache)
+        finally:
+            if os.path.exists(fh.name):
+                os.unlink(fh.name)
+    except OSError:
+        pass
+
+
+class RestraintStore:
+    """All restraints from a Modeller restraints file, held as typed arrays.
+
+       Each restraint has one entry in each of the scalar columns
+       (`form`, `modal`, `feat`, `group`, `natom`, `nparam`, `nfeat`).
+       Variable-length data are held in flat arrays, indexed by offsets;
+       for example the (1-based) atom indices of the i'th restraint are
+       ``atoms[atoms_start[i]:atoms_start[i+1]]``. Feature types other
+       than the first are held in `feats`, numeric parameters in `params`,
+       and parameters of `VERBATIM_FORMS` (or any that are not valid
+       numbers) as ASCII text in `text`.
+    """
+
+    def __init__(self, **columns):
+        for name in SCALAR_COLUMNS:
+            setattr(self, name, columns[name])
+        for name, dtype in RAGGED_COLUMNS:
+            setattr(self, name, columns[name])
+            setattr(self, name + '_start', columns[name + '_start'])
+
+    @classmethod
+    def column_names(cls):
+        """Get the names of all arrays that make up a store"""
+        names = list(SCALAR_COLUMNS)
+        for name, dtype in RAGGED_COLUMNS:
+            names.extend((name, name + '_start'))
+        return names
+
+    def get_columns(self):
+        """Get a dict of all arrays that make up this store"""
+        return dict((name, getattr(self, name))
+                    for name in self.column_names())
+
+    @classmethod
+    def empty(cls):
+        """Make a store containing no restraints"""
+        columns = dict((name, np.zeros(0, dtype=np.int32))
+                       for name in SCALAR_COLUMNS)
+        for name, dtype in RAGGED_COLUMNS:
+            columns[name] = np.zeros(0, dtype=dtype)
+            columns[name + '_start'] = np.zeros(1, dtype=np.int64)
+        return cls(**columns)
+
+    @classmethod
+    def read(cls, fh, chunk_size=1 << 24):
+        """Read all restraints from the given file handle (text or binary).
+           Only lines starting with 'R' are considered. The file is processed
+           approximately `chunk_size` bytes at a time to keep temporary
+           memory use low."""
+        return cls.concatenate(list(cls.iter_read(fh, chunk_size)))
+
+    @classmethod
+    def read_file(cls, fname, cache=True):
+        """Read all restraints from the named file, which can be either a
+           Modeller restraints file or a binary cache (see save()).
+
+           If `cache` is True, restraints are read from the binary cache
+           alongside a restraints file (the same name plus CACHE_SUFFIX)
+           if it is up to date; otherwise the restraints file is parsed
+           and the cache (re)written, if possible."""
+        if is_cache_file(fname):
+            return cls.load(fname)[0]
+        if cache:
+            store = cls.load_cache_for(fname)
+            if store is not None:
+                return store
+        st = os.stat(fname)
+        with open(fname, 'rb') as fh:
+            hfh = HashingReader(fh)
+            store = cls.read(hfh)
+        if cache:
+            store.write_cache_for(fname, st, hfh.hash.hexdigest())
+        return store
+
+    @classmethod
+    def load_cache_for(cls, fname):
+        """Load the binary cache of the named restraints file, if it exists
+           and is up to date, or return None. The cache is considered up
+           to date if the file's size and modification time match those
+           recorded in the cache or, failing that, its size and hash (if
+           a hash was recorded)."""
+        try:
+            store, header = cls.load(fname + CACHE_SUFFIX)
+        except (OSError, ValueError, KeyError):
+            return None
+        source = header.get('source')
+        st = os.stat(fname)
+        if source is None or source['size'] != st.st_size:
+            return None
+        if (source['mtime_ns'] == st.st_mtime_ns
+                or (source['sha256'] is not None
+                    and source['sha256'] == get_file_hash(fname))):
+            return store
+
+    def write_cache_for(self, fname, st, digest):
+        """Write a binary cache of the named restraints file, which had
+           os.stat() result `st` and SHA-256 hash `digest` (or None, if
+           not known) when this store was read. The cache is replaced
+           atomically, so concurrent readers and writers are safe. Any
+           errors (for example, if the directory is not writable) are
+           ignored."""
+        _write_cache_for(fname, st, digest, self.save)
+
+    def save(self, fh, source=None):
+        """Write this store in binary form to the given binary file handle.
+           `source`, if given, is a dict describing the original
+           restraints file (see load_cache_for())."""
+        columns = self.get_columns()
+        _write_cache(fh, [(name, a.dtype, len(a))
+                          for name, a in columns.items()], source,
+                     lambda name: fh.write(
+                         np.ascontiguousarray(columns[name]).tobytes()))
+
+    @classmethod
+    def load(cls, fname):
+        """Load a store from a binary file written by save(). The arrays
+           are memory-mapped from the file. Return the store and the
+           file's header."""
+        with open(fname, 'rb') as fh:
+            if fh.read(len(_CACHE_MAGIC)) != _CACHE_MAGIC:
+                raise ValueError("%s is not a restraints cache file" % fname)
+            size = int.from_bytes(fh.read(8), 'little')
+            header = json.loads(fh.read(size).decode('ascii'))
+            if header.get('version') != _CACHE_VERSION:
+                raise ValueError("%s: unsupported cache version" % fname)
+            start = fh.tell()
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        columns = {}
+        for name in cls.column_names():
+            c = header['columns'][name]
+            columns[name] = np.frombuffer(buf, dtype=np.dtype(c['dtype']),
+                                          count=c['length'],
+                                          offset=start + c['offset'])
+        return cls(**columns), header
+
+    def write(self, fh):
+        """Write all restraints in Modeller text format to the given
+           file handle"""
+        fh.write("MODELLER5 VERSION: MODELLER FORMAT\n")
+        for i in range(len(self)):
+            feats = self.feats[self.feats_start[i]:self.feats_start[i + 1]]
+            fh.write('R %4d %3d %3d %3d %3d %3d %3d '
+                     % (self.form[i], self.modal[i], self.feat[i],
+                        self.group[i], self.natom[i], self.nparam[i],
+                        self.nfeat[i])
+                     + ''.join('%d ' % x for x in feats.tolist())
+                     + ' '.join('%5d' % x for x in self.get_atoms(i).tolist())
+                     + '    '
+                     + ' '.join(str(x) for x in self.get_parameters(i))
+                     + '\n')
+
+    @classmethod
+    def iter_read(cls, fh, chunk_size=1 << 24):
+        """Like read(), but yield a separate store for each chunk of
+           the file (approximately `chunk_size` bytes) in turn."""
+        while True:
+            data = fh.read(chunk_size)
+            if not data:
+                break
+            # Make sure we always end a chunk on a line boundary
+            data += fh.readline()
+            if isinstance(data, str):
+                data = data.encode('latin-1')
+            yield cls.from_bytes(data)
+
+    @classmethod
+    def read_range(cls, fh, start, end):
+        """Read restraints from the given range of bytes of a binary file.
+           Restraints are read from every line that starts within the range,
+           so a set of ranges that cover a file (see split_range()) reads
+           every restraint exactly once."""
+        if start > 0:
+            # Skip any line that starts before the range
+            fh.seek(start - 1)
+            fh.readline()
+        else:
+            fh.seek(0)
+        pos = fh.tell()
+        if pos >= end:
+            return cls.empty()
+        data = fh.read(end - pos)
+        if not data.endswith(b'\n'):
+            data += fh.readline()
+        return cls.from_bytes(data)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Make a store from the restraint lines (those starting with 'R')
+           in the given list of lines."""
+        return cls.from_bytes('\n'.join(lines).encode('latin-1'))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Make a store from the restraint lines (those starting with 'R')
+           in the given bytes object."""
+        # Drop the leading 'R' so that every token in body is a number
+        lines = [line[1:] for line in data.split(b'\n')
+                 if line.startswith(b'R')]
+        if not lines:
+            return cls.empty()
+        body = b'\n'.join(lines)
+        values = None
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            try:
+                values = np.fromstring(body, sep=' ')
+            except (ValueError, DeprecationWarning):
+                pass
+        # Find the start of every token, and which line it is on
+        chars = np.frombuffer(body, dtype=np.uint8)
+        space = chars <= 32
+        prev_space = np.empty_like(space)
+        prev_space[0] = True
+        prev_space[1:] = space[:-1]
+        tok_start = np.flatnonzero(~space & prev_space)
+        line_end = np.append(np.flatnonzero(chars == 10), len(body))
+        ntok = np.bincount(np.searchsorted(line_end, tok_start),
+                           minlength=len(lines))
+        if values is None or len(values) != len(tok_start):
+            # Some tokens are not numbers, so fall back to slower parsing
+            return cls._from_rows([line.decode('latin-1').split()
+                                   for line in lines])
+        return cls._from_tokens(values, ntok, lines, tok_start, line_end,
+                                body)
+
+    @classmethod
+    def _from_tokens(cls, values, ntok, lines, tok_start, line_end, body):
+        """Make a store from the numeric values of all tokens"""
+        if ntok.min() < 7:
+            raise ValueError("Invalid restraint line: R%s"
+                             % lines[int(np.argmin(ntok))].decode('latin-1'))
+        first = np.cumsum(ntok) - ntok
+        header = values[first[:, np.newaxis] + np.arange(7)].astype(np.int32)
+        columns = dict((name, np.ascontiguousarray(header[:, i]))
+                       for i, name in enumerate(SCALAR_COLUMNS))
+
+        natom = columns['natom'].astype(np.int64)
+        nextra = np.maximum(columns['nfeat'].astype(np.int64) - 1, 0)
+        nparam = ntok - 7 - nextra - natom
+        if nparam.min() < 0:
+            raise ValueError(
+                "Invalid restraint line: R%s"
+                % lines[int(np.argmin(nparam))].decode('latin-1'))
+
+        ind, columns['feats_start'] = ragged_index(first + 7, nextra)
+        columns['feats'] = values[ind].astype(np.int32)
+        ind, columns['atoms_start'] = ragged_index(first + 7 + nextra, natom)
+        columns['atoms'] = values[ind].astype(np.int32)
+
+        pfirst = first + 7 + nextra + natom
+        verbatim = np.isin(columns['form'], VERBATIM_FORMS) & (nparam > 0)
+        ind, columns['params_start'] = ragged_index(
+            pfirst, np.where(verbatim, 0, nparam))
+        columns['params'] = values[ind]
+
+        # Keep the original text of the parameters of verbatim restraints
+        text = [b''] * len(lines)
+        for i in np.flatnonzero(verbatim):
+            text[i] = b' '.join(
+                body[tok_start[pfirst[i]]:line_end[i]].split())
+        cls._set_text(columns, text)
+        return cls(**columns)
+
+    @classmethod
+    def _from_rows(cls, rows):
+        """Make a store from the list of tokens on each restraint line"""
+        ntok = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        if ntok.min() < 7:
+            bad = rows[int(np.argmin(ntok))]
+            raise ValueError("Invalid restraint line: R %s" % ' '.join(bad))
+        tokens = np.array(list(itertools.chain.from_iterable(rows)))
+        first = np.cumsum(ntok) - ntok
+        header = tokens[first[:, np.newaxis]
+                        + np.arange(7)].astype(np.int32)
+        columns = dict((name, np.ascontiguousarray(header[:, i]))
+                       for i, name in enumerate(SCALAR_COLUMNS))
+
+        natom = columns['natom'].astype(np.int64)
+        nextra = np.maximum(columns['nfeat'].astype(np.int64) - 1, 0)
+        nparam = ntok - 7 - nextra - natom
+        if nparam.min() < 0:
+            bad = rows[int(np.argmin(nparam))]
+            raise ValueError("Invalid restraint line: R %s" % ' '.join(bad))
+
+        ind, columns['feats_start'] = ragged_index(first + 7, nextra)
+        columns['feats'] = tokens[ind].astype(np.int32)
+        ind, columns['atoms_start'] = ragged_index(first + 7 + nextra, natom)
+        columns['atoms'] = tokens[ind].astype(np.int32)
+
+        # Keep as text any restraints with non-numeric parameters
+        pfirst = first + 7 + nextra + natom
+        verbatim = np.isin(columns['form'], VERBATIM_FORMS)
+        for i in np.flatnonzero(~verbatim):
+            try:
+                np.array(rows[i][pfirst[i] - first[i]:], dtype=np.float64)
+            except ValueError:
+                verbatim[i] = True
+        verbatim &= nparam > 0
+        ind, columns['params_start'] = ragged_index(
+            pfirst, np.where(verbatim, 0, nparam))
+        columns['params'] = tokens[ind].astype(np.float64)
+
+        text = [' '.join(rows[i][pfirst[i] - first[i]:]).encode('latin-1')
+                if verbatim[i] else b'' for i in range(len(rows))]
+        cls._set_text(columns, text)
+        return cls(**columns)
+
+    @staticmethod
+    def _set_text(columns, text):
+        columns['text_start'] = np.zeros(len(text) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in text], out=columns['text_start'][1:])
+        columns['text'] = np.frombuffer(b''.join(text), dtype=np.uint8)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """Combine several stores into one, in order"""
+        if not stores:
+            return cls.empty()
+        elif len(stores) == 1:
+            return stores[0]
+        columns = dict((name, np.concatenate([getattr(s, name)
+                                              for s in stores]))
+                       for name in SCALAR_COLUMNS)
+        for name, dtype in RAGGED_COLUMNS:
+            columns[name] = np.concatenate([getattr(s, name) for s in stores])
+            starts = [np.zeros(1, dtype=np.int64)]
+            offset = 0
+            for s in stores:
+                st = getattr(s, name + '_start')
+                starts.append(st[1:] + offset)
+                offset += st[-1]
+            columns[name + '_start'] = np.concatenate(starts)
+        return cls(**columns)
+
+    def __len__(self):
+        return len(self.form)
+
+    @property
+    def nbytes(self):
+        """Total size, in bytes, of all arrays in this store"""
+        return sum(a.nbytes for a in self.get_columns().values())
+
+    def slice(self, start, stop):
+        """Make a new store containing restraints start through stop-1.
+           Unlike take(), the new store's arrays are views of this
+           store's, so no data are copied."""
+        stop = min(stop, len(self))
+        start = min(start, stop)
+        columns = dict((name, getattr(self, name)[start:stop])
+                       for name in SCALAR_COLUMNS)
+        for name, dtype in RAGGED_COLUMNS:
+            s = getattr(self, name + '_start')[start:stop + 1]
+            columns[name] = getattr(self, name)[s[0]:s[-1]]
+            columns[name + '_start'] = s - s[0]
+        return type(self)(**columns)
+
+    def take(self, ind):
+        """Make a new store containing only the given restraints, in order"""
+        ind = np.asarray(ind, dtype=np.int64)
+        columns = dict((name, getattr(self, name)[ind])
+                       for name in SCALAR_COLUMNS)
+        for name, dtype in RAGGED_COLUMNS:
+            start = getattr(self, name + '_start')
+            rind, columns[name + '_start'] = ragged_index(
+                start[ind], start[ind + 1] - start[ind])
+            columns[name] = getattr(self, name)[rind]
+        return type(self)(**columns)
+
+    def get_atoms(self, i):
+        """Get the 1-based atom indices of the i'th restraint"""
+        return self.atoms[self.atoms_start[i]:self.atoms_start[i + 1]]
+
+    def get_parameters(self, i):
+        """Get the parameters of the i'th restraint, as a list of floats
+           (or strings, for restraints kept as text)"""
+        start, end = self.text_start[i], self.text_start[i + 1]
+        if end > start:
+            return self.text[start:end].tobytes().decode('latin-1').split()
+        else:
+            return self.params[self.params_start[i]:
+                               self.params_start[i + 1]].tolist()
+
+
+class CacheWriter:
+    """Build the binary cache of a restraints file (see
+       RestraintStore.save()) one store at a time, so that the complete
+       set of restraints never has to be held in memory.
+
+       Each array is appended to its own temporary file (in directory
+       `dir`) as stores are added; the arrays are copied into the cache
+       by write_cache_for().
+    """
+
+    def __init__(self, dir=None):
+        self._dtypes = dict((name, np.dtype(np.int32))
+                            for name in SCALAR_COLUMNS)
+        for name, dtype in RAGGED_COLUMNS:
+            self._dtypes[name] = np.dtype(dtype)
+            self._dtypes[name + '_start'] = np.dtype(np.int64)
+        self._files = dict((name, tempfile.TemporaryFile(dir=dir))
+                           for name in RestraintStore.column_names())
+        self._lengths = dict.fromkeys(self._files, 0)
+        self._offsets = {}
+        for name, dtype in RAGGED_COLUMNS:
+            self._offsets[name] = 0
+            self._write(name + '_start', np.zeros(1, dtype=np.int64))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Remove all temporary files"""
+        for fh in self._files.values():
+            fh.close()
+        self._files = {}
+
+    def _write(self, name, a):
+        a = np.ascontiguousarray(a, dtype=self._dtypes[name])
+        self._files[name].write(a.tobytes())
+        self._lengths[name] += len(a)
+
+    def append(self, store):
+        """Add all restraints in the given store to the end of the cache"""
+        for name in SCALAR_COLUMNS:
+            self._write(name, getattr(store, name))
+        for name, dtype in RAGGED_COLUMNS:
+            self._write(name, getattr(store, name))
+            start = getattr(store, name + '_start')
+            self._write(name + '_start', start[1:] + self._offsets[name])
+            self._offsets[name] += int(start[-1])
+
+    def save(self, fh, source=None):
+        """Write the cache to the given binary file handle (see
+           RestraintStore.save())"""
+        def write_column(name):
+            tmp = self._files[name]
+            tmp.flush()
+            tmp.seek(0)
+            shutil.copyfileobj(tmp, fh)
+        _write_cache(fh, [(name, self._dtypes[name], self._lengths[name])
+                          for name in RestraintStore.column_names()],
+                     source, write_column)
+
+    def write_cache_for(self, fname, st, digest):
+        """Write the cache of the named restraints file (see
+           RestraintStore.write_cache_for())"""
+        _write_cache_for(fname, st, digest, self.save)
+
+
+class RestraintBuffer:
+    """An ordered collection of RestraintStores, each optionally with
+       extra per-restraint arrays (such as a classification).
+
+       Stores are kept in memory until their total size exceeds `max_size`
+       bytes. Any further stores are written to an anonymous temporary
+       file (in directory `dir`) and are memory-mapped when read back.
+    """
+
+    # Alignment, in bytes, of each array in the temporary file
+    _align = 64
+
+    def __init__(self, max_size=1 << 30, dir=None):
+        self.max_size, self.dir = max_size, dir
+        self.size = 0
+        self._chunks = []
+        self._spill = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Discard all stores, and remove the temporary file, if any"""
+        self._chunks = []
+        self.size = 0
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    @property
+    def spilled(self):
+        """True iff some stores have been written to a temporary file"""
+        return self._spill is not None
+
+    def append(self, store, **data):
+        """Add a store to the end of the buffer, plus any extra arrays"""
+        columns = store.get_columns()
+        columns.update(data)
+        size = sum(a.nbytes for a in columns.values())
+        if self.size + size > self.max_size:
+            columns = self._write_spill(columns)
+        else:
+            self.size += size
+        self._chunks.append(columns)
+
+    def _write_spill(self, columns):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=self.dir)
+        spilled = {}
+        for name, a in columns.items():
+            a = np.ascontiguousarray(a)
+            offset = self._spill.seek(0, 2)
+            pad = -offset % self._align
+            self._spill.write(b'\0' * pad)
+            spilled[name] = (a.dtype, offset + pad, len(a))
+            self._spill.write(a.tobytes())
+        return spilled
+
+    def _read_spill(self, columns):
+        def _read(val):
+            if not isinstance(val, tuple):
+                return val
+            dtype, offset, length = val
+            if length == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(self._spill, dtype=dtype, mode='r',
+                             offset=offset, shape=(length,))
+        return dict((name, _read(val)) for name, val in columns.items())
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __iter__(self):
+        """Yield each (store, data) pair in turn, where data is a dict
+           of any extra arrays passed to append()"""
+        if self._spill is not None:
+            self._spill.flush()
+        names = RestraintStore.column_names()
+        for columns in self._chunks:
+            columns = self._read_spill(columns)
+            data = dict((name, a) for name, a in columns.items()
+                        if name not in names)
+            yield (RestraintStore(**dict((name, columns[name])
+                                         for name in names)), data)
@@ -0,0 +1,211 @@
+"""Lightweight, Modeller-free view of the atoms and residues in a PDB file."""
+
+import collections
+import numpy as np
+
+
+Chain = collections.namedtuple('Chain', ['name'])
+Residue = collections.namedtuple('Residue', ['index', 'pdb_name', 'num',
+                                             'chain', 'hetatm'])
+Atom = collections.namedtuple('Atom', ['index', 'name', 'residue'])
+
+
+# Residue types that Modeller reads from ATOM records without any renaming
+_STANDARD_RESIDUES = np.array(
+    ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+     'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL',
+     'ADE', 'A', 'DA', 'THY', 'T', 'DT', 'URA', 'U', 'DU', 'GUA', 'G', 'DG',
+     'CYT', 'C', 'DC'], dtype='S3')
+_WATERS = np.array(['HOH', 'WAT', 'H2O', 'DOD', 'TIP', 'SOL'], dtype='S3')
+
+
+class UnsupportedPDBError(Exception):
+    """The PDB file uses features that ModelSnapshot.read() does not
+       handle the same way as Modeller"""
+    pass
+
+
+def _get_column(text, start, end):
+    """Get the given columns of a fixed-width character array, as an array
+       of stripped byte strings"""
+    col = np.ascontiguousarray(text[:, start:end]).view('S%d' % (end - start))
+    return np.char.strip(col[:, 0])
+
+
+def _get_coordinates(text):
+    """Get coordinates from a fixed-width character array of PDB atoms"""
+    # NumPy's string-to-float conversion gives the same results as float()
+    cols = np.ascontiguousarray(text[:, 30:54]).view('S8')
+    return cols.astype(float).reshape(-1, 3)
+
+
+def _read_atom_records(fname, hetatm, water):
+    """Read the ATOM and HETATM records from the named PDB file that
+       Modeller would use, as a fixed-width character array. Return that
+       array, the atom and residue names of each record, whether each is
+       a HETATM record, and whether each starts a new residue.
+       See :meth:`ModelSnapshot.read`."""
+    with open(fname, 'rb') as fh:
+        lines = fh.read().splitlines()
+    # Handle the file as a fixed-width array of characters
+    text = np.frombuffer(b''.join([line[:80].ljust(80) for line in lines]),
+                         dtype=np.uint8).reshape(-1, 80)
+    rec = _get_column(text, 0, 6)
+    end = np.flatnonzero((rec == b'END') | (rec == b'ENDMDL'))
+    if len(end) > 0:
+        text, rec = text[:end[0]], rec[:end[0]]
+    if np.any(rec == b'MODEL'):
+        raise UnsupportedPDBError("%s: MODEL records" % fname)
+    text = text[(rec == b'ATOM') | (rec == b'HETATM')]
+    is_het = text[:, 0] == ord('H')
+    resname = _get_column(text, 17, 20)
+    keep = np.where(np.isin(resname, _WATERS), water, hetatm | ~is_het)
+
+    name = _get_column(text, 12, 16)
+    element = _get_column(text, 76, 78)
+    # Without an element column, guess from the name, as for PDB v2
+    first = np.char.lstrip(name, b'0123456789').astype('S1')
+    maybe_h = np.isin(first, [b'H', b'D'])
+    hydrogen = np.where(element == b'', maybe_h,
+                        np.isin(element, [b'H', b'D']))
+    bad = keep & (element == b'') & maybe_h & is_het
+    if np.any(bad):
+        raise UnsupportedPDBError("%s: possible hydrogen %s"
+                                  % (fname, name[bad][0].decode()))
+    keep &= ~hydrogen
+    if np.any(keep & (text[:, 16] != ord(' '))):
+        raise UnsupportedPDBError("%s: alternate locations" % fname)
+    bad = keep & ~is_het & ~np.isin(resname, _STANDARD_RESIDUES)
+    if np.any(bad):
+        raise UnsupportedPDBError("%s: residue type %s"
+                                  % (fname, resname[bad][0].decode()))
+
+    text = text[keep]
+    # A new residue starts wherever residue name, chain or number change
+    new_res = np.ones(len(text), dtype=bool)
+    new_res[1:] = np.any(text[1:, 17:27] != text[:-1, 17:27], axis=1)
+    return text, name[keep], resname[keep], is_het[keep], new_res
+
+
+def read_ca_p_coordinates(fname):
+    """Read the named PDB file (without HETATM records) and return an Nx3
+       array of the coordinates of one atom per residue: the first CA atom,
+       or the first P atom if the residue has no CA, or NaN if it has
+       neither. :exc:`UnsupportedPDBError` is raised for the same files as
+       :meth:`ModelSnapshot.read`."""
+    text, name, resname, is_het, new_res = _read_atom_records(
+        fname, hetatm=False, water=False)
+    residue = np.cumsum(new_res) - 1
+    nres = np.count_nonzero(new_res)
+    atom = np.full(nres, -1, dtype=np.intp)
+    for atom_name in (b'P', b'CA'):
+        # Reverse order so that the first matching atom wins
+        ind = np.flatnonzero(name == atom_name)[::-1]
+        atom[residue[ind]] = ind
+    coord = np.full((nres, 3), np.nan)
+    found = atom >= 0
+    coord[found] = _get_coordinates(text[atom[found]])
+    return coord
+
+
+class ModelSnapshot:
+    """Atom names, residue names, residue indices, HETATM flags and
+       coordinates of a structure, as NumPy arrays, with atoms and
+       residues in the same order as in a Modeller model.
+
+       Atom and residue indices in :attr:`atoms` and :attr:`residues` start
+       from 1, like Modeller's; the `atom_residue` array is 0-based, so it
+       can be used directly to index the residue arrays."""
+
+    def __init__(self, atom_name, atom_residue, coord, residue_name,
+                 residue_num, residue_chain, residue_hetatm):
+        self.atom_name = np.asarray(atom_name, dtype=str)
+        self.atom_residue = np.asarray(atom_residue, dtype=np.intp)
+        self.coord = np.asarray(coord, dtype=float).reshape(-1, 3)
+        self.residue_name = np.asarray(residue_name, dtype=str)
+        self.residue_num = np.asarray(residue_num, dtype=str)
+        self.residue_chain = np.asarray(residue_chain, dtype=str)
+        self.residue_hetatm = np.asarray(residue_hetatm, dtype=bool)
+        self._atoms = self._residues = None
+
+    @classmethod
+    def read(cls, fname, hetatm=True, water=False):
+        """Read the named PDB file, with the same meaning for `hetatm` and
+           `water` as Modeller's io.hetatm and io.water. Like Modeller,
+           hydrogens are skipped, as is everything after the first END or
+           ENDMDL record.
+           Only simple files (such as those written by Modeller itself)
+           are handled; :exc:`UnsupportedPDBError` is raised for files
+           that Modeller might read differently (alternate locations,
+           multiple models, nonstandard ATOM residues, or HETATM atoms
+           that might be hydrogens but have no element column)."""
+        text, name, resname, is_het, new_res = _read_atom_records(
+            fname, hetatm, water)
+        first = text[new_res]
+        return cls(name.astype(str), np.cumsum(new_res) - 1,
+                   _get_coordinates(text), resname[new_res].astype(str),
+                   _get_column(first, 22, 27).astype(str),
+                   first[:, 21].view('S1').astype(str), is_het[new_res])
+
+    @classmethod
+    def from_model(cls, mdl):
+        """Make a snapshot of an existing Modeller model"""
+        residues = list(mdl.residues)
+        first = residues[0].index if residues else 1
+        names, atom_res, coord = [], [], []
+        for a in mdl.atoms:
+            names.append(a.name)
+            atom_res.append(a.residue.index - first)
+            coord.append((a.x, a.y, a.z))
+        return cls(names, atom_res, coord,
+                   [r.pdb_name for r in residues], [r.num for r in residues],
+                   [r.chain.name for r in residues],
+                   [r.hetatm for r in residues])
+
+    def __len__(self):
+        return len(self.atom_name)
+
+    def _get_residues(self):
+        if self._residues is None:
+            chains = {}
+            self._residues = [
+                Residue(n + 1, name, num,
+                        chains.setdefault(chain, Chain(chain)), het)
+                for n, (name, num, chain, het) in enumerate(zip(
+                    self.residue_name.tolist(), self.residue_num.tolist(),
+                    self.residue_chain.tolist(),
+                    self.residue_hetatm.tolist()))]
+        return self._residues
+    residues = property(_get_residues,
+                        doc="List of residues, as namedtuples similar "
+                            "to Modeller residues")
+
+    def _get_atoms(self):
+        if self._atoms is None:
+            res = self._get_residues()
+            self._atoms = [Atom(n + 1, name, res[r])
+                           for n, (name, r) in enumerate(zip(
+                               self.atom_name.tolist(),
+                               self.atom_residue.tolist()))]
+        return self._atoms
+    atoms = property(_get_atoms,
+                     doc="List of atoms, as namedtuples similar "
+                         "to Modeller atoms")
+
+
+def get_model_snapshot(env, fname):
+    """Get a :class:`ModelSnapshot` of the named PDB file, read using the
+       settings of the given Modeller environment (or with HETATM records
+       but not water, if `env` is None). The file is read directly if
+       possible; otherwise, it is read by Modeller."""
+    hetatm = env.io.hetatm if env is not None else True
+    water = env.io.water if env is not None else False
+    try:
+        return ModelSnapshot.read(fname, hetatm=hetatm, water=water)
+    except UnsupportedPDBError:
+        pass
+    import modeller
+    if env is None:
+        env = modeller.Environ()
+        env.io.hetatm = True
+    return ModelSnapshot.from_model(modeller.Model(env, file=fname))
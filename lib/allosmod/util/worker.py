@@ -0,0 +1,181 @@
+"""Run allosmod commands in a persistent worker process.
+
+The worker listens on a Unix socket. Each client sends its command line,
+working directory, environment, and standard input/output/error file
+descriptors; the worker forks a child with all of these set up (so that
+the command behaves exactly as if run directly) and replies with the
+child's exit code. Since the worker has already imported the command
+modules and Modeller, this avoids paying their startup cost for every
+command.
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+def run_on_worker(socket_path, args):
+    """Run the allosmod command `args` (without the leading 'allosmod')
+       on the worker listening on `socket_path`, and return its exit code.
+       If no worker is running, return None."""
+    if not hasattr(socket, 'send_fds'):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+        request = {'args': args, 'cwd': os.getcwd(),
+                   'env': dict(os.environ)}
+        for fh in (sys.stdout, sys.stderr):
+            fh.flush()
+        socket.send_fds(sock, [json.dumps(request).encode() + b'\n'],
+                        [0, 1, 2])
+        reply = _read_line(sock)
+        # If the worker died without replying, treat the command as failed
+        return json.loads(reply)['exit'] if reply else 1
+    finally:
+        sock.close()
+
+
+def _read_line(sock, data=b''):
+    """Read from the socket until a newline or end of file"""
+    while not data.endswith(b'\n'):
+        d = sock.recv(65536)
+        if not d:
+            break
+        data += d
+    return data
+
+
+def _read_request(conn):
+    """Read a request, plus standard input/output/error, from a client"""
+    data, fds, flags, addr = socket.recv_fds(conn, 65536, 3)
+    if len(fds) != 3:
+        raise ValueError("Expected 3 file descriptors, got %d" % len(fds))
+    return json.loads(_read_line(conn, data)), fds
+
+
+def _get_exit_code(status):
+    if os.WIFSIGNALED(status):
+        # Follow the shell convention for processes killed by a signal
+        return 128 + os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+
+def _run_command(request, fds, package):
+    """Run the requested command in this process and return its exit code"""
+    for fd, target in zip(fds, (0, 1, 2)):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    args = request['args']
+    sys.argv = ['allosmod ' + args[0]] + args[1:]
+    try:
+        mod = __import__(package + '.' + args[0], {}, {}, [''])
+        mod.main()
+        return 0
+    except SystemExit as err:
+        if err.code is None:
+            return 0
+        elif isinstance(err.code, int):
+            return err.code
+        else:
+            print(err.code, file=sys.stderr)
+            return 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        for fh in (sys.stdout, sys.stderr):
+            try:
+                fh.flush()
+            except OSError:
+                pass
+
+
+def _handle_connection(conn, package, log):
+    """Handle a single client connection. This is run in a child of the
+       worker, which forks again to run the command itself, so that it can
+       report the exit code even if the command crashes."""
+    import signal
+    for sig in (signal.SIGCHLD, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_DFL)
+    request, fds = _read_request(conn)
+    if log:
+        log.write("%s: allosmod %s\n" % (request['cwd'],
+                                         " ".join(request['args'])))
+        log.flush()
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        os._exit(_run_command(request, fds, package))
+    for fd in fds:
+        os.close(fd)
+    _, status = os.waitpid(pid, 0)
+    conn.sendall(json.dumps({'exit': _get_exit_code(status)}).encode()
+                 + b'\n')
+
+
+def preload(package, commands):
+    """Import Modeller (if available) and all of the given command modules,
+       so that forked children do not need to"""
+    try:
+        import modeller  # noqa: F401
+    except ImportError:
+        pass
+    for cmd in commands:
+        try:
+            __import__(package + '.' + cmd)
+        except ImportError:
+            pass
+
+
+def serve(socket_path, package='allosmod', idle_timeout=None, log=None):
+    """Accept and run commands on the given Unix socket until interrupted,
+       or until no command is received for `idle_timeout` seconds.
+       If `log` is given, each command is written to it."""
+    import signal
+    # Children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Exit cleanly (removing the socket) on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    old_umask = os.umask(0o077)  # only our user can connect
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    try:
+        sock.listen(16)
+        sock.settimeout(idle_timeout)
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                break
+            conn.settimeout(None)
+            for fh in (sys.stdout, sys.stderr):
+                fh.flush()
+            pid = os.fork()
+            if pid == 0:
+                sock.close()
+                ret = 0
+                try:
+                    _handle_connection(conn, package, log)
+                except BaseException:
+                    import traceback
+                    traceback.print_exc()
+                    ret = 1
+                finally:
+                    os._exit(ret)
+            conn.close()
+    finally:
+        sock.close()
+        os.unlink(socket_path)
@@ -0,0 +1,50 @@
+"""Run a persistent worker to speed up other allosmod commands."""
+
+import optparse
+import sys
+import allosmod._commands
+import allosmod.util.worker
+
+
+def parse_args():
+    usage = """%prog [opts] <socket>
+
+Run a worker process that listens on the given Unix socket and runs allosmod
+commands on request. The worker imports Modeller and all allosmod command
+modules once, so commands run through it start up much faster.
+
+To use the worker, set the ALLOSMOD_WORKER_SOCKET environment variable to the
+socket path; the allosmod front end will then pass all commands to the worker
+(with the same arguments, working directory, environment, input and output,
+and exit code). If no worker is listening on the socket, commands are run
+normally. For example:
+
+  allosmod worker --idle-timeout 600 $TMPDIR/allosmod.sock &
+  export ALLOSMOD_WORKER_SOCKET=$TMPDIR/allosmod.sock
+
+The worker runs until killed, or until the idle timeout is reached, and
+removes the socket on exit.
+"""
+    parser = optparse.OptionParser(usage)
+    parser.add_option("--idle-timeout", type=float, default=None,
+                      dest="idle_timeout", metavar='SECONDS',
+                      help="exit if no command is received for this "
+                           "many seconds")
+    parser.add_option("--verbose", action="store_true", default=False,
+                      help="log each command to standard error")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("incorrect number of arguments")
+    return args[0], opts
+
+
+def main():
+    socket_path, opts = parse_args()
+    allosmod.util.worker.preload(
+        'allosmod', [c for c in allosmod._commands.commands if c != 'worker'])
+    allosmod.util.worker.serve(socket_path, 'allosmod', opts.idle_timeout,
+                               sys.stderr if opts.verbose else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 import unittest
 import os
+import sys
+import subprocess
 import utils
 from utils import check_output
 TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -29,6 +31,32 @@ class Tests(unittest.TestCase):
         for args in (['bad-command'], ['help', 'bad-command']):
             check_output(['allosmod'] + args, retcode=1)
 
+    def test_startup_time(self):
+        """Check import time of 'allosmod' for simple commands"""
+        # Import time budget, in microseconds, for all modules imported by
+        # the dispatcher and each command (actual times are a few ms)
+        budget = 150000
+        for args in (['help'], ['getcofm', '--help'], ['pdb2ali', '--help'],
+                     ['translatepdb', '--help']):
+            p = subprocess.run([sys.executable, '-X', 'importtime',
+                                os.path.join(TOPDIR, 'bin', 'allosmod.in')]
+                               + args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               universal_newlines=True)
+            self.assertEqual(p.returncode, 0)
+            imports = {}
+            for line in p.stderr.split('\n'):
+                if line.startswith('import time:') and '|' in line:
+                    self_us, cumul, name = line[12:].split('|')
+                    if self_us.strip().isdigit():
+                        imports[name.strip()] = int(self_us)
+            self.assertNotIn('modeller', imports)
+            allosmod_time = sum(t for name, t in imports.items()
+                                if name.startswith('allosmod'))
+            self.assertLess(allosmod_time, budget,
+                            "allosmod %s: imports took %d us"
+                            % (' '.join(args), allosmod_time))
+
 
 if __name__ == '__main__':
     unittest.main()
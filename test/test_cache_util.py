@@ -0,0 +1,63 @@
+import unittest
+import os
+from unittest import mock
+import utils
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+
+from allosmod.util.cache import ResultCache, get_cache_dir  # noqa: E402
+
+
+class Tests(unittest.TestCase):
+    def test_get_cache_dir(self):
+        """Test get_cache_dir()"""
+        with mock.patch.dict(os.environ, {'ALLOSMOD_CACHE_DIR': '/foo',
+                                          'XDG_CACHE_HOME': '/bar'}):
+            self.assertEqual(get_cache_dir(), '/foo')
+        with mock.patch.dict(os.environ, {'ALLOSMOD_CACHE_DIR': '',
+                                          'XDG_CACHE_HOME': '/bar'}):
+            self.assertEqual(get_cache_dir(), '/bar/allosmod')
+
+    def test_result_cache(self):
+        """Test ResultCache"""
+        import numpy as np
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            with open(fname, 'w') as fh:
+                fh.write('foo')
+            c = ResultCache('test', directory=tmpdir)
+            key = c.get_key(fname, 10.0)
+            self.assertNotEqual(key, c.get_key(fname, 11.0))
+            self.assertIsNone(c.load(key))
+            c.save(key, a=np.array([1, 2, 3]), b=np.array([4.0]))
+            data = c.load(key)
+            self.assertEqual(sorted(data.keys()), ['a', 'b'])
+            self.assertEqual(list(data['a']), [1, 2, 3])
+            # Key depends only on the file contents
+            fname2 = os.path.join(tmpdir, 'test2.pdb')
+            with open(fname2, 'w') as fh:
+                fh.write('foo')
+            self.assertEqual(c.get_key(fname2, 10.0), key)
+            with open(fname2, 'w') as fh:
+                fh.write('bar')
+            self.assertNotEqual(c.get_key(fname2, 10.0), key)
+            # No temporary files should be left behind
+            self.assertEqual(os.listdir(os.path.join(tmpdir, 'test', key[:2])),
+                             [key + '.npz'])
+            # Corrupt files are ignored
+            with open(os.path.join(tmpdir, 'test', key[:2], key + '.npz'),
+                      'w') as fh:
+                fh.write('garbage')
+            self.assertIsNone(c.load(key))
+            # Disabled cache does nothing
+            c = ResultCache('test', directory=tmpdir, enabled=False)
+            c.save(key, a=np.array([1]))
+            self.assertIsNone(c.load(key))
+            # Unwritable cache directory is ignored
+            c = ResultCache('test', directory=fname)
+            c.save(key, a=np.array([1]))
+            self.assertIsNone(c.load(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
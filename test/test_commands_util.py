@@ -0,0 +1,68 @@
+import unittest
+import os
+import sys
+import subprocess
+import utils
+from io import StringIO
+
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+
+import allosmod.util.commands  # noqa:E402
+
+PACKAGE_DIR = os.path.join(TOPDIR, 'lib', 'allosmod')
+
+
+class Tests(unittest.TestCase):
+    def test_get_commands(self):
+        """Test get_commands()"""
+        with utils.temporary_directory() as tmpdir:
+            for name, contents in (('cmd1.py', '"""First line\nmore"""\n'),
+                                   ('cmd2.py', 'import os\n'),
+                                   ('_private.py', '"""Not a command"""\n'),
+                                   ('notpython.txt', 'foo')):
+                with open(os.path.join(tmpdir, name), 'w') as fh:
+                    fh.write(contents)
+            self.assertEqual(allosmod.util.commands.get_commands(tmpdir),
+                             {'cmd1': 'First line', 'cmd2': ''})
+
+    def test_write_index(self):
+        """Test write_index()"""
+        commands = {'foo': 'Foo command', 'bar': 'x' * 60}
+        sio = StringIO()
+        allosmod.util.commands.write_index(commands, sio)
+        for line in sio.getvalue().split('\n'):
+            self.assertLess(len(line), 80)
+        d = {}
+        exec(sio.getvalue(), d)
+        self.assertEqual(d['commands'], commands)
+
+    def test_index_up_to_date(self):
+        """Check that the command index matches the command modules"""
+        import allosmod._commands
+        self.assertEqual(
+            allosmod._commands.commands,
+            allosmod.util.commands.get_commands(PACKAGE_DIR),
+            "lib/allosmod/_commands.py is out of date; regenerate it "
+            "with 'make commands'")
+
+    def test_no_modeller_import(self):
+        """Check that no command imports Modeller at module level"""
+        import allosmod._commands
+        script = """
+import sys
+for cmd in sys.argv[1:]:
+    __import__('allosmod.' + cmd)
+    if 'modeller' in sys.modules:
+        print(cmd)
+        break
+"""
+        out = subprocess.check_output(
+            [sys.executable, '-c', script]
+            + sorted(allosmod._commands.commands.keys()),
+            universal_newlines=True)
+        self.assertEqual(out, '', "allosmod.%s imports modeller" % out)
+
+
+if __name__ == '__main__':
+    unittest.main()
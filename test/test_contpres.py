@@ -18,6 +18,33 @@ class Tests(unittest.TestCase):
                           'allosmod.contpres'] + args,
                          stderr=subprocess.STDOUT, retcode=2)
 
+    def test_get_restrained_atoms(self):
+        """Test get_restrained_atoms()"""
+        import allosmod.contpres
+        from allosmod.util.restraints import RestraintStore
+
+        class MockModel:
+            atoms = ['a%d' % i for i in range(1, 10)]
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.rsr')
+            with open(fname, 'w') as fh:
+                fh.write("MODELLER5 VERSION: MODELLER FORMAT\n"
+                         "R 3 1 1 9 2 2 1 1 2 1.5 0.1\n"
+                         "R 3 1 1 1 2 2 1 3 4 1.5 0.1\n"
+                         "R 3 1 1 9 3 2 1 3 4 5 1.5 0.1\n"
+                         "R 3 1 1 9 2 0 1 5 6\n"
+                         "R 10 1 1 9 2 2 1 7 8 x y\n")
+            pairs = list(allosmod.contpres.get_restrained_atoms(
+                MockModel(), fname))
+            self.assertEqual(pairs, [('a1', 'a2'), ('a7', 'a8')])
+            # No cache should be written for a file that is only read once
+            self.assertFalse(os.path.exists(fname + '.rsrcache'))
+            # Binary caches can still be read
+            RestraintStore.read_file(fname)
+            pairs = list(allosmod.contpres.get_restrained_atoms(
+                MockModel(), fname + '.rsrcache'))
+            self.assertEqual(pairs, [('a1', 'a2'), ('a7', 'a8')])
+
     def test_simple(self):
         """Simple complete run of contpres"""
         with utils.temporary_directory() as tmpdir:
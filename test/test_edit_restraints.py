@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 import subprocess
 import os
 import sys
@@ -11,9 +12,251 @@ test_dir = utils.set_search_paths(TOPDIR)
 import allosmod.get_contacts  # noqa: E402
 import allosmod.get_ss  # noqa: E402
 import allosmod.edit_restraints  # noqa: E402
+from allosmod.util.restraints import RestraintStore  # noqa: E402
+
+
+# Reference implementation of restraint editing, handling a single restraint
+# at a time. RestraintEditor.classify() and write_classified() should give
+# the same results.
+
+class _StoreColumn:
+    """Read an attribute of a restraint from its RestraintStore.
+       Since this is a non-data descriptor, assigning to the attribute
+       on a restraint overrides the stored value for that restraint only."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return int(getattr(obj._store, self.column)[obj._index])
+
+
+class Restraint:
+    """A single restraint. This is a view of one entry in a
+       :class:`RestraintStore`; modifications to the restraint do not
+       change the store itself."""
+    form = _StoreColumn('form')
+    modal = _StoreColumn('modal')
+    feat = _StoreColumn('feat')
+    group = _StoreColumn('group')
+    nparam = _StoreColumn('nparam')
+    nfeat = _StoreColumn('nfeat')
+
+    def __init__(self, line, atoms):
+        self._bind(RestraintStore.from_lines([line]), 0, atoms)
+
+    @classmethod
+    def from_store(cls, store, index, atoms):
+        """Make a view of the index'th restraint in the given store"""
+        r = cls.__new__(cls)
+        r._bind(store, index, atoms)
+        return r
+
+    def _bind(self, store, index, atoms):
+        self._store, self._index = store, index
+        self.atoms = [atoms[i - 1] for i in store.get_atoms(index).tolist()]
+        self.handle_parameters(store.get_parameters(index))
+
+    def handle_parameters(self, params):
+        raise ValueError("Could not handle %d" % self.form)
+
+    def write(self, fh=sys.stdout):
+        fh.write('R %4d %3d %3d %3d %3d %3d %3d '
+                 % (self.form, self.modal, self.feat, self.group,
+                    len(self.atoms), self.nparam, 1))
+        fh.write(' '.join('%5d' % x.a.index for x in self.atoms))
+        fh.write('    ')
+        self.write_parameters(fh)
+        fh.write('\n')
+
+    def is_intrahet(self):
+        """Return True iff all atoms in this restraint are HETATM"""
+        for a in self.atoms:
+            if not a.a.residue.hetatm:
+                return False
+        return True
+
+    def is_ca_cb_interaction(self):
+        for a in self.atoms:
+            if not a.isNUC and not a.isCA and not a.isCB:
+                return False
+        return True
+
+    def is_sidechain_sidechain_interaction(self):
+        for a in self.atoms:
+            if not a.isSC and not a.isCB:
+                return False
+        return True
+
+    def is_beta_beta_interaction(self, beta_structure):
+        for a in self.atoms:
+            if a.a.residue.index not in beta_structure:
+                return False
+        return True
+
+    def is_intra_protein_interaction(self):
+        for a in self.atoms:
+            if a.isNUC:
+                return False
+        return True
+
+    def is_intra_dna_interaction(self):
+        for a in self.atoms:
+            if not a.isNUC or not a.torestr:
+                return False
+        return True
+
+    def is_protein_dna_interaction(self):
+        dna = [a for a in self.atoms if a.isNUC]
+        if len(dna) == 0 or len(dna) == len(self.atoms):
+            return False
+        for a in dna:
+            if a.torestr:
+                return True
+        return False
+
+    def is_allosteric_interaction(self):
+        for a in self.atoms:
+            if not a.isAS:
+                return False
+        return True
+
 
+class GaussianRestraint(Restraint):
+    def handle_parameters(self, params):
+        self.mean = self.firstmean = float(params[0])
+        self.stdev = float(params[1])
+
+    def write_parameters(self, fh):
+        fh.write(' '.join('%9.4f' % x for x in (self.mean, self.stdev)))
+
+    def any_mean_below(self, threshold):
+        return self.mean < threshold
+
+    def rescale(self, scale):
+        self.stdev /= scale
+
+    def transform(self, tgparams, modal, stdev, truncated=True,
+                  local=False, nuc=False, fh=sys.stdout):
+        """Convert this restraint into a multigaussian, and write out"""
+        if truncated:
+            delE = tgparams.get_dele(self.atoms, local, nuc)
+            parameters = [delE, tgparams.slope, tgparams.scl_delx]
+        else:
+            parameters = []
+        parameters.extend([1.0/modal]*modal + [self.mean] * modal
+                          + [stdev]*modal)
+        fh.write('R %4d%4d%4d%4d%4d%4d%4d'
+                 % (50 if truncated else 4, modal, self.feat, self.group,
+                    len(self.atoms), len(parameters), 1))
+        fh.write(''.join('%6d' % x.a.index for x in self.atoms))
+        fh.write('    ')
+        fh.write(' '.join('%9.4f' % x for x in parameters))
+        fh.write('\n')
+
+
+class MultiGaussianRestraint(Restraint):
+    def handle_parameters(self, params):
+        self.weights = [float(x) for x in params[:self.modal]]
+        self.means = [float(x) for x in params[self.modal:self.modal*2]]
+        self.firstmean = self.means[0]
+        self.stdevs = [float(x) for x in params[self.modal*2:self.modal*3]]
 
-class TruncatedGaussianRestraint(allosmod.edit_restraints.Restraint):
+    def write_parameters(self, fh):
+        fh.write(' '.join('%9.4f' % x
+                          for x in self.weights + self.means + self.stdevs))
+
+    def any_mean_below(self, threshold):
+        for m in self.means:
+            if m < threshold:
+                return True
+        return False
+
+    def rescale(self, scale):
+        self.stdevs = [x / scale for x in self.stdevs]
+
+    def transform(self, tgparams, modal, stdev, truncated=True,
+                  local=False, nuc=False, fh=sys.stdout):
+        """Convert this restraint into a multigaussian, and write out"""
+        # Note that modal is ignored
+        modal = self.modal
+        if truncated:
+            delE = tgparams.get_dele(self.atoms, local, nuc)
+            parameters = [delE, tgparams.slope, tgparams.scl_delx]
+        else:
+            parameters = []
+        parameters.extend([1.0/modal]*modal + self.means + [stdev]*modal)
+        fh.write('R %4d%4d%4d%4d%4d%4d%4d'
+                 % (50 if truncated else 4, modal, self.feat, self.group,
+                    len(self.atoms), len(parameters), 1))
+        fh.write(''.join('%6d' % x.a.index for x in self.atoms))
+        fh.write('    ')
+        fh.write(' '.join('%9.4f' % x for x in parameters))
+        fh.write('\n')
+
+
+class CosineRestraint(Restraint):
+    def handle_parameters(self, params):
+        self.phase, self.force = [float(x) for x in params]
+
+    def write_parameters(self, fh):
+        fh.write(' '.join('%9.4f' % x for x in (self.phase, self.force)))
+
+    def rescale(self, scale):
+        self.force *= scale
+
+
+class BinormalRestraint(Restraint):
+    def handle_parameters(self, params):
+        # Keep as is
+        self._params = params
+
+    def write_parameters(self, fh):
+        fh.write(' '.join('%9s' % x for x in self._params))
+
+
+class SplineRestraint(Restraint):
+    def handle_parameters(self, params):
+        # Keep as is
+        self._params = params
+
+    def write_parameters(self, fh):
+        fh.write(' '.join('%9s' % x for x in self._params))
+
+
+def filter_rs_rs(atoms):
+    """Allow only RS-RS contacts"""
+    for atom in atoms:
+        if atom.isAS:
+            return False
+    return True
+
+
+def filter_not_rs_rs(atoms):
+    """Allow AS-AS and AS-RS contacts"""
+    natomRS = sum(0 if atom.isAS else 1 for atom in atoms)
+    return natomRS != len(atoms)
+
+
+restraint_from_form = {3: GaussianRestraint,
+                       4: MultiGaussianRestraint,
+                       7: CosineRestraint,
+                       9: BinormalRestraint,
+                       10: SplineRestraint}
+
+
+def parse_restraints_file(fh, atoms, filter=None):
+    store = RestraintStore.read(fh)
+    for i, form in enumerate(store.form.tolist()):
+        r = restraint_from_form.get(form, Restraint).from_store(store, i,
+                                                                atoms)
+        if filter is None or filter(r.atoms):
+            yield r
+
+
+class TruncatedGaussianRestraint(Restraint):
     def handle_parameters(self, params):
         self.delE, self.slope, self.scl_delx = [float(x) for x in params[:3]]
         del params[:3]
@@ -32,13 +275,110 @@ class MockRestraintEditor(allosmod.edit_restraints.RestraintEditor):
         self.beta_structure = {}
         self.HETscale *= 4.0  # fail if HETscale not in parent
 
+    def setup_delEmax(self, restraints):
+        """Scale delEmax, for coarse landscapes, given Restraint objects
+           for all restraints in the AS file"""
+        if not self.coarse:
+            return
+        ndist = ndistCACB = 0
+        for r in restraints:
+            if (isinstance(r, GaussianRestraint)
+                and len(r.atoms) == 2 and r.group != 1) \
+               or (isinstance(r, MultiGaussianRestraint)
+                   and len(r.atoms) == 2):
+                if self.contacts[(r.atoms[0], r.atoms[1])]:
+                    if (not r.atoms[0].isSC and not r.atoms[0].isCB) \
+                       or (not r.atoms[1].isSC and not r.atoms[1].isCB) \
+                       or r.firstmean < self.distco_scsc:
+                        ndist += 1
+                    if (r.atoms[0].isCA or r.atoms[0].isCB) \
+                       and (r.atoms[1].isCA or r.atoms[1].isCB):
+                        ndistCACB += 1
+        self._scale_delEmax(ndist, ndistCACB)
+
+    def parse_restraint(self, tgparams, r, fh):
+        # gaussian; bond, angle or torsion
+        # multigaussian; angle or torsion
+        # cosine; some dihedrals
+        # keep as is for prot, scale for HET
+        if ((isinstance(r, GaussianRestraint) and
+             ((len(r.atoms) == 2 and r.group == 1)
+              or len(r.atoms) == 3 or len(r.atoms) == 4))
+                or (isinstance(r, MultiGaussianRestraint)
+                    and len(r.atoms) >= 3)
+                or isinstance(r, CosineRestraint)):
+            if r.is_intrahet():
+                r.rescale(self.HETscale)
+            r.write(fh)
+        # add intra heme contacts to maintain geometry; keep all as is
+        elif (r.is_intrahet() and len(r.atoms) == 2 and
+              ((isinstance(r, GaussianRestraint) and r.group != 1)
+                or isinstance(r, MultiGaussianRestraint))):
+            r.rescale(self.HETscale)
+            r.write(fh)
+        # Keep as is
+        elif isinstance(r, SplineRestraint):
+            r.write(fh)
+        # Gaussian or MultiGaussian distance restraint
+        elif (len(r.atoms) == 2
+              and ((isinstance(r, GaussianRestraint) and r.group != 1)
+                   or (isinstance(r, MultiGaussianRestraint)))):
+            if self.coarse and not r.is_ca_cb_interaction():
+                return
+            # omit side chain interactions > 5 Ang
+            if (r.is_sidechain_sidechain_interaction()
+                    and not r.any_mean_below(self.distco_scsc)):
+                return
+            seqdst = abs(r.atoms[0].a.residue.index
+                         - r.atoms[1].a.residue.index)
+            if self.locrigid and 2 <= seqdst <= 5 and r.is_ca_cb_interaction():
+                r.transform(tgparams, local=True, modal=2, stdev=2.0, fh=fh)
+            elif (self.locrigid and 6 <= seqdst <= 12
+                  and r.is_ca_cb_interaction() and r.any_mean_below(6.0)):
+                r.transform(tgparams, local=True, modal=2, stdev=2.0, fh=fh)
+            elif (2 <= seqdst and r.any_mean_below(6.0)
+                  and r.is_ca_cb_interaction()
+                  and r.is_beta_beta_interaction(self.beta_structure)):
+                r.transform(tgparams, local=True, modal=2, stdev=2.0, fh=fh)
+            elif self.contacts[(r.atoms[0], r.atoms[1])]:
+                if isinstance(r, MultiGaussianRestraint):
+                    sig = self.sigmas.get_scaled(r.atoms) / r.modal / r.modal
+                    r.transform(tgparams, modal=r.modal,
+                                stdev=sig, truncated=tgparams.delEmax != 0.,
+                                fh=fh)
+                elif r.is_intra_protein_interaction():
+                    sig = self.sigmas.get_scaled(r.atoms)
+                    if r.is_allosteric_interaction():
+                        if not self.empty_AS:
+                            if self.tgauss_AS:
+                                r.transform(tgparams, modal=2,
+                                            stdev=sig, fh=fh)
+                            else:
+                                r.stdev = sig
+                                r.write(fh)
+                    else:  # RS or interface
+                        if tgparams.delEmax == 0.:
+                            r.transform(tgparams, modal=1,
+                                        stdev=sig, truncated=False, fh=fh)
+                        else:
+                            r.transform(tgparams, modal=2,
+                                        stdev=sig, fh=fh)
+                elif (r.is_protein_dna_interaction()
+                      and r.any_mean_below(self.rcutNUC)):
+                    sig = self.sigmas.get(r.atoms)
+                    r.transform(tgparams, nuc=True, modal=2, stdev=sig, fh=fh)
+                elif (r.is_intra_dna_interaction()
+                      and r.any_mean_below(self.rcutNUC)):
+                    r.stdev = 1.0
+                    r.write(fh)
+
     def check_parse_restraint(self, r, delEmax=10.0):
         from allosmod.edit_restraints import TruncatedGaussianParameters
-        r_from_form = {3: allosmod.edit_restraints.GaussianRestraint,
-                       4: allosmod.edit_restraints.MultiGaussianRestraint,
-                       7: allosmod.edit_restraints.CosineRestraint,
-                       9: allosmod.edit_restraints.BinormalRestraint,
-                       10: allosmod.edit_restraints.SplineRestraint,
+        r_from_form = {3: GaussianRestraint,
+                       4: MultiGaussianRestraint,
+                       7: CosineRestraint,
+                       9: BinormalRestraint,
+                       10: SplineRestraint,
                        50: TruncatedGaussianRestraint}
 
         tgparams = TruncatedGaussianParameters(delEmax, delEmaxNUC=20.0,
@@ -97,6 +437,8 @@ class Tests(unittest.TestCase):
         with utils.mock_method(allosmod.get_contacts, 'get_contacts',
                                mock_get_cont):
             with utils.mock_method(allosmod.get_ss, 'get_ss', mock_get_ss):
+                # Don't cache the mock contacts
+                e.cache = False
                 e.setup_atoms(env)
         contacts = sorted(e.contacts.keys())
         # Should have the 1-4 interaction from get_contacts, plus the two
@@ -200,7 +542,6 @@ class Tests(unittest.TestCase):
 
     def test_restraint(self):
         """Test Restraint base class"""
-        from allosmod.edit_restraints import Restraint
 
         class Atom:
             def __init__(self, ind):
@@ -210,6 +551,30 @@ class Tests(unittest.TestCase):
                           "R 3 1 9 12 2 2 1 3 2 10.00 20.00",
                           [Atom(i) for i in range(1, 10)])
 
+    def test_restraint_from_store(self):
+        """Test Restraint views of a RestraintStore"""
+        from allosmod.util.restraints import RestraintStore
+
+        class Atom:
+            def __init__(self, ind):
+                self.index = ind
+                self.a = self
+        store = RestraintStore.from_lines(
+            ["R 3 1 9 12 2 2 1 3 2 10.00 20.00",
+             "R 3 1 9 1 2 2 1 4 5 30.00 40.00"])
+        r = GaussianRestraint.from_store(store, 1,
+                                         [Atom(i) for i in range(1, 10)])
+        self.assertEqual([a.a.index for a in r.atoms], [4, 5])
+        self.assertEqual(r.group, 1)
+        self.assertAlmostEqual(r.mean, 30.0, places=1)
+        # Modifying the view should not change the store
+        r.group = 4
+        r.rescale(2.0)
+        self.assertEqual(r.group, 4)
+        self.assertAlmostEqual(r.stdev, 20.0, places=1)
+        self.assertEqual(list(store.group), [12, 1])
+        self.assertEqual(store.get_parameters(1), [30.0, 40.0])
+
     def make_restraint(self, modify_atom_func, args, natom, cls, fmt):
         from allosmod.edit_restraints import Atom
 
@@ -228,27 +593,23 @@ class Tests(unittest.TestCase):
         return r
 
     def make_gaussian_restraint(self, modify_atom_func, args=None, natom=2):
-        from allosmod.edit_restraints import GaussianRestraint
         return self.make_restraint(modify_atom_func, args, natom,
                                    GaussianRestraint,
                                    "R 3 1 9 12 %d 2 1 %s 10.00 20.00")
 
     def make_multi_gaussian_restraint(self, modify_atom_func, args=None,
                                       natom=2):
-        from allosmod.edit_restraints import MultiGaussianRestraint
         return self.make_restraint(modify_atom_func, args, natom,
                                    MultiGaussianRestraint,
                                    "R 4 2 9 12 %d 6 1 %s 0.8 0.2 10.00 "
                                    "20.00 5.0 8.0")
 
     def make_cosine_restraint(self, modify_atom_func, args=None, natom=2):
-        from allosmod.edit_restraints import CosineRestraint
         return self.make_restraint(modify_atom_func, args, natom,
                                    CosineRestraint,
                                    "R 7 2 9 12 %d 2 1 %s 20.0 30.0")
 
     def make_spline_restraint(self, modify_atom_func=None, args=None, natom=2):
-        from allosmod.edit_restraints import SplineRestraint
         return self.make_restraint(modify_atom_func, args, natom,
                                    SplineRestraint,
                                    "R 10 22 3 13 %d 3 1 %s x y z")
@@ -387,7 +748,6 @@ class Tests(unittest.TestCase):
 
     def test_gaussian_restraint(self):
         """Test GaussianRestraint class"""
-        from allosmod.edit_restraints import GaussianRestraint
         from allosmod.edit_restraints import TruncatedGaussianParameters
 
         class Atom:
@@ -433,7 +793,6 @@ class Tests(unittest.TestCase):
 
     def test_multi_gaussian_restraint(self):
         """Test MultiGaussianRestraint class"""
-        from allosmod.edit_restraints import MultiGaussianRestraint
         from allosmod.edit_restraints import TruncatedGaussianParameters
 
         class Atom:
@@ -487,7 +846,6 @@ class Tests(unittest.TestCase):
 
     def test_cosine_restraint(self):
         """Test CosineRestraint class"""
-        from allosmod.edit_restraints import CosineRestraint
 
         class Atom:
             def __init__(self, ind):
@@ -512,7 +870,6 @@ class Tests(unittest.TestCase):
 
     def test_binormal_restraint(self):
         """Test BinormalRestraint class"""
-        from allosmod.edit_restraints import BinormalRestraint
 
         class Atom:
             def __init__(self, ind):
@@ -529,7 +886,6 @@ class Tests(unittest.TestCase):
 
     def test_spline_restraint(self):
         """Test SplineRestraint class"""
-        from allosmod.edit_restraints import SplineRestraint
 
         class Atom:
             def __init__(self, ind):
@@ -546,7 +902,6 @@ class Tests(unittest.TestCase):
 
     def test_restraint_filters(self):
         """Test restraint filters"""
-        from allosmod.edit_restraints import filter_rs_rs, filter_not_rs_rs
 
         class Atom:
             def __init__(self, isAS):
@@ -586,8 +941,6 @@ class Tests(unittest.TestCase):
 
     def test_parse_restraints_file(self):
         """Test parse_restraints_file()"""
-        from allosmod.edit_restraints import parse_restraints_file
-        from allosmod.edit_restraints import filter_rs_rs
 
         class Atom:
             def __init__(self, ind, isAS):
@@ -618,6 +971,62 @@ class Tests(unittest.TestCase):
         self.assertEqual(a.torestr, False)
         self.assertEqual(a.a, 'foo')
 
+    def test_get_contacts(self):
+        """Test get_contacts()"""
+        from allosmod.edit_restraints import get_contacts
+        calls = []
+
+        class Residue:
+            def __init__(self, index):
+                self.index = index
+
+        def mock_get_cont(fname, rcut):
+            calls.append(fname)
+            with open(fname) as fh:
+                for line in fh:
+                    i, j = line.split()
+                    yield Residue(int(i)), Residue(int(j)), rcut
+
+        cwd = os.getcwd()
+        with utils.temporary_directory() as tmpdir:
+            os.chdir(tmpdir)
+            self.addCleanup(os.chdir, cwd)
+            for fname, pairs in (('pm_t1', [(1, 4), (2, 8)]),
+                                 ('pm_t2', [(2, 8), (8, 12), (3, 9)])):
+                with open(fname, 'w') as fh:
+                    for p in pairs:
+                        fh.write('%d %d\n' % p)
+            cachedir = os.path.join(tmpdir, 'cache')
+            templates = ['t1', 't2']
+            with utils.mock_method(allosmod.get_contacts, 'get_contacts',
+                                   mock_get_cont), \
+                    mock.patch.dict(os.environ,
+                                    {'ALLOSMOD_CACHE_DIR': cachedir}):
+                # Contacts are computed unless cached (by an earlier call);
+                # worker processes don't update our list of calls
+                for jobs, cache, ncall in ((1, False, 2), (2, False, 0),
+                                           (2, True, 0), (1, True, 0),
+                                           (2, True, 0)):
+                    del calls[:]
+                    c = get_contacts(templates, 10.0, jobs=jobs, cache=cache)
+                    self.assertEqual(sorted(c.keys()),
+                                     [(1, 4), (2, 8), (3, 9), (8, 12)])
+                    self.assertEqual(len(calls), ncall)
+                    self.assertEqual(os.path.exists(cachedir), cache)
+                # Different cutoff is cached separately
+                del calls[:]
+                get_contacts(templates, 11.0)
+                self.assertEqual(len(calls), 2)
+                # Cached results from a different version are not used
+                del calls[:]
+                with mock.patch.object(allosmod.edit_restraints,
+                                       '_CONTACTS_CACHE_VERSION', 2):
+                    get_contacts(templates, 10.0)
+                self.assertEqual(len(calls), 2)
+                del calls[:]
+                get_contacts(templates, 10.0)
+                self.assertEqual(len(calls), 0)
+
     def test_contact_map(self):
         """Test ContactMap class"""
         from allosmod.edit_restraints import ContactMap, Atom
@@ -641,6 +1050,552 @@ class Tests(unittest.TestCase):
         self.assertTrue(c[(Atom(ModellerAtom(5)), 2)])
         self.assertTrue(c[(5, Atom(ModellerAtom(2)))])
         self.assertEqual(len(c.keys()), 2)
+        self.assertEqual(list(c.lookup([1, 4, 2, 3], [4, 1, 5, 4])),
+                         [True, True, True, False])
+        c[(3, 4)] = True
+        self.assertEqual(list(c.lookup([1, 4, 2, 3], [4, 1, 5, 4])),
+                         [True, True, True, True])
+        self.assertEqual(len(ContactMap().lookup([1], [2])), 1)
+        c.add_pairs([8, 6], [7, 9])
+        self.assertTrue(c[(7, 8)])
+        self.assertEqual(list(c.lookup([7, 6, 9], [8, 9, 6])),
+                         [True, True, True])
+        self.assertEqual(len(c.keys()), 5)
+
+    def test_contact_map_add_all(self):
+        """Test ContactMap with residues that contact everything"""
+        from allosmod.edit_restraints import ContactMap
+        c = ContactMap()
+        c[(1, 2)] = True
+        c.add_all(4, 5)
+        c.add_all(3, 2)
+        self.assertEqual(sorted(c.keys()),
+                         [(1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4),
+                          (4, 4), (4, 5)])
+        for i in range(0, 8):
+            for j in range(0, 8):
+                self.assertEqual(c[(i, j)], (min(i, j), max(i, j)) in c.keys())
+        ri, rj = zip(*[(i, j) for i in range(-1, 8) for j in range(-1, 8)])
+        self.assertEqual(list(c.lookup(ri, rj)),
+                         [c[(i, j)] for i, j in zip(ri, rj)])
+        c = ContactMap()
+        c.add_all(2, 3)
+        self.assertEqual(list(c.lookup([2, 1, 9, 2], [1, 2, 2, 4])),
+                         [True, True, False, False])
+
+    def make_classify_atoms(self):
+        """Make a set of atoms covering all properties used by classify()"""
+        from allosmod.edit_restraints import Atom
+
+        class ModellerResidue:
+            def __init__(self, index, hetatm):
+                self.index, self.hetatm = index, hetatm
+
+        class ModellerAtom:
+            def __init__(self, index, residue):
+                self.index, self.residue = index, residue
+        atoms = []
+        props = [('isCA',), ('isCB', 'isAS'), ('isSC',), ('isSC', 'isAS'),
+                 ('isCA', 'isAS'), ('isNUC', 'torestr'), ('isNUC',),
+                 ('isNUC', 'torestr', 'isAS'), ('hetatm',), ('isCB',)]
+        for i, resind in enumerate((1, 3, 4, 7, 9, 10, 16, 18, 20, 22)):
+            p = props[i]
+            a = Atom(ModellerAtom(i + 1,
+                                  ModellerResidue(resind, 'hetatm' in p)))
+            for flag in p:
+                setattr(a, flag, True)
+            atoms.append(a)
+        # Second HETATM in the same residue
+        atoms.append(Atom(ModellerAtom(11, atoms[8].a.residue)))
+        return atoms
+
+    def make_classify_restraints(self, natom):
+        """Make restraints of all types between atoms"""
+        import itertools
+        lines = []
+        for i, j in itertools.permutations(range(1, natom + 1), 2):
+            for mean in (4.5, 5.5, 7.5, 9.0):
+                for group in (1, 9):
+                    lines.append("R 3 1 1 %d 2 2 1 %d %d %.2f 0.5"
+                                 % (group, i, j, mean))
+                lines.append("R 4 2 1 9 2 6 1 %d %d 0.6 0.4 %.2f 9.0 0.3 0.6"
+                             % (i, j, mean))
+        lines.extend(["R 3 1 1 2 3 2 1 1 2 3 120.0 10.0",
+                      "R 4 3 1 2 4 9 1 1 2 3 9 0.2 0.3 0.5 10.0 50.0 -80.0 "
+                      "1.0 2.0 3.0",
+                      "R 7 3 1 4 4 2 1 9 11 9 11 30.0 2.0",
+                      "R 7 3 1 4 4 2 1 1 2 3 4 30.0 2.0",
+                      "R 9 2 1 13 4 3 2 1 2 3 4 5 0.1 0.2 0.3",
+                      "R 10 22 1 9 2 5 1 2 3 -5.0 1.0 2.0 3 4",
+                      "R 3 1 1 9 2 2 1 9 11 3.0 0.5",
+                      "R 4 2 1 9 2 6 1 9 11 0.6 0.4 4.0 9.0 0.3 0.6"])
+        return "\n".join(lines) + "\n"
+
+    def test_classify(self):
+        """Test vectorized classify() and write_classified()"""
+        import itertools
+        from allosmod.edit_restraints import TruncatedGaussianParameters
+        from allosmod.edit_restraints import mask_rs_rs, mask_not_rs_rs
+        from allosmod.util.restraints import RestraintStore
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+        store = RestraintStore.read(StringIO(rsr))
+        for (coarse, locrigid, (empty_AS, tgauss_AS), delEmax,
+             (ntotal, breaks)) in itertools.product(
+                (False, True), (False, True),
+                ((False, True), (False, False), (True, True)), (0., 0.3),
+                ((1, {}), (2, {3: 0.5, 7: 2.0}))):
+            e = MockRestraintEditor()
+            e.sigmas.ntotal = ntotal
+            e.atoms = atoms
+            e.coarse, e.locrigid = coarse, locrigid
+            e.empty_AS, e.tgauss_AS = empty_AS, tgauss_AS
+            e.beta_structure = {1: True, 3: True, 4: True, 7: True}
+            for i, j in ((1, 3), (3, 7), (1, 9), (4, 10), (10, 16), (3, 16),
+                         (16, 18), (7, 9), (9, 18), (10, 18)):
+                e.contacts[(i, j)] = True
+            tgparams = TruncatedGaussianParameters(
+                delEmax, delEmaxNUC=0.12, slope=4.0, scl_delx=0.7,
+                breaks=breaks)
+            for (filt, mask) in ((None, None), (filter_rs_rs, mask_rs_rs),
+                                 (filter_not_rs_rs, mask_not_rs_rs)):
+                expected = StringIO()
+                for r in parse_restraints_file(StringIO(rsr), atoms, filt):
+                    e.parse_restraint(tgparams, r, expected)
+                fh = StringIO()
+                e.write_classified(tgparams, store, e.classify(store, mask),
+                                   fh)
+                self.assertEqual(fh.getvalue(), expected.getvalue())
+
+    def test_write_splines(self):
+        """Test write_classified() of splines"""
+        from allosmod.edit_restraints import KEEP
+        from allosmod.edit_restraints import TruncatedGaussianParameters
+        from allosmod.util.restraints import RestraintStore
+        import numpy as np
+        atoms = self.make_classify_atoms()
+        lines = ["R 10 22 1 9 2 5 1 2 3 -5.0 1.0   2.0\t3 4",
+                 "R 10 2 1 9 3 2 1 1 2 3 123456789012 -0.000000000001",
+                 "R 10 2 1 9 2 0 1 3 4",
+                 "R 10 2 1 9 2 1 1 9 11 x"]
+        store = RestraintStore.from_lines(lines)
+        e = MockRestraintEditor()
+        e.atoms = atoms
+        tgparams = TruncatedGaussianParameters(
+            0.1, delEmaxNUC=0.12, slope=4.0, scl_delx=0.7, breaks={})
+        fh = StringIO()
+        e.write_classified(tgparams, store, np.full(len(lines), KEEP), fh)
+        expected = StringIO()
+        for line in lines:
+            SplineRestraint(line, atoms).write(expected)
+        self.assertEqual(fh.getvalue(), expected.getvalue())
+
+    def test_count_delEmax_contacts(self):
+        """Test count_delEmax_contacts() matches the reference"""
+        from allosmod.util.restraints import RestraintStore
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+        e = MockRestraintEditor()
+        e.coarse = True
+        e.atoms = atoms
+        for i, j in ((1, 3), (3, 7), (1, 9), (4, 10), (10, 18)):
+            e.contacts[(i, j)] = True
+        store = RestraintStore.read(StringIO(rsr))
+        ndist, ndistCACB = e.count_delEmax_contacts(store)
+        self.assertGreater(ndist, ndistCACB)
+        self.assertGreater(ndistCACB, 0)
+        delEmax = 0.2 * (6.5 / 7.8) * ndist / ndistCACB
+        e.setup_delEmax(parse_restraints_file(StringIO(rsr), atoms))
+        self.assertAlmostEqual(e.delEmax, delEmax, places=6)
+
+    def test_classify_restraints(self):
+        """Test single-pass classify_restraints() and write_restraints()"""
+        from allosmod.edit_restraints import TruncatedGaussianParameters
+        from allosmod.util.restraints import RestraintBuffer
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+        tgparams = TruncatedGaussianParameters(0.1, delEmaxNUC=0.12,
+                                               slope=4.0, scl_delx=0.7,
+                                               breaks={})
+        with utils.temporary_directory() as tmpdir:
+            e = MockRestraintEditor()
+            e.listoth_rsr = os.path.join(tmpdir, 'oth.rsr')
+            e.listas_rsr = os.path.join(tmpdir, 'as.rsr')
+            e.atoms = atoms
+            e.coarse = True
+            e.contacts[(1, 3)] = True
+            for fname in e.listoth_rsr, e.listas_rsr:
+                with open(fname, 'w') as fh:
+                    fh.write(rsr)
+            outputs = []
+            for max_size in (1 << 30, 0):
+                e.delEmax = 0.2
+                with RestraintBuffer(max_size=max_size) as buf:
+                    e.classify_restraints(buf)
+                    self.assertEqual(buf.spilled, max_size == 0)
+                    fh = StringIO()
+                    e.write_restraints(tgparams, buf, fh)
+                    outputs.append(fh.getvalue())
+                # Only contact is CA-CB, so ndist == ndistCACB
+                self.assertAlmostEqual(e.delEmax, 0.2 * (6.5 / 7.8),
+                                       places=6)
+        self.assertEqual(outputs[0], outputs[1])
+        lines = outputs[0].split('\n')
+        self.assertEqual(lines[0], "MODELLER5 VERSION: MODELLER FORMAT")
+        self.assertGreater(len(lines), 100)
+
+    def test_parse_sweep_file(self):
+        """Test parse_sweep_file()"""
+        from allosmod.edit_restraints import parse_sweep_file, SweepPoint
+        points = list(parse_sweep_file(StringIO(
+            "# output delEmax sigAS sigRS siginter\n\n"
+            "out1.rsr 0.1 2.0 3.0 4.0\n  out2.rsr 0 1 1 1  \n")))
+        self.assertEqual(points, [SweepPoint('out1.rsr', 0.1, 2.0, 3.0, 4.0),
+                                  SweepPoint('out2.rsr', 0., 1., 1., 1.)])
+        self.assertRaises(allosmod.util.FileFormatError, list,
+                          parse_sweep_file(StringIO("out1.rsr 0.1 2.0\n")))
+        self.assertRaises(ValueError, list,
+                          parse_sweep_file(StringIO("out 0.1 2.0 x 4.0\n")))
+
+    def test_sweep(self):
+        """Test sweep() matches separate runs of each parameter set"""
+        from allosmod.edit_restraints import TruncatedGaussianParameters
+        from allosmod.edit_restraints import SweepPoint, Sigmas
+        from allosmod.util.restraints import RestraintBuffer
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+
+        def make_editor(tmpdir):
+            e = MockRestraintEditor()
+            e.listoth_rsr = os.path.join(tmpdir, 'oth.rsr')
+            e.listas_rsr = os.path.join(tmpdir, 'as.rsr')
+            e.atoms = atoms
+            e.breaks = {}
+            e.coarse = True
+            e.cache = False
+            e.setup_atoms = lambda env: None
+            for i, j in ((1, 3), (3, 7), (1, 9), (4, 10), (10, 18)):
+                e.contacts[(i, j)] = True
+            return e
+        with utils.temporary_directory() as tmpdir:
+            for fname in 'oth.rsr', 'as.rsr':
+                with open(os.path.join(tmpdir, fname), 'w') as fh:
+                    fh.write(rsr)
+            points = [SweepPoint(os.path.join(tmpdir, 'out%d.rsr' % i),
+                                 delEmax, sig, sig + 1., sig + 2.)
+                      for i, (delEmax, sig) in enumerate(
+                          ((0.2, 2.0), (0., 2.0), (0.2, 1.0)))]
+            expected = []
+            for p in points:
+                e = make_editor(tmpdir)
+                e.delEmax = p.delEmax
+                e.sigmas = Sigmas(e.sigmas.ntotal, p.sig_AS, p.sig_RS,
+                                  p.sig_inter)
+                with RestraintBuffer() as buf:
+                    e.classify_restraints(buf)
+                    tgparams = TruncatedGaussianParameters(
+                        e.delEmax, delEmaxNUC=e.delEmaxNUC, slope=4.0,
+                        scl_delx=0.7, breaks={})
+                    fh = StringIO()
+                    e.write_restraints(tgparams, buf, fh)
+                    expected.append(fh.getvalue())
+            self.assertNotEqual(expected[0], expected[1])
+            self.assertNotEqual(expected[0], expected[2])
+            for jobs in (1, 3):
+                e = make_editor(tmpdir)
+                e.jobs = jobs
+                e.shard_size = 4000
+                e.sweep(None, points)
+                for p, exp in zip(points, expected):
+                    with open(p.output) as fh:
+                        self.assertEqual(fh.read(), exp)
+
+    def test_update(self):
+        """Test update() matches a full edit with a new AS/RS atom list"""
+        import numpy as np
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+
+        def make_editor(tmpdir, atoms):
+            e = MockRestraintEditor()
+            e.listoth_rsr = os.path.join(tmpdir, 'oth.rsr')
+            e.listas_rsr = os.path.join(tmpdir, 'as.rsr')
+            e.atoms = atoms
+            e.breaks = {}
+            e.coarse = True
+            e.cache = False
+            e.max_update_fraction = 1.0
+            e.setup_atoms = lambda env: None
+            e.get_index_key = lambda: 'testkey'
+            for i, j in ((1, 3), (3, 7), (1, 9), (4, 10), (10, 18)):
+                e.contacts[(i, j)] = True
+            return e
+
+        def run(e, *args, **kwargs):
+            fh = StringIO()
+            if args:
+                e.update(None, *args, fh=fh, **kwargs)
+            else:
+                e.edit(None, fh=fh, **kwargs)
+            return fh.getvalue()
+        with utils.temporary_directory() as tmpdir:
+            for fname in 'oth.rsr', 'as.rsr':
+                with open(os.path.join(tmpdir, fname), 'w') as fh:
+                    fh.write(rsr)
+            old_rsr = os.path.join(tmpdir, 'old.rsr')
+            old_idx = os.path.join(tmpdir, 'old.idx')
+            new_idx = os.path.join(tmpdir, 'new.idx')
+            with open(old_rsr, 'w') as fh:
+                fh.write(run(make_editor(tmpdir, atoms), index=old_idx))
+            # Move one atom from AS to RS, and another from RS to AS
+            new_atoms = self.make_classify_atoms()
+            new_atoms[1].isAS = False
+            new_atoms[2].isAS = True
+            e = make_editor(tmpdir, new_atoms)
+            expected = run(e, index=new_idx)
+            with open(old_rsr) as fh:
+                self.assertNotEqual(fh.read(), expected)
+            with np.load(new_idx) as data:
+                expected_kept = data['kept']
+            e = make_editor(tmpdir, new_atoms)
+            with mock.patch.object(e, '_edit') as m:
+                self.assertEqual(run(e, old_rsr, old_idx), expected)
+                self.assertEqual(m.call_count, 0)
+            e = make_editor(tmpdir, new_atoms)
+            self.assertEqual(run(e, old_rsr, old_idx, index=new_idx),
+                             expected)
+            with np.load(new_idx) as data:
+                self.assertEqual(list(data['kept']), list(expected_kept))
+            # Chained update back to the original atom list
+            with open(os.path.join(tmpdir, 'new.rsr'), 'w') as fh:
+                fh.write(expected)
+            self.assertEqual(
+                run(make_editor(tmpdir, atoms),
+                    os.path.join(tmpdir, 'new.rsr'), new_idx),
+                run(make_editor(tmpdir, atoms)))
+            # Full edit if the index does not match or is missing
+            e = make_editor(tmpdir, new_atoms)
+            e.get_index_key = lambda: 'otherkey'
+            self.assertEqual(run(e, old_rsr, old_idx), expected)
+            e = make_editor(tmpdir, new_atoms)
+            self.assertEqual(
+                run(e, old_rsr, os.path.join(tmpdir, 'missing.idx')),
+                expected)
+            # Full edit if too many restraints are affected
+            e = make_editor(tmpdir, new_atoms)
+            e.max_update_fraction = 0.
+            with mock.patch.object(e, '_edit') as m:
+                run(e, old_rsr, old_idx)
+                self.assertEqual(m.call_count, 1)
+            e = make_editor(tmpdir, new_atoms)
+            e.max_update_fraction = 0.
+            self.assertEqual(run(e, old_rsr, old_idx), expected)
+
+    def test_get_calc_residue_counts(self):
+        """Test get_calc_residue_counts()"""
+        from allosmod.edit_restraints import get_calc_residue_counts
+        atom = ("%-6s%5d  CA  %3s %s%4d      "
+                "  18.511  -1.416  15.632  1.00  6.51           C\n")
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            with open(fname, 'w') as fh:
+                fh.write("REMARK test\n")
+                for i, (rec, resname, chain, resnum) in enumerate(
+                        [('ATOM', 'ALA', 'A', 1), ('ATOM', 'GLY', 'A', 2),
+                         ('ATOM', 'GLY', 'A', 2), ('ATOM', 'CYS', 'A', 4),
+                         ('HETATM', 'HEM', 'A', 5), ('HETATM', 'HEM', 'A', 5),
+                         ('HETATM', 'HEM', 'B', 5), ('HETATM', 'HOH', 'B', 5),
+                         ('ATOM', ' DA', 'C', 9), ('HETATM', '  U', 'C', 10)]):
+                    fh.write(atom % (rec, i + 1, resname, chain, resnum))
+                fh.write("TER\nEND\n")
+            self.assertEqual(get_calc_residue_counts(fname), (4, 3))
+            with open(fname, 'w') as fh:
+                pass
+            self.assertEqual(get_calc_residue_counts(fname), (0, 0))
+
+    def test_delEmax_calculation(self):
+        """Test DelEmaxCalculation"""
+        from allosmod.edit_restraints import DelEmaxCalculation
+        c = DelEmaxCalculation(783, 60, 1)
+        self.assertAlmostEqual(c.delEmax, 0.280, delta=1e-8)
+        self.assertAlmostEqual(c.tf, 329.76, delta=0.01)
+        fh = StringIO()
+        c.write(fh)
+        self.assertEqual(fh.getvalue(),
+                         "delEmax set to: 0.280\n"
+                         "Number of distance contacts: 783\n"
+                         "Estimated Tf: 330\n")
+        # No contacts
+        c = DelEmaxCalculation(0, 60, 1)
+        self.assertAlmostEqual(c.delEmax, 0.1, delta=1e-8)
+        self.assertAlmostEqual(c.tf, 0., delta=1e-8)
+        fh = StringIO()
+        c.write(fh)
+        self.assertEqual(fh.getvalue(),
+                         "delEmax set to: 0.1\n"
+                         "Number of distance contacts: 0\n"
+                         "Estimated Tf: 0\n")
+        # No residues
+        c = DelEmaxCalculation(10, 0, 0)
+        self.assertAlmostEqual(c.delEmax, 999., delta=1e-8)
+        self.assertIsNone(c.tf)
+        fh = StringIO()
+        c.write(fh)
+        self.assertEqual(fh.getvalue(),
+                         "delEmax set to: 999\n"
+                         "Number of distance contacts: NA\n"
+                         "Estimated Tf: NA\n")
+
+    def test_classify_restraints_calc_delEmax(self):
+        """Test classify_restraints() with delEmax=CALC"""
+        from allosmod.edit_restraints import TruncatedGaussianParameters
+        from allosmod.util.restraints import RestraintBuffer
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+        with utils.temporary_directory() as tmpdir:
+            def make_editor(delEmax, coarse, locrigid):
+                e = MockRestraintEditor()
+                e.listoth_rsr = os.path.join(tmpdir, 'oth.rsr')
+                e.listas_rsr = os.path.join(tmpdir, 'as.rsr')
+                e.pdb_file = os.path.join(tmpdir, 'test.pdb')
+                e.delEmax = delEmax
+                e.calc_delEmax = delEmax == 'CALC'
+                e.atoms = atoms
+                e.coarse = coarse
+                e.locrigid = locrigid
+                e.cache = False
+                for i, j in ((1, 3), (3, 7), (1, 9), (4, 10), (10, 18)):
+                    e.contacts[(i, j)] = True
+                return e
+
+            def write_restraints(e, jobs=1):
+                e.jobs = jobs
+                e.shard_size = 4000
+                fh = StringIO()
+                with RestraintBuffer() as buf, e.get_pool() as pool:
+                    e.classify_restraints(buf, pool)
+                    tgparams = TruncatedGaussianParameters(
+                        e.delEmax, delEmaxNUC=e.delEmaxNUC, slope=4.0,
+                        scl_delx=0.7, breaks={})
+                    e.write_restraints(tgparams, buf, fh, pool)
+                return fh.getvalue()
+            for fname in 'oth.rsr', 'as.rsr':
+                with open(os.path.join(tmpdir, fname), 'w') as fh:
+                    fh.write(rsr)
+            with open(os.path.join(tmpdir, 'test.pdb'), 'w') as fh:
+                fh.write("ATOM      1  CA  ALA A  40      18.511  -1.416  "
+                         "15.632  1.00  6.51           C\n")
+            # Count contacts in a non-coarse landscape
+            out = write_restraints(make_editor(0.1, False, False))
+            ncontact = len([line for line in out.split('\n')
+                            if line.split()[1:2] == ['50']])
+            self.assertGreater(ncontact, 0)
+            for coarse, locrigid, jobs in ((False, False, 1), (True, True, 1),
+                                           (True, False, 3)):
+                e = make_editor('CALC', coarse, locrigid)
+                out = write_restraints(e, jobs)
+                c = e.delEmax_calculation
+                self.assertEqual(c.ncontact, ncontact)
+                self.assertEqual((c.nres, c.nhet), (40, 0))
+                self.assertAlmostEqual(
+                    c.delEmax, float('%.3f' % (3.6 * 40 / ncontact)),
+                    delta=1e-8)
+                # Output should match that for the calculated delEmax
+                self.assertEqual(
+                    out, write_restraints(make_editor(c.delEmax, coarse,
+                                                      locrigid)))
+
+    def test_classify_restraints_jobs(self):
+        """Test classify_restraints() and write_restraints() in parallel"""
+        from allosmod.edit_restraints import TruncatedGaussianParameters
+        from allosmod.util.restraints import RestraintBuffer, RestraintStore
+        atoms = self.make_classify_atoms()
+        rsr = self.make_classify_restraints(len(atoms))
+        tgparams = TruncatedGaussianParameters(0.1, delEmaxNUC=0.12,
+                                               slope=4.0, scl_delx=0.7,
+                                               breaks={})
+        with utils.temporary_directory() as tmpdir:
+            e = MockRestraintEditor()
+            e.listoth_rsr = os.path.join(tmpdir, 'oth.rsr')
+            e.listas_rsr = os.path.join(tmpdir, 'as.rsr')
+            e.atoms = atoms
+            e.coarse = True
+            for i, j in ((1, 3), (3, 7), (1, 9), (4, 10), (10, 18)):
+                e.contacts[(i, j)] = True
+            for fname in e.listoth_rsr, e.listas_rsr:
+                with open(fname, 'w') as fh:
+                    fh.write(rsr)
+            outputs = []
+            # Run without caches, then write caches, then read them
+            for jobs, cache in ((1, False), (3, False), (3, True), (3, True),
+                                (1, True)):
+                e.delEmax = 0.2
+                e.jobs = jobs
+                e.cache = cache
+                e.shard_size = 4000
+                e.chunk_size = 100
+                # The whole file should never be read into memory at once,
+                # or read a second time to hash it
+                with RestraintBuffer() as buf, e.get_pool() as pool, \
+                        mock.patch.object(RestraintStore, 'read_file',
+                                          side_effect=AssertionError), \
+                        mock.patch.object(RestraintStore, 'concatenate',
+                                          side_effect=AssertionError), \
+                        mock.patch.object(allosmod.util.restraints,
+                                          'get_file_hash',
+                                          side_effect=AssertionError), \
+                        mock.patch.object(allosmod.edit_restraints,
+                                          'get_file_hash',
+                                          side_effect=AssertionError):
+                    e.classify_restraints(buf, pool)
+                    if jobs > 1:
+                        self.assertGreater(len(buf), 2)
+                    fh = StringIO()
+                    e.write_restraints(tgparams, buf, fh, pool)
+                    outputs.append((fh.getvalue(), e.delEmax))
+                self.assertEqual(os.path.exists(e.listas_rsr + '.rsrcache'),
+                                 cache)
+            # Files are hashed only if read serially; otherwise the cache
+            # records only their size and modification time
+            from allosmod.util.cache import get_file_hash
+            header = RestraintStore.load(e.listas_rsr + '.rsrcache')[1]
+            self.assertIsNone(header['source']['sha256'])
+            for fname in e.listoth_rsr, e.listas_rsr:
+                os.unlink(fname + '.rsrcache')
+            e.delEmax = 0.2
+            e.jobs = 1
+            with RestraintBuffer() as buf:
+                e.classify_restraints(buf)
+            header = RestraintStore.load(e.listas_rsr + '.rsrcache')[1]
+            self.assertEqual(header['source']['sha256'],
+                             get_file_hash(e.listas_rsr))
+            # Cache files can also be used directly
+            e.listas_rsr += '.rsrcache'
+            e.listoth_rsr += '.rsrcache'
+            for jobs in (1, 3):
+                e.delEmax = 0.2
+                e.jobs = jobs
+                with RestraintBuffer() as buf, e.get_pool() as pool:
+                    e.classify_restraints(buf, pool)
+                    fh = StringIO()
+                    e.write_restraints(tgparams, buf, fh, pool)
+                    outputs.append((fh.getvalue(), e.delEmax))
+        for output in outputs[1:]:
+            self.assertEqual(output, outputs[0])
+
+    def test_classify_bad(self):
+        """Test classify() with invalid restraints"""
+        from allosmod.util.restraints import RestraintStore
+        e = MockRestraintEditor()
+        e.atoms = self.make_classify_atoms()
+        for line in ("R 5 1 1 9 2 2 1 1 2 3.0 0.5",
+                     "R 3 1 1 9 2 1 1 1 2 3.0",
+                     "R 3 1 1 9 2 2 1 1 2 3.0 x",
+                     "R 7 1 1 9 2 3 1 1 2 3.0 4.0 5.0"):
+            store = RestraintStore.from_lines([line])
+            self.assertRaises(ValueError, e.classify, store)
+        store = RestraintStore.from_lines(["R 3 1 1 9 2 2 1 1 99 3.0 0.5"])
+        self.assertRaises(IndexError, e.classify, store)
 
     def test_get_beta(self):
         """Test get_beta()"""
@@ -713,7 +1668,7 @@ class Tests(unittest.TestCase):
         r2 = list(e.check_parse_restraint(r))
         self.assertEqual(len(r2), 1)
         self.assertEqual(type(r2[0]),
-                         allosmod.edit_restraints.GaussianRestraint)
+                         GaussianRestraint)
         self.assertAlmostEqual(r2[0].stdev, 8.0, places=1)
         # with empty_AS on
         e.tgauss_AS = True
@@ -744,7 +1699,7 @@ class Tests(unittest.TestCase):
         # with delEmax = 0
         r2 = list(e.check_parse_restraint(r, delEmax=0.))
         self.assertEqual(type(r2[0]),
-                         allosmod.edit_restraints.MultiGaussianRestraint)
+                         MultiGaussianRestraint)
         self.assertEqual(len(r2[0].stdevs), 2)
         self.assertAlmostEqual(r2[0].stdevs[0], 2.0, places=1)
 
@@ -772,7 +1727,7 @@ class Tests(unittest.TestCase):
         r2 = list(e.check_parse_restraint(r, delEmax=0.))
         self.assertEqual(len(r2), 1)
         self.assertEqual(type(r2[0]),
-                         allosmod.edit_restraints.MultiGaussianRestraint)
+                         MultiGaussianRestraint)
         self.assertEqual(len(r2[0].stdevs), 1)
         self.assertAlmostEqual(r2[0].stdevs[0], 12.0, places=1)
 
@@ -789,7 +1744,7 @@ class Tests(unittest.TestCase):
             r2 = list(e.check_parse_restraint(r))
             self.assertEqual(len(r2), 1)
             self.assertEqual(type(r2[0]),
-                             allosmod.edit_restraints.GaussianRestraint)
+                             GaussianRestraint)
             self.assertAlmostEqual(r2[0].mean, 10.0, places=1)
             self.assertAlmostEqual(r2[0].stdev, 20.0 / scale, places=1)
 
@@ -808,7 +1763,7 @@ class Tests(unittest.TestCase):
                 r2 = list(e.check_parse_restraint(r))
                 self.assertEqual(len(r2), 1)
                 self.assertEqual(type(r2[0]),
-                                 allosmod.edit_restraints.GaussianRestraint)
+                                 GaussianRestraint)
                 self.assertAlmostEqual(r2[0].mean, 10.0, places=1)
                 self.assertAlmostEqual(r2[0].stdev, 20.0 / scale, places=1)
 
@@ -827,7 +1782,7 @@ class Tests(unittest.TestCase):
                 self.assertEqual(len(r2), 1)
                 self.assertEqual(
                     type(r2[0]),
-                    allosmod.edit_restraints.MultiGaussianRestraint)
+                    MultiGaussianRestraint)
                 self.assertEqual(len(r2[0].means), 2)
                 self.assertAlmostEqual(r2[0].weights[0], 0.8, places=1)
                 self.assertAlmostEqual(r2[0].weights[1], 0.2, places=1)
@@ -848,7 +1803,7 @@ class Tests(unittest.TestCase):
             r2 = list(e.check_parse_restraint(r))
             self.assertEqual(len(r2), 1)
             self.assertEqual(type(r2[0]),
-                             allosmod.edit_restraints.CosineRestraint)
+                             CosineRestraint)
             self.assertAlmostEqual(r2[0].phase, 20.0, places=1)
             self.assertAlmostEqual(r2[0].force, 30.0 * scale, places=1)
 
@@ -860,7 +1815,7 @@ class Tests(unittest.TestCase):
         r2 = list(e.check_parse_restraint(r))
         self.assertEqual(len(r2), 1)
         self.assertEqual(type(r2[0]),
-                         allosmod.edit_restraints.SplineRestraint)
+                         SplineRestraint)
         self.assertEqual(r2[0]._params, ['x', 'y', 'z'])
 
     def test_parse_coarse_not_ca_cb(self):
@@ -976,7 +1931,7 @@ class Tests(unittest.TestCase):
         # keep as is (but scaled by HETscale, 4.0)
         self.assertEqual(len(r2), 1)
         self.assertEqual(type(r2[0]),
-                         allosmod.edit_restraints.GaussianRestraint)
+                         GaussianRestraint)
         self.assertAlmostEqual(r2[0].mean, 10.0, places=1)
         self.assertAlmostEqual(r2[0].stdev, 20.0 / 4.0, places=1)
 
@@ -1019,7 +1974,7 @@ class Tests(unittest.TestCase):
         r2 = list(e.check_parse_restraint(r))
         self.assertEqual(len(r2), 1)
         self.assertEqual(type(r2[0]),
-                         allosmod.edit_restraints.GaussianRestraint)
+                         GaussianRestraint)
         self.assertAlmostEqual(r2[0].mean, 7.9, places=1)
         self.assertAlmostEqual(r2[0].stdev, 1.0, places=1)
         # If mean > rcutNUC (8.0), restraint should be omitted
@@ -1028,39 +1983,31 @@ class Tests(unittest.TestCase):
         self.assertEqual(len(r2), 0)
 
     def test_setup_delEmax_no_coarse(self):
-        """Test setup_delEmax(), coarse=False"""
+        """Test reference delEmax scaling, coarse=False"""
         e = MockRestraintEditor()
         # coarse=False; delE* should be unchanged
-        e.setup_delEmax()
+        e.setup_delEmax(parse_restraints_file(StringIO(""), []))
         self.assertAlmostEqual(e.delEmax, 0.2, places=1)
         self.assertAlmostEqual(e.delEmaxNUC, 0.12, places=2)
 
     def test_setup_delEmax_no_rsr(self):
-        """Test setup_delEmax(), no restraints"""
+        """Test reference delEmax scaling, no restraints"""
         e = MockRestraintEditor()
         # empty file; delE* should be unchanged
         e.coarse = True
         e.atoms = []
-        open('dummyas.rsr', 'w').close()
-
-        def mock_parse(fh, atoms):
-            return []
-        with utils.mock_method(allosmod.edit_restraints,
-                               'parse_restraints_file', mock_parse):
-            e.setup_delEmax()
+        e.setup_delEmax([])
         self.assertAlmostEqual(e.delEmax, 0.2, places=1)
         self.assertAlmostEqual(e.delEmaxNUC, 0.12, places=2)
-        os.unlink('dummyas.rsr')
 
     def test_setup_delEmax_rsr(self):
-        """Test setup_delEmax(), with some restraints"""
+        """Test reference delEmax scaling, with some restraints"""
         e = MockRestraintEditor()
         e.contacts[(1, 2)] = True
         e.coarse = True
         e.atoms = []
-        open('dummyas.rsr', 'w').close()
 
-        def mock_parse(fh, atoms):
+        def make_restraints():
             def set_resind(atoms):
                 atoms[0].a.residue.index = 1
                 atoms[1].a.residue.index = 2
@@ -1096,12 +2043,9 @@ class Tests(unittest.TestCase):
             # Restraint of wrong type
             r = self.make_cosine_restraint(make_ca_ca)
             yield r
-        with utils.mock_method(allosmod.edit_restraints,
-                               'parse_restraints_file', mock_parse):
-            e.setup_delEmax()
+        e.setup_delEmax(make_restraints())
         self.assertAlmostEqual(e.delEmax, 0.08, places=2)
         self.assertAlmostEqual(e.delEmaxNUC, 0.05, places=2)
-        os.unlink('dummyas.rsr')
 
     def test_simple(self):
         """Simple complete run of edit_restraints"""
@@ -1120,9 +2064,11 @@ ATOM      5  CB  ARG A   1     -17.793 -11.337  -0.899  1.00  0.46           C
                 fh.write("test.pdb\n")
             with open(os.path.join(tmpdir, 'atomlistASRS'), 'w') as fh:
                 fh.write("1 AS\n2 AS\n")
+            env = dict(os.environ,
+                       ALLOSMOD_CACHE_DIR=os.path.join(tmpdir, 'cache'))
             check_output(['allosmod', 'edit_restraints', 'test.rsr',
                           'test.rsr', 'pm_test.pdb', 'list4contacts',
-                          'atomlistASRS'], cwd=tmpdir)
+                          'atomlistASRS'], cwd=tmpdir, env=env)
 
 
 if __name__ == '__main__':
@@ -71,6 +71,41 @@ class Tests(unittest.TestCase):
         self.assertRaises(ValueError, _get_average_aa,
                           MockResidue(pdb_name='HIS', atoms=AtomList()))
 
+    def test_get_residue_centers(self):
+        """Test get_residue_centers()"""
+        from allosmod.get_contacts import get_residue_centers
+        gly = MockResidue(pdb_name='GLY', atoms=AtomList(
+            MockAtom(name='N', x=0, y=0, z=0),
+            MockAtom(name='CA', x=2, y=4, z=0),
+            MockAtom(name='CB', x=10, y=10, z=10)))
+        his = MockResidue(pdb_name='HIS', atoms=AtomList(
+            MockAtom(name='CA', x=0, y=0, z=0),
+            MockAtom(name='CB', x=1, y=0, z=0),
+            MockAtom(name='CG', x=2, y=3, z=0)))
+        bb = MockResidue(pdb_name='ALA', atoms=AtomList(
+            MockAtom(name='O', x=5, y=0, z=0),
+            MockAtom(name='N', x=6, y=0, z=0)))
+        hem = MockResidue(pdb_name='HEM', atoms=AtomList(
+            *[MockAtom(name=n, x=i, y=0, z=0)
+              for i, n in enumerate(['FE', 'NA', 'C1A', 'NB', 'NC', 'C1C',
+                                     'C2C', 'ND', 'CA'])]))
+        coords, owner = get_residue_centers([gly, his, bb, hem])
+        self.assertEqual(list(owner), [0, 1, 2, 3, 3, 3, 3])
+        self.assertEqual(coords.tolist(),
+                         [[2., 4., 0.], [1.5, 1.5, 0.], [5., 0., 0.],
+                          [1.5, 0., 0.], [3., 0., 0.], [5., 0., 0.],
+                          [7., 0., 0.]])
+        # Without special HEM handling, it is treated like any other residue
+        coords, owner = get_residue_centers([hem], hem=False)
+        self.assertEqual(list(owner), [0])
+        self.assertAlmostEqual(coords[0][0], 3.5, delta=1e-6)
+        coords, owner = get_residue_centers([])
+        self.assertEqual(coords.shape, (0, 3))
+        self.assertEqual(len(owner), 0)
+        self.assertRaises(ValueError, get_residue_centers,
+                          [gly, MockResidue(pdb_name='HIS',
+                                            atoms=AtomList())])
+
     def test_get_contact_dist(self):
         """Test get_contact_dist()"""
         from allosmod.get_contacts import get_contact_dist
@@ -85,6 +120,26 @@ class Tests(unittest.TestCase):
                                                 Residue(((0, 5, 0),)), 100.),
                                5.0, places=1)
 
+    def test_get_close_points(self):
+        """Test _get_close_points()"""
+        import numpy as np
+        from allosmod.get_contacts import _get_close_points
+        rng = np.random.RandomState(42)
+        coords = rng.uniform(-20., 30., size=(300, 3))
+        for rcut, block_size in ((5.0, 4096), (7.5, 17), (-7.5, 50),
+                                 (100., 64)):
+            i, j = _get_close_points(coords, rcut, block_size=block_size)
+            self.assertTrue(np.all(i < j))
+            d = np.linalg.norm(coords[:, np.newaxis] - coords, axis=2)
+            expected = set(zip(*np.nonzero(np.triu(d < abs(rcut), k=1))))
+            self.assertEqual(set(zip(i, j)), expected)
+            self.assertEqual(len(i), len(expected))
+        for coords, rcut in (([], 5.0), ([(1., 2., 3.)], 5.0),
+                             ([(1., 2., 3.), (1., 2., 3.)], 0.)):
+            i, j = _get_close_points(coords, rcut)
+            self.assertEqual(len(i), 0)
+            self.assertEqual(len(j), 0)
+
     def test_simple(self):
         """Simple complete run of get_contacts"""
         out = check_output(['allosmod', 'get_contacts',
@@ -0,0 +1,121 @@
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import utils
+from utils import check_output
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+test_dir = utils.set_search_paths(TOPDIR)
+
+
+def setup_run_dirs(tmpdir):
+    """Make two simulation directories containing snapshots"""
+    templates = [os.path.join(test_dir, 'input', 'test_qiavg_%d.pdb' % i)
+                 for i in (1, 2)]
+    for n, sim in enumerate(('p_0', 'p_1')):
+        d = os.path.join(tmpdir, 'pred_dE-50rAS1000', sim)
+        os.makedirs(d)
+        shutil.copy(templates[n], os.path.join(d, 'pm.pdb.B10010001.pdb'))
+        shutil.copy(templates[1 - n],
+                    os.path.join(d, 'pm.pdb.B10020001.pdb'))
+        # Only sampling snapshots should be used, not the equilibration
+        # snapshots or the final model
+        for fname in ('pm.pdb.B05010001.pdb', 'pm.pdb.B99990001.pdb'):
+            with open(os.path.join(d, fname), 'w') as fh:
+                fh.write("garbage")
+
+
+class Tests(unittest.TestCase):
+    def test_bad(self):
+        """Test wrong arguments to get_qi_trajectory"""
+        check_output(['allosmod', 'get_qi_trajectory'],
+                     stderr=subprocess.STDOUT, retcode=2)
+        check_output([sys.executable, '-m',
+                      'allosmod.get_qi_trajectory'],
+                     stderr=subprocess.STDOUT, retcode=2)
+
+    def test_find_snapshots(self):
+        """Test find_snapshots()"""
+        from allosmod.get_qi_trajectory import find_snapshots
+        with utils.temporary_directory() as tmpdir:
+            setup_run_dirs(tmpdir)
+            top = os.path.join(tmpdir, 'pred_dE-50rAS1000')
+            self.assertEqual(
+                [os.path.relpath(f, top) for f in find_snapshots([top])],
+                ['p_0/pm.pdb.B10010001.pdb', 'p_0/pm.pdb.B10020001.pdb',
+                 'p_1/pm.pdb.B10010001.pdb', 'p_1/pm.pdb.B10020001.pdb'])
+            self.assertRaises(ValueError, find_snapshots,
+                              [os.path.join(top, 'garbage')])
+
+    def test_get_qi_trajectory(self):
+        """Test get_qi_trajectory() in blocks, with and without a pool"""
+        import numpy as np
+        import allosmod.get_qi_trajectory
+        from allosmod.get_qi_trajectory import get_qi_trajectory
+        target = os.path.join(test_dir, 'input', 'test_qiavg.pdb')
+        expected_qi1 = [0.4274, np.nan, 0.8496, 0.8315, 0.8712, 0.8774,
+                        0.8632, 0.9087, np.nan]
+        cwd = os.getcwd()
+        old_block = allosmod.get_qi_trajectory.frames_per_block
+        try:
+            allosmod.get_qi_trajectory.frames_per_block = 3
+            for jobs in (1, 2):
+                with utils.temporary_directory() as tmpdir:
+                    setup_run_dirs(tmpdir)
+                    os.chdir(tmpdir)
+                    get_qi_trajectory(target, ['pred_dE-50rAS1000'], 20.0,
+                                      jobs=jobs)
+                    qi = np.load('qi_frames.npy')
+                    self.assertEqual(qi.dtype, np.float32)
+                    self.assertEqual(qi.shape, (9, 4))
+                    np.testing.assert_allclose(qi[:, 0], expected_qi1,
+                                               atol=1e-4)
+                    np.testing.assert_array_equal(qi[:, 0], qi[:, 3])
+                    np.testing.assert_array_equal(qi[:, 1], qi[:, 2])
+                    with open('q_frames.dat') as fh:
+                        lines = fh.readlines()
+                    self.assertEqual(len(lines), 4)
+                    self.assertEqual(
+                        lines[2].split()[::2],
+                        ['3', 'pred_dE-50rAS1000/p_1/pm.pdb.B10010001.pdb'])
+                    self.assertEqual(lines[0].split()[1],
+                                     lines[3].split()[1])
+                    os.chdir(cwd)
+        finally:
+            os.chdir(cwd)
+            allosmod.get_qi_trajectory.frames_per_block = old_block
+
+    def test_simple(self):
+        """Simple complete run of get_qi_trajectory"""
+        target = os.path.join(test_dir, 'input', 'test_qiavg.pdb')
+        with utils.temporary_directory() as tmpdir:
+            setup_run_dirs(tmpdir)
+            # Average over all frames should match get_qiavg_ca
+            check_output(['allosmod', 'get_qiavg_ca', target, '20.0',
+                          os.path.join(test_dir, 'input', 'test_qiavg_1.pdb'),
+                          os.path.join(test_dir, 'input', 'test_qiavg_2.pdb')],
+                         cwd=tmpdir)
+            with open(os.path.join(tmpdir, 'qi_avg.dat')) as fh:
+                qiavg = fh.read()
+            check_output(['allosmod', 'get_qi_trajectory', target, '20.0',
+                          'pred_dE-50rAS1000'], cwd=tmpdir)
+            with open(os.path.join(tmpdir, 'qi_avg.dat')) as fh:
+                self.assertEqual(fh.read(), qiavg)
+            self.assertTrue(os.path.exists(os.path.join(tmpdir,
+                                                        'qi_frames.npy')))
+
+    def test_no_snapshots(self):
+        """Test get_qi_trajectory with no snapshots"""
+        with utils.temporary_directory() as tmpdir:
+            out = check_output(['allosmod', 'get_qi_trajectory',
+                                os.path.join(test_dir, 'input',
+                                             'test_qiavg.pdb'),
+                                '20.0', tmpdir],
+                               stderr=subprocess.STDOUT, retcode=1,
+                               universal_newlines=True)
+            self.assertIn('No snapshots found', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
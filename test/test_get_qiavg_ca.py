@@ -17,6 +17,83 @@ class Tests(unittest.TestCase):
                       'allosmod.get_qiavg_ca'],
                      stderr=subprocess.STDOUT, retcode=2)
 
+    def test_get_qi_ca(self):
+        """Test get_distances() and get_qi_ca() against a simple loop"""
+        import io
+        import math
+        import numpy as np
+        import allosmod.get_qiavg_ca
+        from allosmod.get_qiavg_ca import get_distances, get_qi_ca
+        from allosmod.get_qiavg_ca import get_coordinate_array
+
+        class Coord:
+            def __init__(self, x, y, z):
+                self.x, self.y, self.z = x, y, z
+        rng = np.random.RandomState(42)
+        target = [Coord(*c) for c in rng.uniform(0., 10., size=(20, 3))]
+        template = [Coord(c.x + 0.5, c.y - 0.2, c.z) for c in target]
+        template[3] = target[7] = None
+
+        dist = get_distances(get_coordinate_array(target), 6.0)
+        expected = {}
+        for i, ci in enumerate(target):
+            for j, cj in enumerate(target):
+                if ci is not None and cj is not None and abs(i - j) >= 2:
+                    d = math.sqrt((ci.x - cj.x) ** 2 + (ci.y - cj.y) ** 2
+                                  + (ci.z - cj.z) ** 2)
+                    if d < 6.0:
+                        expected[(i, j)] = d
+        self.assertEqual(list(zip(dist.i.tolist(), dist.j.tolist())),
+                         sorted(expected.keys()))
+        for i, j, d in zip(dist.i, dist.j, dist.dist):
+            self.assertAlmostEqual(d, expected[(i, j)], places=8)
+
+        avg = np.zeros(20)
+        navg = np.zeros(20, dtype=np.int64)
+        fh = io.StringIO()
+        with utils.mock_method(allosmod.get_qiavg_ca, 'read_coordinates',
+                               lambda fname, m: get_coordinate_array(
+                                   template)):
+            get_qi_ca(None, 20, dist, 'template.pdb', avg, navg, fh)
+            self.assertRaises(ValueError, get_qi_ca, None, 19, dist,
+                              'template.pdb', avg, navg, fh)
+        lines = fh.getvalue().split('\n')
+        self.assertEqual(len(lines), 21)
+        # Residues without coordinates get the sentinel value
+        self.assertEqual(lines[3], '     4    1.1000')
+        self.assertEqual(lines[7], '     8    1.1000')
+        self.assertEqual(navg[3], 0)
+        self.assertEqual(navg[7], 0)
+        for i in range(20):
+            qi, n = 0., 0
+            for j in range(20):
+                if (i, j) in expected and template[i] is not None \
+                        and template[j] is not None:
+                    ci, cj = template[i], template[j]
+                    d = math.sqrt((ci.x - cj.x) ** 2 + (ci.y - cj.y) ** 2
+                                  + (ci.z - cj.z) ** 2)
+                    delta = (expected[(i, j)] - d) / (abs(i - j) ** 0.15)
+                    qi += math.exp(-delta * delta * 0.5)
+                    n += 1
+            if n > 0:
+                self.assertAlmostEqual(avg[i], qi / n, places=8)
+                self.assertEqual(lines[i], "%6d %9.4f" % (i + 1, qi / n))
+
+    def test_read_coordinates(self):
+        """Test read_coordinates()"""
+        import numpy as np
+        from allosmod.get_qiavg_ca import read_coordinates
+        fname = os.path.join(test_dir, 'input', 'test_qiavg.pdb')
+        c = read_coordinates(fname)
+        with open(fname) as fh:
+            contents = fh.read()
+        with utils.temporary_directory() as tmpdir:
+            # Files with multiple models should be read with Modeller
+            multi = os.path.join(tmpdir, 'multi.pdb')
+            with open(multi, 'w') as fh:
+                fh.write("MODEL        1\n" + contents)
+            np.testing.assert_array_equal(read_coordinates(multi), c)
+
     def test_simple(self):
         """Simple complete run of get_qiavg_ca"""
         check_output(['allosmod', 'get_qiavg_ca',
@@ -17,6 +17,152 @@ class Tests(unittest.TestCase):
                       'allosmod.get_qmatrix'],
                      stderr=subprocess.STDOUT, retcode=2)
 
+    def test_make_matrix_from_dists(self):
+        """Test make_matrix_from_dists() against a simple loop"""
+        import math
+        import numpy as np
+        import allosmod.get_qmatrix
+        from allosmod.get_qmatrix import TemplateDistances
+        from allosmod.get_qmatrix import make_matrix_from_dists
+        from allosmod.get_qiavg_ca import get_coordinate_array
+
+        class Coord:
+            def __init__(self, x, y, z):
+                self.x, self.y, self.z = x, y, z
+        rng = np.random.RandomState(42)
+        numres, ntemp, rcut = 30, 7, 8.0
+        base = rng.uniform(0., 20., size=(numres + 5, 3))
+        coords = []
+        for t in range(ntemp):
+            # Templates may be shorter or longer than the target
+            n = numres + (t % 3) * 5 - 5
+            xyz = base[:n] + rng.normal(0., 1., size=(n, 3))
+            coords.append([Coord(*c) for c in xyz])
+        coords[2][4] = coords[5][10] = None
+
+        def get_dist(ci, cj):
+            if ci is not None and cj is not None:
+                return math.sqrt((ci.x - cj.x) ** 2 + (ci.y - cj.y) ** 2
+                                 + (ci.z - cj.z) ** 2)
+
+        def get_expected_q(c1, c2):
+            q, n = 0., 0
+            for i in range(numres - 2):
+                for j in range(i + 2, numres):
+                    if j >= len(c1) or j >= len(c2):
+                        continue
+                    d1 = get_dist(c1[i], c1[j])
+                    d2 = get_dist(c2[i], c2[j])
+                    if d1 is not None and d2 is not None \
+                            and (d1 < rcut or d2 < rcut):
+                        delta = (d1 - d2) / (abs(j - i) ** 0.15)
+                        q += math.exp(-delta * delta * 0.5)
+                        n += 1
+            return q / n if n > 0 else 0.
+
+        old_max_memory = allosmod.get_qmatrix.max_memory
+        old_max_block_size = allosmod.get_qmatrix.max_block_size
+        try:
+            for jobs, block_size, max_memory, max_block_size in (
+                    (1, 16, 1 << 30, 1 << 22), (2, 3, 100, 9)):
+                allosmod.get_qmatrix.max_memory = max_memory
+                allosmod.get_qmatrix.max_block_size = max_block_size
+                dists = TemplateDistances(numres, ntemp, rcut)
+                self.assertEqual(len(dists), ntemp)
+                self.assertEqual(dists.dist.dtype, np.float32)
+                self.assertEqual(isinstance(dists.dist, np.memmap),
+                                 max_memory == 100)
+                for n, c in enumerate(coords):
+                    dists.set_coordinates(n, get_coordinate_array(c))
+                q = make_matrix_from_dists(dists, jobs=jobs,
+                                           block_size=block_size)
+                self.assertEqual(isinstance(q, np.memmap),
+                                 max_memory == 100)
+                for i in range(ntemp):
+                    self.assertEqual(q[i, i], 0.)
+                    for j in range(i + 1, ntemp):
+                        self.assertEqual(q[i, j], q[j, i])
+                        self.assertAlmostEqual(
+                            q[i, j], get_expected_q(coords[i], coords[j]),
+                            delta=1e-6)
+        finally:
+            allosmod.get_qmatrix.max_memory = old_max_memory
+            allosmod.get_qmatrix.max_block_size = old_max_block_size
+
+    def test_landmark_q_matrix(self):
+        """Test LandmarkQMatrix"""
+        import io
+        import numpy as np
+        from allosmod.get_qmatrix import TemplateDistances
+        from allosmod.get_qmatrix import make_matrix_from_dists
+        from allosmod.get_qmatrix import LandmarkQMatrix, write_q_output
+
+        rng = np.random.RandomState(42)
+        numres, ntemp = 40, 30
+        # Templates are noisy copies of two structures
+        states = [np.cumsum(rng.normal(0., 2.2, size=(numres, 3)), axis=0)
+                  for _ in range(2)]
+        dists = TemplateDistances(numres, ntemp, 11.0)
+        for n in range(ntemp):
+            xyz = states[n % 2] + rng.normal(0., 0.5, size=(numres, 3))
+            dists.set_coordinates(n, xyz)
+        exact = make_matrix_from_dists(dists)
+        np.fill_diagonal(exact, 1.0)
+        for jobs in (1, 2):
+            q = LandmarkQMatrix(dists, 4, jobs=jobs, ncheck=50)
+            self.assertEqual(len(q), ntemp)
+            self.assertEqual(len(q.landmarks), 4)
+            self.assertEqual(q.landmarks[0], 0)
+            # Farthest-point sampling should pick both structures
+            self.assertEqual(q.landmarks[1] % 2, 1)
+            approx = q[0:ntemp]
+            for itg in q.landmarks:
+                self.assertLess(np.max(np.abs(approx[itg] - exact[itg])),
+                                1e-6)
+                self.assertLess(np.max(np.abs(approx[:, itg]
+                                              - exact[:, itg])), 1e-6)
+            self.assertLess(np.mean(np.abs(approx - exact)), 0.02)
+            self.assertEqual(len(q.errors), 50)
+            self.assertLess(q.get_error_bound(), 0.05)
+
+            mat_fh, avg_fh = io.StringIO(), io.StringIO()
+            write_q_output(q, ['t%d' % i for i in range(ntemp)], mat_fh,
+                           avg_fh)
+            q.write_error_summary(avg_fh)
+            lines = avg_fh.getvalue().split('\n')
+            self.assertTrue(lines[0].startswith('Qa,b: '))
+            self.assertTrue(lines[1].startswith('Qa,b error bound: '))
+            self.assertTrue(lines[2].startswith(
+                'Approximate Q matrix from 4 landmarks; over 50 sampled'))
+        # With all templates as landmarks, the matrix is exact
+        q = LandmarkQMatrix(dists, 50)
+        self.assertEqual(len(q.landmarks), ntemp)
+        self.assertEqual(len(q.errors), 0)
+        self.assertEqual(q.get_error_bound(), 0.)
+        self.assertLess(np.max(np.abs(q[0:ntemp] - exact)), 1e-6)
+
+    def test_write_q_output(self):
+        """Test write_q_output()"""
+        import io
+        import numpy as np
+        from allosmod.get_qmatrix import write_q_output
+        q = np.array([[0., 0.5, 0.], [0.5, 0., 0.25], [0., 0.25, 0.]])
+        mat_fh, avg_fh = io.StringIO(), io.StringIO()
+        write_q_output(q, ['a', 'b', 'c'], mat_fh, avg_fh)
+        self.assertEqual(mat_fh.getvalue(),
+                         "a 1.0000 0.5000 1.0000\n"
+                         "b 0.5000 1.0000 0.2500\n"
+                         "c 1.0000 0.2500 1.0000\n")
+        self.assertEqual(avg_fh.getvalue(), "Qa,b: 0.58\n")
+
+    def test_shuffle_templates(self):
+        """Test that shuffle_templates() keeps all templates"""
+        from allosmod.get_qmatrix import shuffle_templates
+        templates = ['t%d' % i for i in range(1000)]
+        shuffle_templates(templates)
+        self.assertEqual(sorted(templates),
+                         sorted('t%d' % i for i in range(1000)))
+
     def test_simple(self):
         """Simple complete run of get_qmatrix"""
         check_output(['allosmod', 'get_qmatrix',
@@ -55,6 +201,26 @@ class Tests(unittest.TestCase):
         os.unlink('qmatrix.dat')
         os.unlink('cq_aq_qavg_qsd.dat')
 
+    def test_landmarks(self):
+        """Complete run of get_qmatrix with landmarks"""
+        check_output(['allosmod', 'get_qmatrix', '--landmarks', '2',
+                     os.path.join(test_dir, 'input',
+                                  'test_get_contacts.pdb'), '11.0']
+                     + [os.path.join(test_dir, 'input',
+                                     'test_qmatrix_%d.pdb' % i)
+                        for i in (1, 2, 3)])
+        with open('qmatrix.dat') as fh:
+            lines = fh.readlines()
+        self.assertEqual(len(lines), 3)
+        with open('cq_aq_qavg_qsd.dat') as fh:
+            contents = fh.read()
+        # Only one template is not a landmark, so all of the off-diagonal
+        # elements are exact
+        self.assertTrue(contents.startswith('Qa,b: '))
+        self.assertTrue(contents.endswith('\nQa,b error bound: 0.0000\n'))
+        os.unlink('qmatrix.dat')
+        os.unlink('cq_aq_qavg_qsd.dat')
+
 
 if __name__ == '__main__':
     unittest.main()
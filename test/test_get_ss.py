@@ -26,6 +26,49 @@ class Tests(unittest.TestCase):
                            universal_newlines=True)
         self.assertEqual(out, '-\n-\n-\n-\n-\nS\nT\nT\n-\n-\n')
 
+    def test_get_ss_cached(self):
+        """Test get_ss_cached()"""
+        import allosmod.get_ss
+        calls = []
+
+        def mock_get_ss(pdb_file):
+            calls.append(pdb_file)
+            with open(pdb_file) as fh:
+                return list(fh.read())
+        with utils.temporary_directory() as tmpdir:
+            pdb1 = os.path.join(tmpdir, 'test1.pdb')
+            pdb2 = os.path.join(tmpdir, 'test2.pdb')
+            for fname in pdb1, pdb2:
+                with open(fname, 'w') as fh:
+                    fh.write('-HHE')
+            cachedir = os.path.join(tmpdir, 'cache')
+            with utils.mock_method(allosmod.get_ss, 'get_ss', mock_get_ss):
+                allosmod.get_ss._memo.clear()
+                # Uncached
+                ss = allosmod.get_ss.get_ss_cached(pdb1, cache=False,
+                                                   directory=cachedir)
+                self.assertEqual(ss, ['-', 'H', 'H', 'E'])
+                self.assertEqual(calls, [pdb1])
+                self.assertFalse(os.path.exists(cachedir))
+                # Results are cached by file contents
+                for fname in (pdb1, pdb2, pdb1):
+                    ss = allosmod.get_ss.get_ss_cached(fname,
+                                                       directory=cachedir)
+                    self.assertEqual(ss, ['-', 'H', 'H', 'E'])
+                self.assertEqual(calls, [pdb1, pdb1])
+                # Results are also cached on disk
+                allosmod.get_ss._memo.clear()
+                ss = allosmod.get_ss.get_ss_cached(pdb2, directory=cachedir)
+                self.assertEqual(ss, ['-', 'H', 'H', 'E'])
+                self.assertEqual(calls, [pdb1, pdb1])
+                # Changed file is not found in the cache
+                with open(pdb2, 'w') as fh:
+                    fh.write('')
+                ss = allosmod.get_ss.get_ss_cached(pdb2, directory=cachedir)
+                self.assertEqual(ss, [])
+                self.assertEqual(calls, [pdb1, pdb1, pdb2])
+                allosmod.get_ss._memo.clear()
+
     def test_rna(self):
         """Test get_ss with RNA-only file"""
         out = check_output(['allosmod', 'get_ss',
@@ -75,6 +75,22 @@ class Tests(unittest.TestCase):
                     self.assertEqual(line[12:15], exp_records[n][1])
                     self.assertEqual(line[17:20], exp_records[n][2])
 
+    def test_multiple(self):
+        """Test pdb_fix_res on multiple files"""
+        with utils.temporary_directory() as tmpdir:
+            fnames = ['test%d.pdb' % i for i in range(4)]
+            for fname in fnames:
+                with open(os.path.join(tmpdir, fname), 'w') as fh:
+                    fh.write(test_pdb)
+            expected = check_output(['allosmod', 'pdb_fix_res', fnames[0]],
+                                    universal_newlines=True, cwd=tmpdir)
+            check_output(['allosmod', 'pdb_fix_res', '--in-place',
+                          '--jobs', '2'] + fnames, cwd=tmpdir)
+            for fname in fnames:
+                with open(os.path.join(tmpdir, fname)) as fh:
+                    self.assertEqual(fh.read(), expected)
+            self.assertEqual(sorted(os.listdir(tmpdir)), fnames)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import io
+import os
+import utils
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+
+from allosmod.util.pdbcoord import PDBCoordinates  # noqa: E402
+
+TEST_PDB = """EXPDTA    THEORETICAL MODEL
+ATOM      1  N   CYS A   1       1.453   2.100   3.200  0.00  0.00           C
+ATOM      2  CA  CYS A   1      -0.000   0.000   0.000  0.00  0.00           C
+TER
+HETATM    8  CA  MET A   2       3.735   3.100   0.000  1.00  0.00
+"""
+
+
+class Tests(unittest.TestCase):
+    def test_read(self):
+        """Test PDBCoordinates.read()"""
+        c = PDBCoordinates.read(io.StringIO(TEST_PDB))
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.coord[0], (1.453, 2.100, 3.200))
+        self.assertEqual(c.prefix[2], 'HETATM    8  CA  MET A   2    ')
+        self.assertEqual(c.suffix[2], '  1.00  0.00\n')
+        c = PDBCoordinates.read(io.StringIO(TEST_PDB),
+                                filter=lambda line: line.startswith('ATOM'))
+        self.assertEqual(len(c), 2)
+        short = "ATOM      1  N   CYS A   1       1.453\n"
+        self.assertRaises(ValueError, PDBCoordinates.read,
+                          io.StringIO(short))
+
+    def test_write(self):
+        """Test PDBCoordinates.write()"""
+        c = PDBCoordinates.read(io.StringIO(TEST_PDB))
+        fh = io.StringIO()
+        c.write(fh)
+        self.assertEqual(fh.getvalue(),
+                         "".join(line + "\n" for line in TEST_PDB.split("\n")
+                                 if line.startswith(('ATOM', 'HETATM'))))
+        c.translate(10000., 1., -1.)
+        fh = io.StringIO()
+        c.write(fh)
+        self.assertEqual(fh.getvalue().split('\n')[1],
+                         "ATOM      2  CA  CYS A   1    10000.000   1.000"
+                         "  -1.000  0.00  0.00           C")
+
+    def test_center(self):
+        """Test center and mean distance"""
+        c = PDBCoordinates.read(io.StringIO(TEST_PDB))
+        center = c.get_center()
+        for a, b in zip(center, (1.729333, 1.733333, 1.066667)):
+            self.assertAlmostEqual(a, b, places=5)
+        self.assertAlmostEqual(c.get_mean_distance((0., 0., 0.)),
+                               2.9826, places=4)
+        c = PDBCoordinates.read(io.StringIO(""))
+        self.assertRaises(ValueError, c.get_center)
+        self.assertRaises(ValueError, c.get_mean_distance, (0., 0., 0.))
+
+
+if __name__ == '__main__':
+    unittest.main()
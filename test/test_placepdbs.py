@@ -0,0 +1,155 @@
+import unittest
+import subprocess
+import os
+import sys
+import utils
+from utils import check_output
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+test_dir = utils.set_search_paths(TOPDIR)
+
+
+test_pdb = """EXPDTA    THEORETICAL MODEL, MODELLER SVN 2015/05/15 09:37:25
+ATOM      1  N   CYS A   1       1.453   2.100   3.200  0.00  0.00           C
+ATOM      2  CA  CYS A   1       1.453   0.000   0.000  0.00  0.00           C
+ATOM      8  CA  MET A   2       3.735   3.100   0.000  1.00  0.00           C
+HETATM   18  CA  MET A   2      13.735   3.100   0.000  1.00  0.00           C
+END
+"""
+
+
+def setup_pdbs(tmpdir):
+    """Write a list file naming several PDB files"""
+    pdbs = ['asite_pdb1.pdb', 'test_rna.pdb', 'test_qiavg.pdb',
+            'asite_pdb2.pdb', 'test_qmatrix_1.pdb', 'test_qmatrix_2.pdb',
+            'test_qmatrix_3.pdb', 'test_qiavg_1.pdb', 'test_qiavg_2.pdb']
+    for n, pdb in enumerate(pdbs):
+        with open(os.path.join(test_dir, 'input', pdb)) as fh:
+            contents = fh.read()
+        with open(os.path.join(tmpdir, 's%d.pdb' % n), 'w') as fh:
+            fh.write(contents)
+    with open(os.path.join(tmpdir, 'list'), 'w') as fh:
+        for n in range(len(pdbs)):
+            fh.write("s%d.pdb A 1 10\n" % n)
+    return ['s%d.pdb' % n for n in range(len(pdbs))]
+
+
+class Tests(unittest.TestCase):
+    def test_bad(self):
+        """Test wrong arguments to placepdbs"""
+        for args in ([], ['foo']):
+            check_output(['allosmod', 'placepdbs'] + args,
+                         stderr=subprocess.STDOUT, retcode=2)
+            check_output([sys.executable, '-m', 'allosmod.placepdbs'] + args,
+                         stderr=subprocess.STDOUT, retcode=2)
+
+    def test_get_lattice_position(self):
+        """Test get_lattice_position()"""
+        from allosmod.placepdbs import get_lattice_position
+        self.assertEqual(get_lattice_position(0), ((0, 0, 0), 0))
+        self.assertEqual(get_lattice_position(1), ((1, 0, 0), 1))
+        self.assertEqual(get_lattice_position(6), ((0, 0, -1), 1))
+        self.assertEqual(get_lattice_position(7), ((1, 0, 0), 2))
+        self.assertEqual(get_lattice_position(13), ((1, 0, 0), 3))
+
+    def test_get_random_angles(self):
+        """Test get_random_angles()"""
+        from allosmod.placepdbs import get_random_angles
+        angles = get_random_angles(5, seed=42)
+        self.assertEqual(len(angles), 5)
+        for a in angles:
+            self.assertEqual(len(a), 3)
+            for r in a:
+                self.assertTrue(0 <= r < 360)
+        self.assertEqual(get_random_angles(5, seed=42), angles)
+
+    def test_place_pdbs(self):
+        """Test place_pdbs() against the individual commands it replaces"""
+        from decimal import Decimal
+        from allosmod.placepdbs import place_pdbs, get_lattice_position
+        angles = [(17, 200, 359), (0, 0, 0), (90, 45, 301), (123, 7, 88),
+                  (5, 270, 180), (44, 44, 44), (300, 1, 2), (77, 150, 222),
+                  (359, 359, 1)]
+        with utils.temporary_directory() as tmpdir:
+            olddir = os.path.join(tmpdir, 'old')
+            newdir = os.path.join(tmpdir, 'new')
+            os.mkdir(olddir)
+            os.mkdir(newdir)
+            pdbs = setup_pdbs(olddir)
+            setup_pdbs(newdir)
+            # Emulate the original shell script loop
+            for n, (pdb, rot) in enumerate(zip(pdbs, angles)):
+                out = check_output(['allosmod', 'rotatepdb', pdb]
+                                   + [str(r) for r in rot], cwd=olddir,
+                                   universal_newlines=True)
+                with open(os.path.join(olddir, 'random.ini'), 'w') as fh:
+                    fh.write(out)
+                rofg = Decimal(check_output(
+                    ['allosmod', 'getrofg', 'random.ini'], cwd=olddir,
+                    universal_newlines=True).strip())
+                if n == 0:
+                    rofg0 = rofg
+                cofm = check_output(['allosmod', 'getcofm', 'random.ini'],
+                                    cwd=olddir,
+                                    universal_newlines=True).split()
+                direction, steps = get_lattice_position(n)
+                dist = Decimal('1.3') * (rofg0 + rofg)
+                offset = [str(-Decimal(x) + d * steps * dist)
+                          for x, d in zip(cofm, direction)]
+                out = check_output(['allosmod', 'translatepdb', '--',
+                                    'random.ini'] + offset, cwd=olddir,
+                                   universal_newlines=True)
+                with open(os.path.join(olddir, pdb), 'w') as fh:
+                    fh.write(out)
+            place_pdbs([os.path.join(newdir, pdb) for pdb in pdbs], angles)
+            for pdb in pdbs:
+                with open(os.path.join(olddir, pdb)) as fh:
+                    old = fh.read()
+                with open(os.path.join(newdir, pdb)) as fh:
+                    self.assertEqual(fh.read(), old)
+
+    def test_write_ligand_center(self):
+        """Test get_ligand_center() and write_ligand_center()"""
+        import io
+        from allosmod.placepdbs import get_ligand_center, write_ligand_center
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            with open(fname, 'w') as fh:
+                fh.write(test_pdb)
+            fh = io.StringIO()
+            write_ligand_center(get_ligand_center(fname), fh)
+            self.assertEqual(
+                fh.getvalue(),
+                "ATOM      1  XX  ALA A   1       2.214   1.733   1.067"
+                "  1.00 99.99           C\n")
+
+    def test_simple(self):
+        """Simple complete run of placepdbs"""
+        with utils.temporary_directory() as tmpdir:
+            pdbs = setup_pdbs(tmpdir)
+            check_output(['allosmod', 'placepdbs', '--seed', '42', 'list',
+                          's0.pdb'], cwd=tmpdir)
+            with open(os.path.join(tmpdir, 'lig.pdb')) as fh:
+                lig = fh.read()
+            # The first structure is centered on the origin
+            self.assertEqual(len(lig.split('\n')), 2)
+            for coord in (lig[30:38], lig[38:46], lig[46:54]):
+                self.assertAlmostEqual(float(coord), 0., delta=0.01)
+            with open(os.path.join(tmpdir, pdbs[2])) as fh:
+                for line in fh:
+                    self.assertTrue(line.startswith(('ATOM', 'HETATM')))
+
+    def test_ligand_output_same_as_input(self):
+        """Test placepdbs writing the ligand center over the ligand file"""
+        with utils.temporary_directory() as tmpdir:
+            setup_pdbs(tmpdir)
+            check_output(['allosmod', 'placepdbs', '--seed', '42',
+                          '--ligand-output', 's1.pdb', 'list', 's1.pdb'],
+                         cwd=tmpdir)
+            with open(os.path.join(tmpdir, 's1.pdb')) as fh:
+                lig = fh.read()
+            self.assertEqual(len(lig.split('\n')), 2)
+            self.assertTrue(lig.startswith('ATOM      1  XX  ALA A   1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
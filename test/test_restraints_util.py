@@ -0,0 +1,302 @@
+import unittest
+import os
+from io import StringIO
+import utils
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+utils.set_search_paths(TOPDIR)
+
+import allosmod.util.restraints  # noqa: E402
+from allosmod.util.restraints import RestraintStore  # noqa: E402
+
+TEST_RESTRAINTS = """MODELLER5 VERSION: MODELLER FORMAT
+R    3   1   9  12   2   2   1     3     2      10.0000   20.0000
+R    4   2   9  12   2   6   1     3     2       0.8000    0.2000   10.0000   20.0000   30.0000   40.0000
+R    9   2   3  13   4   3   2   4     1     2     3     4     x y z
+R   10  22   1   9   3   2   1     5     6     7      -1.0000    2.0000
+
+R    3   1   1   9   2   2   0     1     2       1.5380    0.0364
+"""  # noqa: E501
+
+
+class Tests(unittest.TestCase):
+    def test_read(self):
+        """Test RestraintStore.read()"""
+        s = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        self.assertEqual(len(s), 5)
+        self.assertEqual(list(s.form), [3, 4, 9, 10, 3])
+        self.assertEqual(list(s.modal), [1, 2, 2, 22, 1])
+        self.assertEqual(list(s.feat), [9, 9, 3, 1, 1])
+        self.assertEqual(list(s.group), [12, 12, 13, 9, 9])
+        self.assertEqual(list(s.natom), [2, 2, 4, 3, 2])
+        self.assertEqual(list(s.nparam), [2, 6, 3, 2, 2])
+        self.assertEqual(list(s.nfeat), [1, 1, 2, 1, 0])
+        self.assertEqual(list(s.get_atoms(0)), [3, 2])
+        self.assertEqual(list(s.get_atoms(2)), [1, 2, 3, 4])
+        self.assertEqual(list(s.get_atoms(4)), [1, 2])
+        # Extra feature types for multi-feature restraints
+        self.assertEqual(list(s.feats), [4])
+        self.assertEqual(list(s.feats_start), [0, 0, 0, 1, 1, 1])
+        self.assertEqual(s.get_parameters(0), [10.0, 20.0])
+        self.assertEqual(s.get_parameters(1), [0.8, 0.2, 10.0, 20.0,
+                                               30.0, 40.0])
+        # Binormal and spline parameters are kept as-is
+        self.assertEqual(s.get_parameters(2), ['x', 'y', 'z'])
+        self.assertEqual(s.get_parameters(3), ['-1.0000', '2.0000'])
+        self.assertEqual(len(s.params), 10)
+
+    def test_read_chunked(self):
+        """Test RestraintStore.read() in multiple chunks"""
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        s = RestraintStore.read(StringIO(TEST_RESTRAINTS), chunk_size=2)
+        self.assertEqual(len(s), 5)
+        for name, col in full.get_columns().items():
+            self.assertEqual(list(getattr(s, name)), list(col))
+        self.assertEqual(list(s.get_atoms(3)), [5, 6, 7])
+        self.assertEqual(s.get_parameters(3), ['-1.0000', '2.0000'])
+        self.assertEqual(s.get_parameters(4), [1.538, 0.0364])
+
+    def test_read_empty(self):
+        """Test RestraintStore.read() of a file with no restraints"""
+        s = RestraintStore.read(StringIO("MODELLER5 VERSION\n\n"))
+        self.assertEqual(len(s), 0)
+        self.assertEqual(list(s.atoms_start), [0])
+
+    def test_read_non_numeric(self):
+        """Test RestraintStore.read() of non-numeric parameters"""
+        s = RestraintStore.from_lines(["R 3 1 9 12 2 2 1 3 2 10.00 20.00",
+                                       "R 3 1 9 12 2 2 1 3 2 a 20.00"])
+        self.assertEqual(s.get_parameters(0), [10.0, 20.0])
+        self.assertEqual(s.get_parameters(1), ['a', '20.00'])
+
+    def test_read_bad(self):
+        """Test RestraintStore.read() of invalid restraints"""
+        self.assertRaises(ValueError, RestraintStore.from_lines,
+                          ["R 3 1 9 12"])
+        self.assertRaises(ValueError, RestraintStore.from_lines,
+                          ["R 3 1 9 12 4 2 1 3 2"])
+
+    def test_iter_read(self):
+        """Test RestraintStore.iter_read()"""
+        stores = list(RestraintStore.iter_read(StringIO(TEST_RESTRAINTS),
+                                               chunk_size=100))
+        self.assertGreater(len(stores), 1)
+        self.assertEqual(sum(len(s) for s in stores), 5)
+
+    def test_read_range(self):
+        """Test RestraintStore.read_range()"""
+        from io import BytesIO
+        from allosmod.util.restraints import split_range
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        data = TEST_RESTRAINTS.encode('latin-1')
+        for nrange in (1, 2, 5, 40, len(data)):
+            ranges = split_range(len(data), nrange)
+            self.assertEqual(len(ranges), nrange)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            stores = [RestraintStore.read_range(BytesIO(data), start, end)
+                      for start, end in ranges]
+            s = RestraintStore.concatenate(stores)
+            for name, col in full.get_columns().items():
+                self.assertEqual(list(getattr(s, name)), list(col))
+
+    def test_take(self):
+        """Test RestraintStore.take()"""
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        s = full.take([4, 2, 3])
+        self.assertEqual(len(s), 3)
+        self.assertEqual(list(s.form), [3, 9, 10])
+        self.assertEqual(list(s.get_atoms(0)), [1, 2])
+        self.assertEqual(list(s.get_atoms(1)), [1, 2, 3, 4])
+        self.assertEqual(s.get_parameters(0), [1.538, 0.0364])
+        self.assertEqual(s.get_parameters(1), ['x', 'y', 'z'])
+        self.assertEqual(list(s.feats), [4])
+        self.assertEqual(len(full.take([])), 0)
+        self.assertGreater(full.nbytes, s.nbytes)
+
+    def test_slice(self):
+        """Test RestraintStore.slice()"""
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        s = full.slice(2, 4)
+        self.assertEqual(list(s.form), [9, 10])
+        self.assertEqual(list(s.get_atoms(1)), [5, 6, 7])
+        self.assertEqual(s.get_parameters(0), ['x', 'y', 'z'])
+        self.assertEqual(len(full.slice(4, 10)), 1)
+        self.assertEqual(len(full.slice(8, 10)), 0)
+
+    def test_write(self):
+        """Test RestraintStore.write()"""
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        fh = StringIO()
+        full.write(fh)
+        s = RestraintStore.read(StringIO(fh.getvalue()))
+        for name, col in full.get_columns().items():
+            self.assertEqual(list(getattr(s, name)), list(col))
+
+    def test_cache(self):
+        """Test reading and writing binary caches"""
+        from allosmod.util.restraints import is_cache_file
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.rsr')
+            cache = fname + '.rsrcache'
+            with open(fname, 'w') as fh:
+                fh.write(TEST_RESTRAINTS)
+            full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+            # No cache written if not requested
+            RestraintStore.read_file(fname, cache=False)
+            self.assertFalse(os.path.exists(cache))
+            self.assertIsNone(RestraintStore.load_cache_for(fname))
+            s = RestraintStore.read_file(fname)
+            self.assertTrue(is_cache_file(cache))
+            self.assertFalse(is_cache_file(fname))
+            s = RestraintStore.load_cache_for(fname)
+            self.assertIsNotNone(s)
+            for name, col in full.get_columns().items():
+                self.assertEqual(list(getattr(s, name)), list(col))
+            # Cache can be read directly
+            s = RestraintStore.read_file(cache)
+            self.assertEqual(s.get_parameters(3), ['-1.0000', '2.0000'])
+            # Same contents but new mtime; cache is still valid
+            st = os.stat(fname)
+            os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            self.assertIsNotNone(RestraintStore.load_cache_for(fname))
+            # Same size, different contents; cache is stale
+            with open(fname, 'w') as fh:
+                fh.write(TEST_RESTRAINTS.replace('10.0000', '11.0000'))
+            os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+            self.assertIsNone(RestraintStore.load_cache_for(fname))
+            s = RestraintStore.read_file(fname)
+            self.assertEqual(s.get_parameters(0), [11.0, 20.0])
+            self.assertEqual(
+                RestraintStore.load_cache_for(fname).get_parameters(0),
+                [11.0, 20.0])
+            # Corrupt cache is ignored
+            with open(cache, 'wb') as fh:
+                fh.write(b'garbage')
+            self.assertIsNone(RestraintStore.load_cache_for(fname))
+            self.assertRaises(ValueError, RestraintStore.load, cache)
+            self.assertEqual(len(RestraintStore.read_file(fname)), 5)
+            self.assertEqual([f for f in os.listdir(tmpdir)
+                              if f not in ('test.rsr', 'test.rsr.rsrcache')],
+                             [])
+
+    def test_cache_writer(self):
+        """Test building a binary cache one store at a time"""
+        from io import BytesIO
+        from allosmod.util.restraints import CacheWriter
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        stores = [full.slice(0, 2), RestraintStore.read(StringIO("")),
+                  full.slice(2, 3), full.slice(3, 5)]
+        expected = BytesIO()
+        RestraintStore.concatenate(stores).save(expected)
+        with CacheWriter() as w:
+            for s in stores:
+                w.append(s)
+            fh = BytesIO()
+            w.save(fh)
+        self.assertEqual(fh.getvalue(), expected.getvalue())
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.rsr')
+            with open(fname, 'w') as fh:
+                fh.write(TEST_RESTRAINTS)
+            st = os.stat(fname)
+            with CacheWriter(dir=tmpdir) as w:
+                for s in stores:
+                    w.append(s)
+                w.write_cache_for(fname, st,
+                                  allosmod.util.restraints.get_file_hash(
+                                      fname))
+            s = RestraintStore.load_cache_for(fname)
+            for name, col in full.get_columns().items():
+                self.assertEqual(list(getattr(s, name)), list(col))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['test.rsr', 'test.rsr.rsrcache'])
+            # With no recorded hash, the cache is stale if the mtime changes
+            with CacheWriter() as w:
+                w.write_cache_for(fname, st, None)
+            self.assertIsNotNone(RestraintStore.load_cache_for(fname))
+            os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            self.assertIsNone(RestraintStore.load_cache_for(fname))
+
+    def test_text_restraints_file(self):
+        """Test text_restraints_file()"""
+        from allosmod.util.restraints import text_restraints_file
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.rsr')
+            with open(fname, 'w') as fh:
+                fh.write(TEST_RESTRAINTS)
+            with text_restraints_file(fname) as f:
+                self.assertEqual(f, fname)
+            RestraintStore.read_file(fname)
+            with text_restraints_file(fname + '.rsrcache') as f:
+                self.assertNotEqual(f, fname)
+                s = RestraintStore.read_file(f, cache=False)
+            self.assertFalse(os.path.exists(f))
+            self.assertEqual(len(s), 5)
+
+    def test_buffer(self):
+        """Test RestraintBuffer"""
+        import numpy as np
+        from allosmod.util.restraints import RestraintBuffer
+        full = RestraintStore.read(StringIO(TEST_RESTRAINTS))
+        for max_size, spilled in ((1 << 20, False), (0, True)):
+            with RestraintBuffer(max_size=max_size) as buf:
+                buf.append(full.take([0, 1]), codes=np.array([4, 5]))
+                buf.append(full.take([]), codes=np.array([], dtype=int))
+                buf.append(full.take([2, 3, 4]), codes=np.array([1, 2, 3]))
+                self.assertEqual(buf.spilled, spilled)
+                self.assertEqual(len(buf), 3)
+                chunks = list(buf)
+            self.assertEqual([len(s) for s, data in chunks], [2, 0, 3])
+            self.assertEqual([list(data['codes']) for s, data in chunks],
+                             [[4, 5], [], [1, 2, 3]])
+            s = chunks[2][0]
+            self.assertEqual(list(s.form), [9, 10, 3])
+            self.assertEqual(s.get_parameters(1), ['-1.0000', '2.0000'])
+            self.assertEqual(s.get_parameters(2), [1.538, 0.0364])
+            self.assertEqual(list(s.get_atoms(0)), [1, 2, 3, 4])
+
+    def test_line_buffer(self):
+        """Test LineBuffer"""
+        import numpy as np
+        from allosmod.util.restraints import LineBuffer
+        rng = np.random.RandomState(42)
+        table = np.column_stack(
+            (rng.randint(-999, 9999, 1000), rng.uniform(-1e4, 1e4, 1000),
+             rng.normal(0., 1., 1000), (rng.randint(-5000, 5000, 1000)
+                                        + 0.5) / 1e4))
+        # Include values that need to be handled by Python
+        table[:12, 1] = [0., -0., 1e10, -1e10, np.nan, np.inf, -np.inf,
+                         9999.99995, -9999.99995, 0.03125, 2.5e-5, -5e-5]
+        table[12, 0] = 1e10
+        fmt = 'R %4d %9.4f%8.3f %5.0f   %3.1f\n'
+        keys = rng.randint(0, 100, 1000)
+        b = LineBuffer()
+        b.add_rows(keys[:500], fmt, table[:500, :2], table[:500, 2:],
+                   table[:500, 3])
+        b.add_lines([50, 150], ['foo\n', 'bar\n'])
+        b.add_rows([], fmt, np.zeros((0, 5)))
+        b.add_rows(keys[500:], fmt, table[500:, :2], table[500:, 2:],
+                   table[500:, 3])
+        self.assertEqual(len(b), 1002)
+        lines = [fmt % (r[0], r[1], r[2], r[3], r[3])
+                 for r in table.tolist()]
+        lines[500:500] = ['foo\n', 'bar\n']
+        keys = list(keys[:500]) + [50, 150] + list(keys[500:])
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        self.assertEqual(b.getvalue(), ''.join(lines[i] for i in order))
+        self.assertEqual(LineBuffer().getvalue(), '')
+        self.assertRaises(ValueError, b.add_rows, [1], '%4d %s\n',
+                          [[1, 2]])
+        self.assertRaises(ValueError, b.add_rows, [1], '%4d\n', [[1, 2]])
+
+    def test_ragged_index(self):
+        """Test ragged_index()"""
+        import numpy as np
+        ind, offsets = allosmod.util.restraints.ragged_index(
+            np.array([10, 20, 30]), np.array([2, 0, 3]))
+        self.assertEqual(list(ind), [10, 11, 30, 31, 32])
+        self.assertEqual(list(offsets), [0, 2, 2, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
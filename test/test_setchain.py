@@ -42,6 +42,23 @@ class Tests(unittest.TestCase):
                 lines = out.split('\n')
                 self.assertEqual(lines[2][17:25], 'CYS X   ')
 
+    def test_multiple(self):
+        """Test setchain on multiple files"""
+        with utils.temporary_directory() as tmpdir:
+            fnames = ['test%d.pdb' % i for i in range(4)]
+            for fname in fnames:
+                with open(os.path.join(tmpdir, fname), 'w') as fh:
+                    fh.write(test_pdb)
+            check_output(['allosmod', 'setchain', '--in-place', '--jobs', '2']
+                         + fnames + ['X'], cwd=tmpdir)
+            for fname in fnames:
+                with open(os.path.join(tmpdir, fname)) as fh:
+                    lines = fh.readlines()
+                self.assertEqual(lines[0], test_pdb.split('\n')[0] + '\n')
+                for line in lines[1:]:
+                    self.assertEqual(line[21], 'X')
+            self.assertEqual(sorted(os.listdir(tmpdir)), fnames)
+
 
 if __name__ == '__main__':
     unittest.main()
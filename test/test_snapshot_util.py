@@ -0,0 +1,148 @@
+import unittest
+import os
+import utils
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+test_dir = utils.set_search_paths(TOPDIR)
+
+from allosmod.util.snapshot import ModelSnapshot  # noqa: E402
+from allosmod.util.snapshot import UnsupportedPDBError  # noqa: E402
+from allosmod.util.snapshot import get_model_snapshot  # noqa: E402
+from allosmod.util.snapshot import read_ca_p_coordinates  # noqa: E402
+
+TEST_PDB = """EXPDTA    THEORETICAL MODEL
+ATOM      1  N   ALA A   1      10.000  11.000  12.000  1.00  0.00           N
+ATOM      2  CA  ALA A   1      13.000  14.000  15.000  1.00  0.00           C
+ATOM      3  CA  GLY A   1A      1.000   2.000   3.000  1.00  0.00           C
+TER
+HETATM    4  O   HOH A   2       1.000   2.000   3.000  1.00  0.00           O
+ATOM      5  P    DU B   1       4.000   5.000   6.000  1.00  0.00           P
+HETATM    6 ZN    ZN B   2       7.000   8.000   9.000  1.00  0.00          ZN
+END
+ATOM      7  CA  ALA A   9       1.000   2.000   3.000  1.00  0.00           C
+"""
+
+
+class Tests(unittest.TestCase):
+    def test_read(self):
+        """Test ModelSnapshot.read()"""
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            with open(fname, 'w') as fh:
+                fh.write(TEST_PDB)
+            s = ModelSnapshot.read(fname)
+            self.assertEqual(len(s), 5)
+            self.assertEqual(list(s.atom_name), ['N', 'CA', 'CA', 'P', 'ZN'])
+            self.assertEqual(list(s.atom_residue), [0, 0, 1, 2, 3])
+            self.assertEqual(list(s.residue_name), ['ALA', 'GLY', 'DU', 'ZN'])
+            self.assertEqual(list(s.residue_num), ['1', '1A', '1', '2'])
+            self.assertEqual(list(s.residue_chain), ['A', 'A', 'B', 'B'])
+            self.assertEqual(list(s.residue_hetatm),
+                             [False, False, False, True])
+            self.assertEqual(s.coord[1].tolist(), [13., 14., 15.])
+            a = s.atoms[4]
+            self.assertEqual((a.index, a.name), (5, 'ZN'))
+            self.assertEqual((a.residue.index, a.residue.pdb_name,
+                              a.residue.num, a.residue.chain.name,
+                              a.residue.hetatm), (4, 'ZN', '2', 'B', True))
+            self.assertIs(s.residues[2].chain, a.residue.chain)
+
+            s = ModelSnapshot.read(fname, hetatm=False, water=True)
+            self.assertEqual(list(s.residue_name),
+                             ['ALA', 'GLY', 'HOH', 'DU'])
+
+    def test_read_unsupported(self):
+        """Test ModelSnapshot.read() with unsupported files"""
+        atom = ("ATOM      1  CA  ALA A   1      10.000  11.000  12.000"
+                "  1.00  0.00           C\n")
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            for contents in ("MODEL        1\n" + atom,
+                             atom[:16] + 'A' + atom[17:],
+                             atom[:17] + 'MSE' + atom[20:],
+                             'HETATM' + atom[6:13] + 'HG' + atom[15:76]
+                             + '\n'):
+                with open(fname, 'w') as fh:
+                    fh.write(contents)
+                self.assertRaises(UnsupportedPDBError, ModelSnapshot.read,
+                                  fname)
+            # Hydrogens with an element, or in ATOM records, are skipped
+            for contents in (atom[:13] + 'H ' + atom[15:77] + 'H\n',
+                             atom[:13] + 'HA' + atom[15:76] + '\n',
+                             'HETATM' + atom[6:13] + 'HG' + atom[15:77]
+                             + 'H\n'):
+                with open(fname, 'w') as fh:
+                    fh.write(contents + atom)
+                s = ModelSnapshot.read(fname)
+                self.assertEqual(list(s.atom_name), ['CA'])
+
+    def test_modeller_parity(self):
+        """Check that ModelSnapshot matches Modeller's atom ordering"""
+        import modeller
+        env = modeller.Environ()
+        env.io.hetatm = True
+        for pdb in ('test_editrsr.pdb', 'test_contpres.pdb',
+                    'asite_pdb1.pdb', 'asite_ligand.pdb', 'test_rna.pdb'):
+            fname = os.path.join(test_dir, 'input', pdb)
+            s = ModelSnapshot.read(fname)
+            m = modeller.Model(env, file=fname)
+            self.assertEqual([(a.index, a.name, a.residue.index)
+                              for a in s.atoms],
+                             [(a.index, a.name, a.residue.index)
+                              for a in m.atoms])
+            self.assertEqual([(r.pdb_name, r.num, r.chain.name,
+                               bool(r.hetatm)) for r in s.residues],
+                             [(r.pdb_name, r.num, r.chain.name,
+                               bool(r.hetatm)) for r in m.residues])
+            self.assertEqual(
+                s.coord.tolist(),
+                ModelSnapshot.from_model(m).coord.tolist())
+
+    def test_read_ca_p_coordinates(self):
+        """Test read_ca_p_coordinates()"""
+        import numpy as np
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            with open(fname, 'w') as fh:
+                fh.write(TEST_PDB.replace(' CA  GLY', ' N   GLY'))
+            c = read_ca_p_coordinates(fname)
+            self.assertEqual(c.shape, (3, 3))
+            self.assertEqual(c[0].tolist(), [13., 14., 15.])
+            self.assertTrue(np.all(np.isnan(c[1])))
+            self.assertEqual(c[2].tolist(), [4., 5., 6.])
+
+    def test_read_ca_p_coordinates_parity(self):
+        """Check that read_ca_p_coordinates matches Modeller"""
+        import numpy as np
+        import modeller
+        from allosmod.get_qiavg_ca import get_coordinates
+        from allosmod.get_qiavg_ca import get_coordinate_array
+        env = modeller.Environ()
+        env.io.hetatm = False
+        m = modeller.Model(env)
+        for pdb in ('test_qiavg.pdb', 'test_qiavg_1.pdb', 'asite_pdb1.pdb',
+                    'test_rna.pdb'):
+            fname = os.path.join(test_dir, 'input', pdb)
+            np.testing.assert_array_equal(
+                read_ca_p_coordinates(fname),
+                get_coordinate_array(get_coordinates(m, fname)))
+
+    def test_get_model_snapshot(self):
+        """Test get_model_snapshot()"""
+        import modeller
+        env = modeller.Environ()
+        env.io.hetatm = True
+        with utils.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'test.pdb')
+            with open(fname, 'w') as fh:
+                fh.write("MODEL        1\n"
+                         + TEST_PDB[:TEST_PDB.index('END\n')])
+            # Should fall back to reading with Modeller
+            for e in (env, None):
+                s = get_model_snapshot(e, fname)
+                self.assertEqual(list(s.residue_name),
+                                 ['ALA', 'GLY', 'DU', 'ZN'])
+                self.assertEqual(list(s.atom_residue), [0, 0, 1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -45,6 +45,35 @@ class Tests(unittest.TestCase):
         assert_content("test\nbar\n")
         os.unlink('testnl')
 
+    def test_rewrite_files(self):
+        """Test rewrite_files function"""
+        def upper(lines):
+            if lines[0] == 'bad\n':
+                raise ValueError("bad file")
+            return [line.upper() for line in lines]
+        with utils.temporary_directory() as tmpdir:
+            fnames = [os.path.join(tmpdir, 'test%d' % i) for i in range(5)]
+            for i, fname in enumerate(fnames):
+                with open(fname, 'w') as fh:
+                    fh.write("foo%d\nbar\n" % i)
+            os.chmod(fnames[0], 0o600)
+            for jobs in (1, 3):
+                allosmod.util.rewrite_files(fnames, upper, jobs)
+                for i, fname in enumerate(fnames):
+                    with open(fname) as fh:
+                        self.assertEqual(fh.read(), "FOO%d\nBAR\n" % i)
+                self.assertEqual(os.stat(fnames[0]).st_mode & 0o777, 0o600)
+                # Errors should leave the file (and directory) untouched
+                with open(fnames[2], 'w') as fh:
+                    fh.write("bad\n")
+                self.assertRaises(ValueError, allosmod.util.rewrite_files,
+                                  fnames, upper, jobs)
+                with open(fnames[2]) as fh:
+                    self.assertEqual(fh.read(), "bad\n")
+                with open(fnames[2], 'w') as fh:
+                    fh.write("foo2\nbar\n")
+                self.assertEqual(len(os.listdir(tmpdir)), 5)
+
     def test_sequence(self):
         """Test Sequence class"""
         s = allosmod.util.Sequence()
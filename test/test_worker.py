@@ -0,0 +1,145 @@
+import unittest
+import os
+import sys
+import time
+import subprocess
+import utils
+from utils import check_output
+TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+test_dir = utils.set_search_paths(TOPDIR)
+
+
+test_pdb = """EXPDTA    THEORETICAL MODEL, MODELLER SVN 2015/05/15 09:37:25
+ATOM      1  N   CYS A   1       1.453   2.100   3.200  0.00  0.00           C
+ATOM      2  CA  CYS A   1       1.453   0.000   0.000  0.00  0.00           C
+ATOM      8  CA  MSE A   2       3.735   3.100   0.000  1.00  0.00           C
+HETATM   18  CA  MET A   2     113.735   3.100   0.000  1.00  0.00           C
+"""
+
+
+def wait_for_socket(socket_path, proc):
+    for _ in range(200):
+        if os.path.exists(socket_path) or proc.poll() is not None:
+            return
+        time.sleep(0.05)
+
+
+class Tests(unittest.TestCase):
+    def test_bad(self):
+        """Test wrong arguments to worker"""
+        for args in ([], ['foo', 'bar']):
+            check_output(['allosmod', 'worker'] + args,
+                         stderr=subprocess.STDOUT, retcode=2)
+            check_output([sys.executable, '-m', 'allosmod.worker'] + args,
+                         stderr=subprocess.STDOUT, retcode=2)
+
+    def test_no_worker(self):
+        """Commands should run normally if no worker is running"""
+        with utils.temporary_directory() as tmpdir:
+            with open(os.path.join(tmpdir, 'test.pdb'), 'w') as fh:
+                fh.write(test_pdb)
+            env = dict(os.environ)
+            env['ALLOSMOD_WORKER_SOCKET'] = os.path.join(tmpdir, 'sock')
+            out = check_output(['allosmod', 'getcofm', 'test.pdb'],
+                               cwd=tmpdir, env=env, universal_newlines=True)
+            self.assertEqual(out, '   2.214    1.733    1.067\n')
+
+    def test_worker(self):
+        """Test running commands on a worker"""
+        with utils.temporary_directory() as tmpdir:
+            subdir = os.path.join(tmpdir, 'sub')
+            os.mkdir(subdir)
+            with open(os.path.join(subdir, 'test.pdb'), 'w') as fh:
+                fh.write(test_pdb)
+            socket_path = os.path.join(tmpdir, 'sock')
+            worker = subprocess.Popen(['allosmod', 'worker', '--verbose',
+                                       socket_path], stderr=subprocess.PIPE,
+                                      universal_newlines=True)
+            try:
+                wait_for_socket(socket_path, worker)
+                self.assertEqual(os.stat(socket_path).st_mode & 0o777,
+                                 0o700)
+                env = dict(os.environ)
+                env['ALLOSMOD_WORKER_SOCKET'] = socket_path
+                for args, retcode, stdin in (
+                        (['getcofm', 'test.pdb'], 0, None),
+                        (['getcofm'], 2, None),
+                        (['pdb_fix_res', '/dev/stdin'], 0, test_pdb)):
+                    results = []
+                    for e in (None, env):
+                        p = subprocess.run(['allosmod'] + args, cwd=subdir,
+                                           env=e, input=stdin,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           universal_newlines=True)
+                        self.assertEqual(p.returncode, retcode)
+                        results.append((p.stdout, p.stderr))
+                    self.assertEqual(results[0], results[1])
+            finally:
+                worker.terminate()
+                _, log = worker.communicate()
+            self.assertFalse(os.path.exists(socket_path))
+            self.assertIn('%s: allosmod getcofm test.pdb' % subdir, log)
+            self.assertIn('%s: allosmod pdb_fix_res /dev/stdin' % subdir, log)
+
+    def test_run_on_worker(self):
+        """Test run_on_worker() with a test package"""
+        cmd = """
+import os
+import sys
+
+
+def main():
+    print(sys.argv, os.getcwd(), os.environ['TEST_WORKER_VAR'])
+    print(sys.stdin.read().upper(), file=sys.stderr)
+    if sys.argv[1] == 'crash':
+        os.kill(os.getpid(), 9)
+    sys.exit(3)
+"""
+        client = """
+import sys
+import allosmod.util.worker
+sys.exit(allosmod.util.worker.run_on_worker(sys.argv[1], sys.argv[2:]))
+"""
+        with utils.temporary_directory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, 'testpkg'))
+            for fname, contents in (('__init__.py', ''), ('cmd.py', cmd)):
+                with open(os.path.join(tmpdir, 'testpkg', fname), 'w') as fh:
+                    fh.write(contents)
+            socket_path = os.path.join(tmpdir, 'sock')
+            env = dict(os.environ)
+            env['PYTHONPATH'] = tmpdir + ':' + env['PYTHONPATH']
+            worker = subprocess.Popen(
+                [sys.executable, '-c',
+                 'import allosmod.util.worker as w; '
+                 'w.serve(%r, "testpkg")' % socket_path], env=env)
+            try:
+                wait_for_socket(socket_path, worker)
+                env['TEST_WORKER_VAR'] = 'foo'
+                for arg, retcode in (('ok', 3), ('crash', 137)):
+                    p = subprocess.run([sys.executable, '-c', client,
+                                        socket_path, 'cmd', arg],
+                                       cwd=tmpdir, env=env, input='bar',
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       universal_newlines=True)
+                    self.assertEqual(p.returncode, retcode)
+                    self.assertEqual(p.stdout,
+                                     "['allosmod cmd', '%s'] %s foo\n"
+                                     % (arg, os.path.realpath(tmpdir)))
+                    self.assertEqual(p.stderr, 'BAR\n')
+            finally:
+                worker.terminate()
+                worker.wait()
+
+    def test_idle_timeout(self):
+        """Test worker exit after idle timeout"""
+        with utils.temporary_directory() as tmpdir:
+            socket_path = os.path.join(tmpdir, 'sock')
+            check_output(['allosmod', 'worker', '--idle-timeout', '0.1',
+                          socket_path])
+            self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()